@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   End-to-end HTTP benchmark: PUT, GET and HEAD of objects, listing of buckets
+#
+#   usage: python benchmarks/http_load.py [--target inprocess|gunicorn] [--sizes 1K,64K,1M]
+#          [--concurrency 1,8] [--bucket-sizes 0,100000] [--requests 200] [--output results.json]
+#
+#   The in-process target calls the WSGI application of objectstore.appl directly, the gunicorn
+#   target starts gunicorn on a local port and sends the requests over HTTP with keep-alive
+#   connections. The request bodies are generated on the fly, so the objects up to 1G do not
+#   take memory. The buckets are filled with metadata rows up to the bucket size before the run.
+#
+#   The report is JSON with throughput and p50/p99 latency per operation, see report.py
+#
+
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import httplib
+import argparse
+import tempfile
+import itertools
+import threading
+import subprocess
+
+from cStringIO import StringIO
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_PATH)
+
+import falcon.testing
+
+# the module-level application of objectstore.appl requires an existing storage path,
+# the benchmark creates its own application by create_app()
+os.environ.setdefault('OBJECTSTORE_STORAGE_PATH', tempfile.gettempdir())
+from objectstore import appl
+from objectstore.api import buckets
+
+import report
+
+
+SIZE_UNITS = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30}
+
+# the size of metadata batches written when the bucket is filled
+FILL_BATCH_SIZE = 10000
+
+# the block of random data repeated in request bodies
+PATTERN = os.urandom(2 ** 16)
+
+
+def parse_size(value):
+    ''' returns the number of bytes from the size like 1K, 64K, 1M, 1G
+    '''
+    value = value.strip().upper()
+    if value and value[-1] in SIZE_UNITS:
+        return int(value[:-1]) * SIZE_UNITS[value[-1]]
+    return int(value)
+
+
+def parse_list(value, parse=int):
+
+    return [parse(item) for item in value.split(',') if item.strip()]
+
+
+class BodyStream(object):
+    ''' the request body of `size` bytes, unique per seed, generated on read
+    '''
+    def __init__(self, size, seed):
+
+        self._prefix = ('%016x' % seed)[:size]
+        self._size = size
+        self._position = 0
+
+
+    def read(self, size=-1):
+
+        remaining = self._size - self._position
+        if size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return ''
+        chunks = list()
+        position, end = self._position, self._position + size
+        while position < end:
+            if position < len(self._prefix):
+                chunk = self._prefix[position:end]
+            else:
+                offset = (position - len(self._prefix)) % len(PATTERN)
+                chunk = PATTERN[offset:offset + end - position]
+            chunks.append(chunk)
+            position += len(chunk)
+        self._position = end
+        return ''.join(chunks)
+
+
+class InProcessClient(object):
+    ''' calls the WSGI application in the calling thread
+    '''
+    def __init__(self, application):
+
+        self._application = application
+
+
+    def request(self, method, path, query_string='', body=None, length=0, collect=False):
+        ''' returns (status, number of received bytes, the body if `collect` is True)
+        '''
+        env = falcon.testing.create_environ(path=path, query_string=query_string, method=method)
+        if body is not None:
+            env['wsgi.input'] = body
+            env['CONTENT_LENGTH'] = str(length)
+        status = list()
+        result = self._application(env, lambda s, headers, exc_info=None: status.append(s))
+        received, chunks = 0, list()
+        try:
+            for chunk in result:
+                received += len(chunk)
+                if collect:
+                    chunks.append(chunk)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        return int(status[0].split(' ', 1)[0]), received, ''.join(chunks)
+
+
+class HttpClient(object):
+    ''' sends the requests over keep-alive connection per thread
+    '''
+    def __init__(self, host, port):
+
+        self._host = host
+        self._port = port
+        self._local = threading.local()
+
+
+    def request(self, method, path, query_string='', body=None, length=0, collect=False):
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = httplib.HTTPConnection(self._host, self._port)
+        url = path + ('?' + query_string if query_string else '')
+        try:
+            conn.request(method, url, body=body, headers={'Content-Length': str(length)} if body is not None else {})
+            response = conn.getresponse()
+            received, chunks = 0, list()
+            while True:
+                chunk = response.read(2 ** 16)
+                if not chunk:
+                    break
+                received += len(chunk)
+                if collect:
+                    chunks.append(chunk)
+            return response.status, received, ''.join(chunks)
+        except (httplib.HTTPException, socket.error):
+            conn.close()
+            self._local.conn = None
+            raise
+
+
+class GunicornServer(object):
+    ''' gunicorn serving objectstore.appl on a local port
+    '''
+    def __init__(self, storage_path, workers=4, worker_class='sync', port=None):
+
+        self.host = '127.0.0.1'
+        self.port = port or self._free_port()
+        self._command = [
+            sys.executable, '-c', 'import sys; from gunicorn.app.wsgiapp import run; sys.argv[0] = "gunicorn"; run()',
+            '-b', '%s:%d' % (self.host, self.port), '-w', str(workers), '-k', worker_class,
+            '--log-level', 'warning', 'objectstore.appl',
+        ]
+        self._env = dict(os.environ, OBJECTSTORE_STORAGE_PATH=storage_path, PYTHONPATH=ROOT_PATH)
+        self._process = None
+
+
+    def _free_port(self):
+
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+
+    def __enter__(self):
+
+        self._process = subprocess.Popen(self._command, env=self._env, cwd=ROOT_PATH)
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            if self._process.poll() is not None:
+                raise RuntimeError('gunicorn exited with code %d' % self._process.returncode)
+            try:
+                socket.create_connection((self.host, self.port), timeout=1).close()
+                return self
+            except socket.error:
+                time.sleep(0.1)
+        self.__exit__()
+        raise RuntimeError('gunicorn did not start in 30 seconds')
+
+
+    def __exit__(self, *exc_info):
+
+        if self._process and self._process.poll() is None:
+            self._process.terminate()
+            self._process.wait()
+
+
+def fill_bucket(storage_path, bucket_name, bucket_size):
+    ''' creates the bucket with `bucket_size` metadata rows, the rows have no object files
+    '''
+    bucket = buckets.Bucket(bucket_name, storage_path=storage_path)
+    bucket.create()
+    objects = bucket.objects_metadata()
+    for start in range(0, bucket_size, FILL_BATCH_SIZE):
+        objects.update(
+            ('%040x' % i, {'content-length': 1, 'content-name': 'fill-%d' % i, 'created': 0})
+            for i in range(start, min(start + FILL_BATCH_SIZE, bucket_size))
+        )
+    return bucket
+
+
+def run_operation(operation, requests, concurrency):
+    ''' runs `requests` calls of `operation(index)` by `concurrency` threads, the operation returns
+    (ok, transferred bytes). Returns (latencies, errors, transferred bytes, elapsed seconds)
+    '''
+    counter = itertools.count()
+    latencies, results = list(), list()
+
+    def worker():
+        local_latencies, errors, transferred = list(), 0, 0
+        while True:
+            index = next(counter)
+            if index >= requests:
+                break
+            started = time.time()
+            try:
+                ok, size = operation(index)
+            except Exception:
+                ok, size = False, 0
+            local_latencies.append(time.time() - started)
+            errors += 0 if ok else 1
+            transferred += size
+        latencies.extend(local_latencies)
+        results.append((errors, transferred))
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - started
+    return latencies, sum(r[0] for r in results), sum(r[1] for r in results), elapsed
+
+
+def benchmark_bucket(client, bucket_name, sizes, concurrency_levels, requests, seeds):
+    ''' yields the results of PUT, GET, HEAD per object size and concurrency, and of listing
+    '''
+    bucket_path = '/bucket/%s' % bucket_name
+    for size in sizes:
+        for concurrency in concurrency_levels:
+            object_ids = [None] * requests
+
+            def put(index):
+                status, _, body = client.request(
+                    'PUT', '%s/object/object-%d' % (bucket_path, index),
+                    body=BodyStream(size, next(seeds)), length=size, collect=True
+                )
+                if status == 200:
+                    object_ids[index] = json.loads(body)['content-sha1']
+                return status == 200, size
+
+            def get(index):
+                status, received, _ = client.request('GET', '%s/object/%s' % (bucket_path, object_ids[index]))
+                return status == 200 and received == size, received
+
+            def head(index):
+                status, _, _ = client.request('HEAD', '%s/object/%s' % (bucket_path, object_ids[index]))
+                return status == 200, 0
+
+            for name, operation in (('PUT', put), ('GET', get), ('HEAD', head)):
+                latencies, errors, transferred, elapsed = run_operation(operation, requests, concurrency)
+                result = {'name': name, 'object_size': size, 'concurrency': concurrency, 'errors': errors}
+                result.update(report.summarize(latencies, elapsed, transferred))
+                yield result
+
+            # the objects are removed, so the bucket size is kept for the next run
+            stored = [object_id for object_id in object_ids if object_id]
+            for start in range(0, len(stored), buckets.MAX_DELETE_KEYS):
+                body = json.dumps({'objects': stored[start:start + buckets.MAX_DELETE_KEYS]})
+                client.request('POST', bucket_path, query_string='delete', body=StringIO(body), length=len(body))
+
+    for concurrency in concurrency_levels:
+
+        def list_objects(index):
+            status, received, _ = client.request('GET', bucket_path, query_string='max-keys=1000')
+            return status == 200, received
+
+        latencies, errors, transferred, elapsed = run_operation(list_objects, requests, concurrency)
+        result = {'name': 'LIST', 'object_size': 0, 'concurrency': concurrency, 'errors': errors}
+        result.update(report.summarize(latencies, elapsed, transferred))
+        yield result
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='End-to-end HTTP benchmark of objectstore')
+    parser.add_argument('--target', choices=('inprocess', 'gunicorn'), default='inprocess')
+    parser.add_argument('--sizes', default='1K,64K,1M', help='object sizes, up to 1G, default: %(default)s')
+    parser.add_argument('--concurrency', default='1,8', help='concurrency levels, default: %(default)s')
+    parser.add_argument('--bucket-sizes', default='0,10000', help='objects in the bucket, default: %(default)s')
+    parser.add_argument('--requests', type=int, default=200, help='requests per run, default: %(default)s')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers, default: %(default)s')
+    parser.add_argument('--worker-class', default='sync', help='gunicorn worker class, default: %(default)s')
+    parser.add_argument('--output', default=None, help='the path to the JSON report, default: stdout')
+    args = parser.parse_args(argv)
+
+    sizes = parse_list(args.sizes, parse_size)
+    concurrency_levels = parse_list(args.concurrency)
+    bucket_sizes = parse_list(args.bucket_sizes)
+    seeds = itertools.count(int(time.time() * 1000))
+
+    storage_path = tempfile.mkdtemp()
+    try:
+        for bucket_size in bucket_sizes:
+            fill_bucket(storage_path, 'bench-%d' % bucket_size, bucket_size)
+
+        server = None
+        if args.target == 'gunicorn':
+            server = GunicornServer(storage_path, workers=args.workers, worker_class=args.worker_class)
+            server.__enter__()
+            client = HttpClient(server.host, server.port)
+        else:
+            client = InProcessClient(appl.create_app(storage_path))
+
+        results = list()
+        try:
+            for bucket_size in bucket_sizes:
+                bucket_name = 'bench-%d' % bucket_size
+                for result in benchmark_bucket(client, bucket_name, sizes, concurrency_levels, args.requests, seeds):
+                    result.update({'target': args.target, 'bucket_size': bucket_size})
+                    results.append(result)
+                    sys.stderr.write('%(name)5s size=%(object_size)d c=%(concurrency)d bucket=%(bucket_size)d '
+                                     'ops=%(throughput_ops).1f p50=%(p50_ms)sms p99=%(p99_ms)sms\n' % result)
+        finally:
+            if server is not None:
+                server.__exit__()
+
+        report.write(args.output, report.meta(benchmark='http_load', target=args.target), results)
+    finally:
+        shutil.rmtree(storage_path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#
+#   The results of benchmarks as JSON
+#
+#   {"meta": {...}, "results": [{"name": ..., <parameters>, <measurements>}, ...]}
+#
+#   Two reports are compared by the results with the same parameters:
+#
+#   usage: python benchmarks/report.py baseline.json current.json [--threshold 0.1]
+#
+#   The measurements worse than the baseline by more than the threshold are printed,
+#   the exit code is 1 if there are such regressions.
+#
+
+import sys
+import json
+import argparse
+import time
+import socket
+import platform
+
+
+# measurement: True if the higher value is better
+MEASUREMENTS = {
+    'throughput_ops': True,
+    'throughput_mbps': True,
+    'p50_ms': False,
+    'p99_ms': False,
+    'us_per_op': False,
+}
+
+# the fields of results which are neither parameters nor compared measurements
+COUNTERS = ('requests', 'ops', 'seconds', 'errors')
+
+DEFAULT_THRESHOLD = 0.1
+
+
+def percentile(values, fraction):
+    ''' returns the nearest-rank percentile of the values, None if there are no values
+    '''
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = int(round(fraction * len(ordered) + 0.5)) - 1
+    return ordered[min(max(rank, 0), len(ordered) - 1)]
+
+
+def summarize(latencies, elapsed, transferred=0):
+    ''' returns the measurements of the run: throughput and latency percentiles, in ms
+    '''
+    elapsed = max(elapsed, 1e-9)
+    return {
+        'requests': len(latencies),
+        'seconds': round(elapsed, 6),
+        'throughput_ops': round(len(latencies) / elapsed, 3),
+        'throughput_mbps': round(transferred / elapsed / 2 ** 20, 3),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+    }
+
+
+def meta(**kwargs):
+    ''' returns the description of the environment of the run
+    '''
+    info = {
+        'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'host': socket.gethostname(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'argv': sys.argv[1:],
+    }
+    info.update(kwargs)
+    return info
+
+
+def write(path, info, results):
+    ''' writes the report to the path, to stdout if the path is None or `-`
+    '''
+    report = json.dumps({'meta': info, 'results': results}, indent=2, sort_keys=True)
+    if path in (None, '-'):
+        print report
+    else:
+        with open(path, 'w') as _file:
+            _file.write(report + '\n')
+
+
+def read(path):
+
+    with open(path) as _file:
+        return json.load(_file)
+
+
+def result_key(result):
+    ''' returns the parameters of the result: the fields except measurements and counters
+    '''
+    return tuple(sorted(
+        (name, value) for name, value in result.items() if name not in MEASUREMENTS and name not in COUNTERS
+    ))
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    ''' returns the list of regressions: the measurements of current results worse than
+    of baseline results with the same parameters by more than the threshold, a fraction
+    '''
+    baseline_results = dict((result_key(result), result) for result in baseline['results'])
+    regressions = list()
+    for result in current['results']:
+        base = baseline_results.get(result_key(result))
+        if base is None:
+            continue
+        for measurement, higher_is_better in sorted(MEASUREMENTS.items()):
+            before, after = base.get(measurement), result.get(measurement)
+            # the measurements close to zero are noise, e.g. throughput_mbps of HEAD
+            if not before or after is None:
+                continue
+            change = (after - before) / float(before)
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append({
+                    'parameters': dict(result_key(result)),
+                    'measurement': measurement,
+                    'baseline': before,
+                    'current': after,
+                    'change': round(change, 4),
+                })
+    return regressions
+
+
+def print_regressions(regressions):
+
+    for regression in regressions:
+        parameters = ' '.join('%s=%s' % item for item in sorted(regression['parameters'].items()))
+        print '%s: %s %s -> %s (%+.1f%%)' % (
+            parameters, regression['measurement'], regression['baseline'], regression['current'],
+            regression['change'] * 100
+        )
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Compares two benchmark reports')
+    parser.add_argument('baseline', help='the path to the baseline report')
+    parser.add_argument('current', help='the path to the current report')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='the change treated as regression, a fraction, default: %(default)s')
+    args = parser.parse_args(argv)
+
+    regressions = compare(read(args.baseline), read(args.current), args.threshold)
+    print_regressions(regressions)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+
+    sys.exit(main())
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   SqliteDict lookups/sec under concurrent reader threads, per backend
+#
+#   usage: python benchmarks/sqlitedict_readers.py [rows] [seconds]
+#
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from objectstore.api.sqlitedict import SqliteDict
+
+
+THREADS = (1, 2, 4, 8)
+
+
+def reader(operation, keys, deadline, counts):
+
+    count = 0
+    while time.time() < deadline:
+        for key in random.sample(keys, 100):
+            operation(key)
+        count += 100
+    counts.append(count)
+
+
+def run(operation, keys, threads, duration):
+    ''' returns lookups/sec for `threads` readers running `operation` for `duration` seconds
+    '''
+    counts = []
+    deadline = time.time() + duration
+    workers = [threading.Thread(target=reader, args=(operation, keys, deadline, counts)) for _ in range(threads)]
+    started = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sum(counts) / (time.time() - started)
+
+
+def main(rows, duration):
+
+    path = tempfile.mkdtemp()
+    try:
+        print '%12s %12s %8s %14s' % ('backend', 'operation', 'threads', 'lookups/sec')
+        for backend in ('multithread', 'direct'):
+            filename = os.path.join(path, '%s.sqlite' % backend)
+            with SqliteDict(filename, 'objects', autocommit=True, backend=backend) as sqlite_dict:
+                keys = ['%040x' % random.getrandbits(160) for _ in range(rows)]
+                sqlite_dict.update(dict((key, {'content-length': 1}) for key in keys))
+                sqlite_dict.commit()
+
+                operations = (
+                    ('contains', sqlite_dict.__contains__),
+                    ('getitem', sqlite_dict.__getitem__),
+                )
+                for name, operation in operations:
+                    for threads in THREADS:
+                        rate = run(operation, keys, threads, duration)
+                        print '%12s %12s %8d %14.0f' % (backend, name, threads, rate)
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+    main(rows, duration)
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   Microbenchmarks of storage primitives: SqliteDict operations per backend and table size,
+#   SqliteMultithread queue overhead per statement, pairtree_path + movefile into new (cold)
+#   and existing (warm) directories, BucketObject.filehash per algorithm
+#
+#   usage: python benchmarks/storage_micro.py [--rows 1000,100000] [--ops 10000] [--output micro.json]
+#          [--baseline previous.json] [--threshold 0.1]
+#
+#   With --baseline the results are compared with the previous report, the slowdowns beyond
+#   the threshold are printed and the exit code is 1. Two saved reports are compared by
+#   `python benchmarks/report.py previous.json micro.json`
+#
+
+import os
+import sys
+import time
+import random
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from objectstore.api import buckets
+from objectstore.api import objects
+from objectstore.api.common import pairtree_path, movefile
+from objectstore.api.sqlitedict import SqliteDict
+
+import report
+
+
+BACKENDS = ('multithread', 'direct')
+
+# the size of batches written when the table is filled
+FILL_BATCH_SIZE = 10000
+
+HASH_ALGORITHMS = (('md5', hashlib.md5), ('sha1', hashlib.sha1), ('sha256', hashlib.sha256))
+
+VALUE = {'content-length': 1024, 'content-type': 'application/octet-stream', 'created': 1445000000}
+
+
+def random_key():
+
+    return '%040x' % random.getrandbits(160)
+
+
+def measure(func, ops, transferred=0):
+    ''' returns the measurements of `func()` doing `ops` operations
+    '''
+    started = time.time()
+    func()
+    elapsed = max(time.time() - started, 1e-9)
+    return {
+        'ops': ops,
+        'seconds': round(elapsed, 6),
+        'throughput_ops': round(ops / elapsed, 3),
+        'throughput_mbps': round(transferred / elapsed / 2 ** 20, 3),
+        'us_per_op': round(elapsed / ops * 10 ** 6, 3),
+    }
+
+
+def fill(sqlite_dict, rows):
+    ''' returns the list of keys of `rows` rows written to the table
+    '''
+    keys = [random_key() for _ in range(rows)]
+    for start in range(0, rows, FILL_BATCH_SIZE):
+        sqlite_dict.update(dict((key, VALUE) for key in keys[start:start + FILL_BATCH_SIZE]))
+    sqlite_dict.commit()
+    return keys
+
+
+def bench_sqlitedict(path, rows_levels, ops):
+    ''' yields the results of get, set, contains, update and keys per backend and table size
+    '''
+    for backend in BACKENDS:
+        for rows in rows_levels:
+            filename = os.path.join(path, '%s-%d.sqlite' % (backend, rows))
+            with SqliteDict(filename, 'objects', autocommit=True, backend=backend) as sqlite_dict:
+                keys = fill(sqlite_dict, rows)
+                sample = [random.choice(keys) for _ in range(ops)]
+                probes = [key if i % 2 else random_key() for i, key in enumerate(sample)]
+                new_keys = [random_key() for _ in range(ops)]
+                update_keys = [random_key() for _ in range(ops)]
+
+                def get():
+                    for key in sample:
+                        sqlite_dict[key]
+
+                def contains():
+                    for key in probes:
+                        key in sqlite_dict
+
+                def set_items():
+                    for key in new_keys:
+                        sqlite_dict[key] = VALUE
+                    sqlite_dict.commit()
+
+                def update():
+                    sqlite_dict.update(dict((key, VALUE) for key in update_keys))
+                    sqlite_dict.commit()
+
+                def keys_scan():
+                    for key in sqlite_dict.keys():
+                        pass
+
+                operations = (
+                    ('get', get, ops), ('contains', contains, ops), ('set', set_items, ops),
+                    ('update', update, ops), ('keys', keys_scan, rows + 2 * ops),
+                )
+                for name, func, count in operations:
+                    result = {'name': 'sqlitedict_%s' % name, 'backend': backend, 'rows': rows}
+                    result.update(measure(func, count))
+                    yield result
+            os.remove(filename)
+
+
+def bench_queue_overhead(path, ops):
+    ''' yields the cost of a trivial statement: by SqliteMultithread queue, by SqliteDirect
+    and by the raw sqlite3 connection
+    '''
+    filename = os.path.join(path, 'queue.sqlite')
+    for backend in BACKENDS:
+        with SqliteDict(filename, 'objects', autocommit=True, backend=backend) as sqlite_dict:
+
+            def select_one():
+                for _ in range(ops):
+                    sqlite_dict.conn.select_one('SELECT 1')
+
+            result = {'name': 'sqlite_select_one', 'via': backend}
+            result.update(measure(select_one, ops))
+            yield result
+
+    conn = sqlite3.connect(filename, isolation_level=None)
+
+    def raw_select_one():
+        for _ in range(ops):
+            conn.execute('SELECT 1').fetchone()
+
+    result = {'name': 'sqlite_select_one', 'via': 'raw'}
+    result.update(measure(raw_select_one, ops))
+    conn.close()
+    yield result
+
+
+def bench_movefile(path, ops):
+    ''' yields the cost of pairtree_path + movefile into new (cold) and existing (warm) directories
+    '''
+    source_path = os.path.join(path, 'sources')
+    os.makedirs(source_path)
+    for mode in ('cold', 'warm'):
+        data_path = os.path.join(path, 'data-%s' % mode)
+        os.makedirs(data_path)
+        moves = list()
+        for i in range(ops):
+            source = os.path.join(source_path, '%s-%d' % (mode, i))
+            with open(source, 'wb') as _file:
+                _file.write('#')
+            moves.append((source, random_key()))
+        if mode == 'warm':
+            for _, filehash in moves:
+                target_dir = os.path.dirname(os.path.join(data_path, pairtree_path(filehash)))
+                if not os.path.isdir(target_dir):
+                    os.makedirs(target_dir)
+
+        def move():
+            for source, filehash in moves:
+                movefile(source, os.path.join(data_path, pairtree_path(filehash)))
+
+        result = {'name': 'pairtree_movefile', 'directories': mode}
+        result.update(measure(move, ops))
+        yield result
+        shutil.rmtree(data_path, ignore_errors=True)
+    shutil.rmtree(source_path, ignore_errors=True)
+
+
+def bench_filehash(path, size):
+    ''' yields the throughput of BucketObject.filehash per algorithm
+    '''
+    bucket = buckets.Bucket('micro', storage_path=path)
+    bucket.create()
+    bucket_object = objects.BucketObject(bucket=bucket)
+    filepath = os.path.join(path, 'content')
+    with open(filepath, 'wb') as _file:
+        block = os.urandom(2 ** 20)
+        for _ in range(size // len(block)):
+            _file.write(block)
+        _file.write(block[:size % len(block)])
+
+    for name, hashfunc in HASH_ALGORITHMS:
+        result = {'name': 'filehash', 'algorithm': name, 'size': size}
+        result.update(measure(lambda: bucket_object.filehash(filepath, hashfunc()), 1, size))
+        yield result
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Microbenchmarks of objectstore storage primitives')
+    parser.add_argument('--rows', default='1000,100000', help='table sizes, up to 10000000, default: %(default)s')
+    parser.add_argument('--ops', type=int, default=10000, help='operations per run, default: %(default)s')
+    parser.add_argument('--hash-size', type=int, default=64, help='the size of hashed file, MB, default: %(default)s')
+    parser.add_argument('--output', default=None, help='the path to the JSON report, default: stdout')
+    parser.add_argument('--baseline', default=None, help='the report to compare the results with')
+    parser.add_argument('--threshold', type=float, default=report.DEFAULT_THRESHOLD,
+                        help='the slowdown treated as regression, a fraction, default: %(default)s')
+    args = parser.parse_args(argv)
+
+    rows_levels = [int(rows) for rows in args.rows.split(',') if rows.strip()]
+    path = tempfile.mkdtemp()
+    results = list()
+    try:
+        benchmarks = (
+            bench_sqlitedict(path, rows_levels, args.ops),
+            bench_queue_overhead(path, args.ops),
+            bench_movefile(path, args.ops),
+            bench_filehash(path, args.hash_size * 2 ** 20),
+        )
+        for benchmark in benchmarks:
+            for result in benchmark:
+                results.append(result)
+                sys.stderr.write('%s %s\n' % (
+                    ' '.join('%s=%s' % item for item in report.result_key(result)), result['us_per_op']
+                ))
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+    current = {'meta': report.meta(benchmark='storage_micro'), 'results': results}
+    report.write(args.output, current['meta'], results)
+    if args.baseline:
+        regressions = report.compare(report.read(args.baseline), current, args.threshold)
+        report.print_regressions(regressions)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+
+    sys.exit(main())
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+#   Disk I/O per PUT: single-pass hashing vs. re-reading the temp file per digest
+#
+#   usage: python benchmarks/store_io.py [size-in-MB ...]
+#
+#   The number of bytes read by the process is taken from /proc/self/io (rchar), so
+#   the benchmark is Linux-only. The request body is served from memory, therefore
+#   all bytes reported as read come from the files in the storage.
+#
+
+import os
+import sys
+import time
+import shutil
+import hashlib
+import tempfile
+
+from cStringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from objectstore.api import buckets
+from objectstore.api import objects
+
+
+def io_counters():
+    ''' returns the dict of I/O counters for the current process
+    '''
+    counters = dict()
+    with open('/proc/self/io') as _file:
+        for line in _file:
+            name, value = line.split(':')
+            counters[name.strip()] = int(value)
+    return counters
+
+
+def legacy_store(bucket_object, stream):
+    ''' the store path before single-pass hashing: write by 4KB chunks, then re-read
+    the temp file once for each digest
+    '''
+    with tempfile.NamedTemporaryFile(dir=bucket_object._temp_path, mode="wb", delete=False) as _file:
+        temp_filepath = _file.name
+        while True:
+            chunk = stream.read(4096)
+            if not chunk:
+                break
+            _file.write(chunk)
+
+    hashes = {
+        'content-md5': bucket_object.filehash(temp_filepath, hashlib.md5()),
+        'content-sha1': bucket_object.filehash(temp_filepath, hashlib.sha1()),
+        'content-sha256': bucket_object.filehash(temp_filepath, hashlib.sha256())
+    }
+    os.remove(temp_filepath)
+    return hashes
+
+
+def streaming_store(bucket_object, stream):
+    ''' the current store path
+    '''
+    bucket_object.store(stream)
+    bucket_object.delete()
+
+
+def measure(func, bucket, data):
+
+    bucket_object = objects.BucketObject(bucket=bucket)
+    stream = StringIO(data)
+    before = io_counters()
+    started = time.time()
+    func(bucket_object, stream)
+    elapsed = time.time() - started
+    after = io_counters()
+    return after['rchar'] - before['rchar'], after['wchar'] - before['wchar'], elapsed
+
+
+def main(sizes):
+
+    storage_path = tempfile.mkdtemp()
+    try:
+        bucket = buckets.Bucket('benchmark', storage_path=storage_path)
+        bucket.create()
+
+        print '%10s %10s %16s %16s %10s' % ('size, MB', 'method', 'read, bytes', 'written, bytes', 'time, s')
+        for size in sizes:
+            data = os.urandom(size * 2 ** 20)
+            for name, func in (('legacy', legacy_store), ('streaming', streaming_store)):
+                read_bytes, written_bytes, elapsed = measure(func, bucket, data)
+                print '%10d %10s %16d %16d %10.3f' % (size, name, read_bytes, written_bytes, elapsed)
+    finally:
+        shutil.rmtree(storage_path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+
+    main([int(size) for size in sys.argv[1:]] or [1, 16, 128])
@@ -0,0 +1,160 @@
+#
+#   Blob pool
+#
+#   The content of objects from buckets with `dedup` setting is stored once per storage, in
+#   the `.blobs` directory. The object file in the bucket is a hardlink to the blob, so the
+#   objects are read as usual and the blob is removed with the last link to it.
+#
+#   The number of bucket links is recorded in the `refcount` table. The link count of
+#   the blob file is authoritative: the table is updated from it, and repair() rebuilds
+#   the table and removes orphaned blobs after a crash.
+#
+
+import os
+import errno
+
+from handles import registry
+from common import pairtree_path
+from durability import directory_paths
+
+
+# the directory of blob pool in the storage, the name is reserved for buckets
+BLOB_POOL_NAME = '.blobs'
+
+
+def blob_key(hashes):
+    ''' returns the key of blob with the content: the digest of original content and
+    the codec and the length of stored data, if the data is compressed. The content compressed
+    at different levels is stored as different blobs, so the linked blob always has the
+    `stored-length` of the object
+    '''
+    if hashes.get('stored-codec'):
+        return '%s.%s.%d' % (hashes['content-sha256'], hashes['stored-codec'], hashes['stored-length'])
+    return hashes['content-sha256']
+
+
+def makedirs(path):
+    ''' creates the directory, if it does not exist
+    '''
+    try:
+        os.makedirs(path)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+
+
+class BlobPool(object):
+
+    def __init__(self, storage_path):
+
+        self._storage_path = storage_path
+        self._pool_path = os.path.join(storage_path, BLOB_POOL_NAME)
+
+
+    @property
+    def refcount(self):
+        ''' returns the shared handle to refcount table
+        '''
+        makedirs(self._pool_path)
+        return registry.get(os.path.join(self._pool_path, 'refcount.sqlite'), 'refcount')
+
+
+    def blob_path(self, key):
+
+        return os.path.join(self._pool_path, pairtree_path(key))
+
+
+    def directory_paths(self, key):
+        ''' returns the directories to sync for durability of the blob entry, including the pool
+        directories which link() is going to create
+        '''
+        return directory_paths(os.path.dirname(self.blob_path(key)), self._storage_path)
+
+
+    def link(self, key, source_path, target_path):
+        ''' stores the content of source file as the object file `target_path`. If the blob
+        with the key exists, the target is linked to it and the source file is removed, otherwise
+        the source file is moved to the target and added to the pool.
+
+        Returns True if the content is deduplicated. Each step leaves the pool consistent:
+        the blob is added only after the object file is in place.
+        '''
+        blob_path = self.blob_path(key)
+        makedirs(os.path.dirname(blob_path))
+        makedirs(os.path.dirname(target_path))
+        if os.path.lexists(target_path):
+            os.remove(target_path)
+
+        try:
+            os.link(blob_path, target_path)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            os.rename(source_path, target_path)
+            try:
+                os.link(target_path, blob_path)
+            except OSError as err:
+                # the blob is added by concurrent request, this object is not deduplicated
+                if err.errno != errno.EEXIST:
+                    raise
+            self._update(key)
+            return False
+
+        os.remove(source_path)
+        self._update(key)
+        return True
+
+
+    def unlink(self, key, target_path):
+        ''' removes the object file linked to the blob, the blob is removed with the last link
+        '''
+        os.remove(target_path)
+        self._update(key, remove_unused=True)
+
+
+    def repair(self):
+        ''' rebuilds the refcount table from the link counts of blob files and removes the blobs
+        without links from buckets. Returns the dict with the numbers of blobs and removed blobs
+        '''
+        stats = {'blobs': 0, 'removed': 0}
+        refcount = self.refcount
+        found = set()
+        for dirpath, dirnames, filenames in os.walk(self._pool_path):
+            if dirpath == self._pool_path:
+                continue
+            for key in filenames:
+                found.add(key)
+                if self._update(key, remove_unused=True):
+                    stats['blobs'] += 1
+                else:
+                    stats['removed'] += 1
+
+        for key in [key for key in refcount.keys() if key not in found]:
+            del refcount[key]
+        refcount.commit()
+        return stats
+
+
+    def _update(self, key, remove_unused=False):
+        ''' updates the refcount of the blob from its link count, returns the refcount.
+        The blob without links is removed if `remove_unused` is True
+        '''
+        blob_path = self.blob_path(key)
+        try:
+            links = os.stat(blob_path).st_nlink - 1
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            links = 0
+
+        refcount = self.refcount
+        if links > 0:
+            refcount[key] = links
+        else:
+            if remove_unused and os.path.exists(blob_path):
+                # the object linked concurrently keeps its content, only the dedup is lost
+                os.remove(blob_path)
+            if key in refcount:
+                del refcount[key]
+        refcount.commit()
+        return links
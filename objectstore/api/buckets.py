@@ -8,11 +8,215 @@
 import os
 import re
 import json
+import base64
 import shutil
+import errno
 import falcon
+import threading
 
-from common import BaseAPI
+from multiprocessing.pool import ThreadPool
+
+from common import BaseAPI, has_param, prefix_upper_bound, pairtree_path
+from handles import registry
 from sqlitedict import SqliteDict
+from packs import PackStore, DEFAULT_SEGMENT_SIZE
+from compression import CODECS
+from blobs import BlobPool, BLOB_POOL_NAME, makedirs
+from catalog import ObjectCatalog, parse_query, parse_order
+from durability import DURABILITY_MODES, DEFAULT_DURABILITY, committer, database_paths
+
+
+# max number of keys returned by the objects listing
+MAX_KEYS = 1000
+
+# max number of objects removed by one multi-object delete request
+MAX_DELETE_KEYS = 1000
+
+# the number of threads removing object files on multi-object delete, the pool is shared by requests
+DELETE_WORKERS = 8
+
+_delete_pool = {'pool': None, 'pid': None}
+_delete_pool_lock = threading.Lock()
+
+# max number of objects in one batch lookup request, the metadata is read by batches of LOOKUP_BATCH_SIZE
+MAX_LOOKUP_KEYS = 100000
+LOOKUP_BATCH_SIZE = 500
+
+# metadata keys which can be used for object identification in the storage
+OBJECT_KEYS = ('content-md5', 'content-sha1')
+DEFAULT_OBJECT_KEY = 'content-sha1'
+
+# the number of directory levels of the pairtree in the bucket data directory, 2 levels are 65536 leaf
+# directories, each next level multiplies it by 256
+DEFAULT_PAIRTREE_DEPTH = 2
+MAX_PAIRTREE_DEPTH = 4
+
+# the generation counter of bucket metadata, increased by triggers on any change of `bucket` table.
+# The counter starts from 0 in the recreated bucket, so the row 1 holds the random id of the metadata
+# file and the generation is the pair (counter, file id)
+GENERATION_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS bucket_generation (id INTEGER PRIMARY KEY, value INTEGER NOT NULL)',
+    'INSERT OR IGNORE INTO bucket_generation (id, value) VALUES (0, 0)',
+    'INSERT OR IGNORE INTO bucket_generation (id, value) VALUES (1, random())',
+    'CREATE TRIGGER IF NOT EXISTS bucket_generation_insert AFTER INSERT ON bucket '
+        'BEGIN UPDATE bucket_generation SET value = value + 1 WHERE id = 0; END',
+    'CREATE TRIGGER IF NOT EXISTS bucket_generation_update AFTER UPDATE ON bucket '
+        'BEGIN UPDATE bucket_generation SET value = value + 1 WHERE id = 0; END',
+    'CREATE TRIGGER IF NOT EXISTS bucket_generation_delete AFTER DELETE ON bucket '
+        'BEGIN UPDATE bucket_generation SET value = value + 1 WHERE id = 0; END',
+)
+GET_GENERATION = (
+    'SELECT (SELECT value FROM bucket_generation WHERE id = 0), (SELECT value FROM bucket_generation WHERE id = 1)'
+)
+
+
+def encode_continuation_token(marker):
+    ''' returns an opaque continuation token for the listing marker
+    '''
+    if isinstance(marker, unicode):
+        marker = marker.encode('utf-8')
+    return base64.urlsafe_b64encode(marker)
+
+
+def decode_continuation_token(token):
+    ''' returns the listing marker from the continuation token
+    '''
+    try:
+        return base64.urlsafe_b64decode(str(token)).decode('utf-8')
+    except (TypeError, ValueError, UnicodeError):
+        raise falcon.HTTPInvalidParam('The continuation token is invalid', param_name='continuation-token')
+
+
+def int_setting(metadata, name, default=0):
+    ''' returns integer value of the bucket setting, the default if it's absent or invalid
+    '''
+    try:
+        return int(metadata.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def depth_setting(metadata, name, default=DEFAULT_PAIRTREE_DEPTH):
+    ''' returns the pairtree depth from the bucket setting, the default if it's absent or out of range
+    '''
+    depth = int_setting(metadata, name, None)
+    if depth is None or not 0 <= depth <= MAX_PAIRTREE_DEPTH:
+        return default
+    return depth
+
+
+def open_bucket_metadata(filename, tablename, autocommit=True, **kwargs):
+    ''' opens the bucket metadata table with the generation counter, used as registry factory
+    '''
+    handle = SqliteDict(filename, tablename, autocommit=autocommit, **kwargs)
+    for statement in GENERATION_SCHEMA:
+        handle.conn.execute(statement)
+    handle.commit()
+    return handle
+
+
+def delete_pool():
+    ''' returns the pool of threads removing object files, created on first use in the process
+    '''
+    with _delete_pool_lock:
+        # the threads of the pool are not inherited by the forked worker
+        if _delete_pool['pool'] is None or _delete_pool['pid'] != os.getpid():
+            _delete_pool['pool'] = ThreadPool(DELETE_WORKERS)
+            _delete_pool['pid'] = os.getpid()
+        return _delete_pool['pool']
+
+
+def iter_lookup(objects, object_ids, batch_size=LOOKUP_BATCH_SIZE):
+    ''' yields JSON lines with the metadata of objects, in the order of object ids
+    '''
+    for i in range(0, len(object_ids), batch_size):
+        batch = object_ids[i:i + batch_size]
+        found = objects.get_many(batch, batch_size=batch_size)
+        lines = list()
+        for object_id in batch:
+            if object_id in found:
+                lines.append(json.dumps({u'object-id': object_id, u'metadata': found[object_id]}))
+            else:
+                lines.append(json.dumps({u'object-id': object_id, u'missing': True}))
+        yield '\n'.join(lines) + '\n'
+
+
+class BucketConfig(object):
+    ''' bucket settings resolved from bucket metadata
+    '''
+    def __init__(self, metadata, generation=None):
+
+        self.metadata = metadata
+        self.generation = generation
+
+        # metadata key used for object identification in the storage
+        if metadata.get('object-key') in OBJECT_KEYS:
+            self.object_key = metadata['object-key']
+        else:
+            self.object_key = DEFAULT_OBJECT_KEY
+
+        # objects smaller than pack-threshold bytes are stored in pack segments, 0 - disabled
+        self.pack_threshold = int_setting(metadata, 'pack-threshold')
+        self.pack_segment_size = int_setting(metadata, 'pack-segment-size', DEFAULT_SEGMENT_SIZE)
+
+        # codec of stored objects, None - the objects are stored as is
+        self.compression = metadata.get('compression') if metadata.get('compression') in CODECS else None
+        self.compression_level = int_setting(metadata, 'compression-level', None)
+
+        # the content of objects is stored once per storage, in the blob pool
+        self.dedup = bool(int_setting(metadata, 'dedup'))
+
+        # max size of object content in bytes, 0 - unlimited
+        self.max_object_size = int_setting(metadata, 'max-object-size')
+
+        # the directory levels of the data pairtree. While the data directory is resharded, the files
+        # which are not moved yet are in the pairtree of the previous depth
+        self.pairtree_depth = depth_setting(metadata, 'pairtree-depth')
+        self.previous_pairtree_depth = depth_setting(metadata, 'pairtree-previous-depth', None)
+
+        # the data synced to disk before the object is acknowledged, see durability.py
+        if metadata.get('durability') in DURABILITY_MODES:
+            self.durability = metadata['durability']
+        else:
+            self.durability = DEFAULT_DURABILITY
+
+
+class BucketConfigCache(object):
+    ''' in-process cache of bucket settings, keyed by bucket path
+
+    The cached config is valid until the generation of bucket metadata is changed, so the check
+    costs two primary key lookups instead of reading the whole metadata table. The generation
+    includes the random id of the metadata file, so the config of a removed bucket is not
+    taken for the config of the bucket recreated with the same name.
+    '''
+    def __init__(self):
+
+        self._configs = dict()
+        self._lock = threading.Lock()
+
+
+    def get(self, bucket_path, meta):
+        ''' returns the config of the bucket, `meta` is the handle to bucket metadata table
+        '''
+        generation = meta.conn.select_one(GET_GENERATION)
+        config = self._configs.get(bucket_path)
+        if config is None or config.generation != generation:
+            # the generation is read before the metadata, so a concurrent change leads 
+            # to reloading on the next call, not to a stale config
+            config = BucketConfig(dict(meta), generation)
+            with self._lock:
+                self._configs[bucket_path] = config
+        return config
+
+
+    def invalidate(self, bucket_path):
+
+        with self._lock:
+            self._configs.pop(bucket_path, None)
+
+
+# process-wide cache of bucket settings
+config_cache = BucketConfigCache()
 
 
 class BucketCollectionAPI(BaseAPI):
@@ -24,6 +228,12 @@ class BucketCollectionAPI(BaseAPI):
 
         parameters:
         - name, mandatory parameter
+        - pairtree-depth, the directory levels of the data pairtree, from 0 to 4, 2 by default
+        - durability, what is synced to disk before the object is acknowledged: none (default),
+          data or data+metadata (`data%2Bmetadata` in the query string)
+        - compression, the codec of stored objects: zlib, gzip, bz2 or lzma if it's available
+        - compression-level, the level of the codec: -1 to 9 for zlib and gzip, 1 to 9 for bz2,
+          0 to 9 for lzma
 
         The rest of parameters are optional and they will storing as metadata
 
@@ -34,6 +244,31 @@ class BucketCollectionAPI(BaseAPI):
 
         bucket_name = req.params.get(u'name')
 
+        if req.get_param('compression') and req.get_param('compression') not in CODECS:
+            raise falcon.HTTPInvalidParam(
+                'The supported codecs: %s' % ', '.join(sorted(CODECS)), 
+                param_name='compression'
+            )
+        codec = CODECS.get(req.get_param('compression'))
+        if req.get_param('compression-level') is not None:
+            level = int_setting(req.params, 'compression-level', None)
+            if level is None or (codec and level not in codec.levels):
+                raise falcon.HTTPInvalidParam(
+                    'The levels of %s codec: %s' % (codec.name, ', '.join(str(level) for level in codec.levels))
+                    if codec else 'The level shall be integer',
+                    param_name='compression-level'
+                )
+        if req.get_param('durability') and req.get_param('durability') not in DURABILITY_MODES:
+            raise falcon.HTTPInvalidParam(
+                'The durability modes: %s' % ', '.join(DURABILITY_MODES),
+                param_name='durability'
+            )
+        if req.get_param('pairtree-depth') is not None and depth_setting(req.params, 'pairtree-depth', None) is None:
+            raise falcon.HTTPInvalidParam(
+                'The depth from 0 to %d is expected' % MAX_PAIRTREE_DEPTH,
+                param_name='pairtree-depth'
+            )
+
         bucket = Bucket(bucket_name, storage_path=self._storage_path)
         bucket.metadata = req.params
         bucket.create()
@@ -48,29 +283,170 @@ class BucketAPI(BaseAPI):
         
         returns some or all (up to 1000) of the objects in a bucket. You can use the request parameters 
         as selection criteria to return a subset of the objects in a bucket. 
+
+        parameters:
+        - prefix, limits the response to keys that begin with the specified prefix
+        - delimiter, keys that contain the same string between the prefix and the first occurrence 
+          of the delimiter are rolled up into a single entry of `common-prefixes`
+        - marker, the key to start with, the listing starts after this key
+        - continuation-token, the value of `next-continuation-token` from the previous response, 
+          used instead of marker
+        - max-keys, the max number of keys and common prefixes returned, up to 1000
+
+        If the listing is truncated, `is-truncated` is true and `next-continuation-token` refers to 
+        the next page.
+
+        Search, if `query` or `order` parameter is given:
+        - query, the comma-separated predicates `<field><operator><value>`, the operators: =, !=, <, <=, 
+          >, >=, ^= (starts with). The fields: content-length, content-type, content-name, content-md5, 
+          content-sha1, content-sha256, created. Example: `content-type=image/png,content-length>10485760`
+        - order, the field to order by, `-<field>` for descending order, by default the objects are 
+          ordered by key
+        - continuation-token and max-keys, as for listing
+
+        The search returns the objects as the list of dicts with `object-id` and `metadata`.
+
+        Export, if `export=tar` parameter is given: the tar archive of the objects with `data/<object-id>` 
+        members and `manifest.ndjson` of objects metadata, streamed in key order. The `prefix` and 
+        `marker` parameters select the range of keys, so the bucket can be exported by parallel requests.
         
         Based on: [GET Bucket (List Objects)](http://docs.aws.amazon.com/AmazonS3/latest/API/RESTBucketGET.html)
         '''
         bucket = Bucket(bucket_name=bucket_name, storage_path=self._storage_path)
         if bucket.exists():
-            resp.data = json.dumps({
-                u'metadata': bucket.metadata,
-                u'objects': bucket.object_list()
-            })
+            if req.get_param('export') is not None:
+                self._export(req, resp, bucket)
+                return
+
+            max_keys = req.get_param_as_int('max-keys', min=0)
+            if max_keys is None or max_keys > MAX_KEYS:
+                max_keys = MAX_KEYS
+
+            if req.get_param('query') is not None or req.get_param('order') is not None:
+                listing = self._search(req, bucket, max_keys)
+                resp.data = json.dumps(listing)
+                return
+
+            marker = req.get_param('marker')
+            if req.get_param('continuation-token'):
+                marker = decode_continuation_token(req.get_param('continuation-token'))
+
+            listing = bucket.object_list(
+                prefix=req.get_param('prefix') or u'', 
+                marker=marker, 
+                max_keys=max_keys, 
+                delimiter=req.get_param('delimiter')
+            )
+            listing[u'metadata'] = bucket.metadata
+            resp.data = json.dumps(listing)
+        else:
+            raise falcon.HTTPNotFound()
+
+
+    def on_post(self, req, resp, bucket_name):
+        ''' _POST_ Bucket (Delete Multiple Objects, Lookup Multiple Objects)
+
+        The body is JSON `{"objects": ["<object-id>", ...]}`.
+
+        `POST ?delete` removes up to 1000 objects from the bucket in one request. The metadata is 
+        removed in one transaction, the files are removed after that by the pool of threads.
+        The response is `{"deleted": [...], "errors": [{"object-id": ..., "code": ..., "message": ...}]}`
+
+        `POST ?lookup` returns the metadata of up to 100000 objects, as JSON lines in the order of 
+        request: `{"object-id": ..., "metadata": {...}}` or `{"object-id": ..., "missing": true}`.
+        The metadata is read by `SELECT ... WHERE key IN (...)` per batch of 500 objects, the lines 
+        are streamed as the batches are read.
+
+        Based on: [Delete Multiple Objects](http://docs.aws.amazon.com/AmazonS3/latest/API/multiobjectdeleteapi.html)
+        '''
+        if has_param(req, 'delete'):
+            max_keys = MAX_DELETE_KEYS
+        elif has_param(req, 'lookup'):
+            max_keys = MAX_LOOKUP_KEYS
         else:
+            raise falcon.HTTPBadRequest(title='InvalidRequest', description='The operation is not supported')
+
+        bucket = Bucket(bucket_name, storage_path=self._storage_path)
+        if not bucket.exists():
             raise falcon.HTTPNotFound()
 
+        try:
+            object_ids = json.loads(req.stream.read())['objects']
+            if not isinstance(object_ids, list) or not all(isinstance(k, basestring) for k in object_ids):
+                raise ValueError()
+        except (ValueError, KeyError, TypeError):
+            raise falcon.HTTPBadRequest(
+                title='MalformedJSON',
+                description='The list of objects is expected as {"objects": ["<object-id>", ...]}'
+            )
+        if len(object_ids) > max_keys:
+            raise falcon.HTTPBadRequest(
+                title='TooManyKeys',
+                description='Up to %d objects can be processed by one request' % max_keys
+            )
+
+        if has_param(req, 'lookup'):
+            resp.content_type = 'application/x-ndjson'
+            resp.stream = iter_lookup(bucket.objects_metadata(), object_ids)
+            return
+
+        deleted = bucket.delete_objects(object_ids)
+        missing = set(object_ids) - set(deleted)
+        resp.data = json.dumps({
+            u'deleted': deleted,
+            u'errors': [
+                {u'object-id': object_id, u'code': u'NoSuchKey', u'message': u'The object does not exist'} 
+                for object_id in object_ids if object_id in missing
+            ],
+        })
+
+
+    def _export(self, req, resp, bucket):
+        ''' streams the archive of the bucket objects
+        '''
+        # the export module depends on objects, which imports this module
+        from export import EXPORT_FORMATS, export_bucket
+
+        if req.get_param('export') not in EXPORT_FORMATS:
+            raise falcon.HTTPInvalidParam(
+                'The supported formats: %s' % ', '.join(EXPORT_FORMATS), param_name='export'
+            )
+        resp.content_type = 'application/x-tar'
+        resp.set_header('content-disposition', 'attachment; filename="%s.tar"' % os.path.basename(bucket.bucket_path))
+        resp.stream = export_bucket(bucket, prefix=req.get_param('prefix') or u'', marker=req.get_param('marker'))
+
+
+    def _search(self, req, bucket, max_keys):
+        ''' returns the page of objects matching the query
+        '''
+        predicates = parse_query(req.get_param_as_list('query') or [])
+        order, descending = parse_order(req.get_param('order'))
+
+        # the token of search page refers to the order value and the key of the last object
+        after = None
+        if req.get_param('continuation-token'):
+            try:
+                after = json.loads(decode_continuation_token(req.get_param('continuation-token')))
+                value, key = after
+            except (ValueError, TypeError):
+                raise falcon.HTTPInvalidParam('The continuation token is invalid', param_name='continuation-token')
+
+        return bucket.search(predicates, order=order, descending=descending, after=after, max_keys=max_keys)
+
 
     def on_head(self, req, resp, bucket_name):
         ''' _HEAD_ Bucket
         
-        useful to determine if a bucket exists.
+        useful to determine if a bucket exists. The number of objects and the total of their 
+        content-length are returned in `object-count` and `bytes-used` headers.
         
         Based on: [HEAD Bucket](http://docs.aws.amazon.com/AmazonS3/latest/API/RESTBucketHEAD.html)
         '''
         bucket = Bucket(bucket_name, storage_path=self._storage_path)
         if not bucket.exists():
             raise falcon.HTTPNotFound()
+        for k, v in bucket.stats().items():
+            resp.set_header(k, str(v))
 
 
     def on_delete(self, req, resp, bucket_name):
@@ -103,9 +479,15 @@ class Bucket(object):
                 "The parameter shall contain only alpha-numeric characters, value: '%s'" % bucket_name, 
                 param_name='name'
             )
+        if self._name == BLOB_POOL_NAME:
+            raise falcon.HTTPInvalidParam(
+                "The bucket name is reserved, value: '%s'" % bucket_name, 
+                param_name='name'
+            )
 
         self._bucket_path = None
         if storage_path and os.path.exists(storage_path):
+            self._storage_path = storage_path
             self._bucket_path = os.path.join(storage_path, self._name)
         else:
             raise falcon.HTTPInternalServerError(
@@ -113,21 +495,44 @@ class Bucket(object):
                 description='The storage path is incorrect, "%s"' % storage_path
             )
 
+        # the metadata of non-existing bucket is kept in memory until the bucket is created
         if self._bucket_path and os.path.exists(self._bucket_path):
-            self._meta = SqliteDict(os.path.join(self._bucket_path,'metadata.sqlite'), 'bucket', autocommit=True)
+            self._meta = registry.get(self.metadata_path, 'bucket', factory=open_bucket_metadata)
         else:
-            self._meta = SqliteDict(':memory:', 'bucket', autocommit=True)
+            self._meta = dict()
 
     @property
     def bucket_path(self):
 
         return self._bucket_path
 
+
+    @property
+    def storage_path(self):
+
+        return self._storage_path
+
+
+    @property
+    def metadata_path(self):
+        ''' returns the path to the sqlite file with bucket and objects metadata
+        '''
+        return os.path.join(self._bucket_path, 'metadata.sqlite')
+
     
+    @property
+    def config(self):
+        ''' returns the bucket settings
+        '''
+        if isinstance(self._meta, dict):
+            return BucketConfig(self._meta)
+        return config_cache.get(self.bucket_path, self._meta)
+
+
     @property
     def metadata(self):
         
-        return dict(self._meta)
+        return dict(self.config.metadata)
     
 
     @metadata.setter
@@ -170,7 +575,7 @@ class Bucket(object):
 
         # create metadata file in bucket directory
         _meta = self._meta
-        self._meta = SqliteDict(os.path.join(self.bucket_path, 'metadata.sqlite'), 'bucket', autocommit=True) 
+        self._meta = registry.get(self.metadata_path, 'bucket', factory=open_bucket_metadata)
         self._meta.update(_meta)
 
 
@@ -181,12 +586,14 @@ class Bucket(object):
         '''
         bucket_data_path = os.path.join(self.bucket_path, 'data')
         if self.bucket_path and os.path.isdir(self.bucket_path):
-            if len(os.listdir(bucket_data_path)) > 0:
+            if len(os.listdir(bucket_data_path)) > 0 or self.objects_metadata():
                 raise falcon.HTTPConflict(
                     title='BucketNotEmpty',
                     description="The bucket you tried to delete is not empty"                    
                 )
             else:
+                registry.invalidate(self.bucket_path)
+                config_cache.invalidate(self.bucket_path)
                 shutil.rmtree(self.bucket_path)
         else:
             raise falcon.HTTPNotFound()
@@ -195,14 +602,253 @@ class Bucket(object):
     def info(self):
         ''' returns bucket info as dictionary
         '''
-        return dict(self._meta)
+        return self.metadata
+
+
+    def stats(self):
+        ''' returns the dict with `object-count` and `bytes-used`, the total of content-length 
+        of objects. The counters are maintained by the catalog, the call costs one lookup
+        '''
+        stats = self.objects_metadata().stats()
+        return {u'object-count': stats['objects'], u'bytes-used': stats['bytes']}
+
+
+    def object_list(self, prefix=u'', marker=None, max_keys=MAX_KEYS, delimiter=None):
+        ''' returns the page of objects listing as dictionary:
+
+        - objects, the list of object keys
+        - common-prefixes, the list of keys rolled up by delimiter
+        - is-truncated, True if there are more keys after this page
+        - next-continuation-token, the token of the next page, only if the listing is truncated 
+          and the page is not empty (max_keys = 0)
+        '''
+        listing = {
+            u'objects': list(),
+            u'common-prefixes': list(),
+            u'is-truncated': False,
+        }
+
+        last_entry = None
+        for entry, is_prefix in self._iter_listing(prefix, marker, delimiter):
+            if len(listing[u'objects']) + len(listing[u'common-prefixes']) == max_keys:
+                listing[u'is-truncated'] = True
+                if last_entry is not None:
+                    listing[u'next-continuation-token'] = encode_continuation_token(last_entry)
+                break
+            if is_prefix:
+                listing[u'common-prefixes'].append(entry)
+            else:
+                listing[u'objects'].append(entry)
+            last_entry = entry
+
+        return listing
+
+
+    def delete_objects(self, object_ids):
+        ''' removes the objects, returns the list of removed object ids, the objects which do not 
+        exist are skipped. 
+
+        The metadata and pack locations are removed in one transaction, the object files are 
+        removed after commit by the pool of threads: a crash can leave orphaned files, not 
+        the metadata of removed files.
+        '''
+        objects = self.objects_metadata()
+        found = objects.get_many(object_ids)
+        deleted, seen = list(), set()
+        for object_id in object_ids:
+            if object_id in found and object_id not in seen:
+                deleted.append(object_id)
+                seen.add(object_id)
+        if not deleted:
+            return deleted
+
+        statements = [('DELETE FROM %s WHERE key = ?' % objects.tablename, (k,)) for k in deleted]
+        packed = dict()
+        if os.path.isdir(os.path.join(self.bucket_path, 'packs')):
+            index = PackStore(self.bucket_path).index
+            packed = index.get_many(deleted)
+            # the pack index is in the same database file, so it's changed in the same transaction
+            statements.extend(('DELETE FROM %s WHERE key = ?' % index.tablename, (k,)) for k in packed)
+        objects.conn.execute_batch(statements)
+        if self.config.durability == 'data+metadata':
+            committer.submit(*database_paths(self.metadata_path))
+
+        delete_pool().map(self._remove_file, [(k, found[k]) for k in deleted if k not in packed])
+        return deleted
+
+
+    def iter_objects(self, prefix=u'', marker=None, batch_size=MAX_KEYS):
+        ''' yields (object id, metadata) of the objects in key order, the keys and the metadata
+        are read by batches
+        '''
+        objects = self.objects_metadata()
+        batch = list()
+        for key, _ in self._iter_listing(prefix, marker, None, batch_size=batch_size):
+            batch.append(key)
+            if len(batch) == batch_size:
+                for entry in self._iter_metadata(objects, batch):
+                    yield entry
+                batch = list()
+        for entry in self._iter_metadata(objects, batch):
+            yield entry
+
+
+    def _iter_metadata(self, objects, keys):
+
+        found = objects.get_many(keys, batch_size=len(keys) or 1)
+        for key in keys:
+            # the object removed after the keys are read is skipped
+            if key in found:
+                yield key, found[key]
+
+
+    def object_path(self, object_id, config=None):
+        ''' returns the path to the object file in the data directory.
+
+        While the data directory is resharded, the file is looked up in the new layout, then in 
+        the previous one, then in the new one again: the file moved between the first two lookups 
+        is found by the last one. The path in the new layout is returned for the missing file.
+        '''
+        if config is None:
+            config = self.config
+        data_path = os.path.join(self.bucket_path, 'data')
+        filepath = os.path.join(data_path, pairtree_path(object_id, config.pairtree_depth))
+        if config.previous_pairtree_depth is None or os.path.exists(filepath):
+            return filepath
+        previous_filepath = os.path.join(data_path, pairtree_path(object_id, config.previous_pairtree_depth))
+        if os.path.exists(previous_filepath):
+            return previous_filepath
+        return filepath
+
+
+    def reshard(self, depth):
+        ''' moves the object files of the data directory to the pairtree of `depth` levels, returns 
+        the dict with the numbers of moved files, skipped files and removed directories.
+
+        The new depth is recorded with the previous one before the files are moved: the new objects 
+        are stored in the new layout, the lookups fall back to the previous layout until the files 
+        are moved. The interrupted resharding is resumed by the call with the same depth.
+        '''
+        if not isinstance(depth, (int, long)) or not 0 <= depth <= MAX_PAIRTREE_DEPTH:
+            raise RuntimeError('The depth from 0 to %d is expected, %s' % (MAX_PAIRTREE_DEPTH, depth))
+        config = self.config
+        if config.previous_pairtree_depth is not None and config.pairtree_depth != depth:
+            raise RuntimeError('The bucket is being resharded to depth %d, the resharding shall be '
+                               'completed first' % config.pairtree_depth)
+
+        stats = {'moved': 0, 'skipped': 0, 'directories': 0}
+        if config.previous_pairtree_depth is None:
+            if config.pairtree_depth == depth:
+                return stats
+            self.metadata = {'pairtree-depth': depth, 'pairtree-previous-depth': config.pairtree_depth}
+            self._meta.commit()
+
+        data_path = os.path.join(self.bucket_path, 'data')
+        for dirpath, dirnames, filenames in os.walk(data_path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                try:
+                    target = os.path.join(data_path, pairtree_path(filename, depth))
+                except RuntimeError:
+                    stats['skipped'] += 1
+                    continue
+                source = os.path.join(dirpath, filename)
+                if source != target:
+                    makedirs(os.path.dirname(target))
+                    os.rename(source, target)
+                    stats['moved'] += 1
+
+        # the directories below the leaf level of the new layout are not used by new objects, 
+        # the empty ones are removed
+        for dirpath, dirnames, filenames in os.walk(data_path, topdown=False):
+            level = len(os.path.relpath(dirpath, data_path).split(os.sep))
+            if dirpath != data_path and level > depth and not os.listdir(dirpath):
+                os.rmdir(dirpath)
+                stats['directories'] += 1
+
+        del self._meta['pairtree-previous-depth']
+        self._meta.commit()
+        return stats
+
+
+    def _remove_file(self, entry):
+        ''' removes the file of the object, the file of deduplicated object is unlinked from the blob
+        '''
+        object_id, metadata = entry
+        filepath = self.object_path(object_id)
+        try:
+            if 'stored-blob' in metadata:
+                BlobPool(self.storage_path).unlink(metadata['stored-blob'], filepath)
+            else:
+                os.remove(filepath)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+
+
+    def search(self, predicates, order=None, descending=False, after=None, max_keys=MAX_KEYS):
+        ''' returns the page of objects matching the predicates as dictionary:
+
+        - objects, the list of dicts with object-id and metadata
+        - is-truncated, True if there are more objects after this page
+        - next-continuation-token, the token of the next page, only if the result is truncated
+        '''
+        rows = self.objects_metadata().search(
+            predicates, order=order, descending=descending, after=after, limit=max_keys + 1
+        )
+        result = {
+            u'objects': [{u'object-id': key, u'metadata': metadata} for key, metadata, _ in rows[:max_keys]],
+            u'is-truncated': len(rows) > max_keys,
+        }
+        if result[u'is-truncated'] and max_keys:
+            key, _, value = rows[max_keys - 1]
+            result[u'next-continuation-token'] = encode_continuation_token(json.dumps([value, key]))
+        return result
+
+
+    def _iter_listing(self, prefix, marker, delimiter, batch_size=MAX_KEYS):
+        ''' yields (entry, is_prefix) tuples in key order
+
+        The keys are read by batches from the primary key index, the keys rolled up into 
+        a common prefix are skipped by one index seek.
+        '''
+        objects = self.objects_metadata()
+        start = prefix or None
+        stop = prefix_upper_bound(prefix) if prefix else None
+        after = marker
+
+        # the marker refers to a common prefix (or a key inside of it), the rest of it is skipped
+        if delimiter and marker and marker.startswith(prefix):
+            position = marker.find(delimiter, len(prefix))
+            if position >= 0:
+                start, after = prefix_upper_bound(marker[:position + len(delimiter)]), None
+
+        while True:
+            keys = objects.keys_range(start=start, stop=stop, after=after, limit=batch_size)
+            if not keys:
+                return
+
+            for key in keys:
+                if delimiter:
+                    position = key.find(delimiter, len(prefix))
+                    if position >= 0:
+                        common_prefix = key[:position + len(delimiter)]
+                        yield common_prefix, True
+                        start, after = prefix_upper_bound(common_prefix), None
+                        if start is None:
+                            return
+                        break
+                yield key, False
+                after = key
+            else:
+                if len(keys) < batch_size:
+                    return
 
 
-    def object_list(self):
-        ''' returns a list of objects
+    def objects_metadata(self):
+        ''' returns the shared handle to objects metadata table
         '''
-        objects_metadata = SqliteDict(self._meta.filename, 'objects')
-        return objects_metadata.keys()
+        return registry.get(self.metadata_path, 'objects', factory=ObjectCatalog)
 
 
 
@@ -220,14 +866,16 @@ class BucketCollection(object):
             )
 
     def list(self):
-        ''' return the list of buckets
+        ''' return the list of buckets, the info of bucket includes `object-count` and `bytes-used`
         '''
         buckets_info = list()
 
         for bucket_name in os.listdir(self._storage_path):
             path = os.path.join(self._storage_path, bucket_name)
-            if os.path.isdir(path):
+            if os.path.isdir(path) and bucket_name != BLOB_POOL_NAME:
                 bucket = Bucket(bucket_name=bucket_name, storage_path=self._storage_path)
-                buckets_info.append(bucket.info())
+                info = bucket.info()
+                info.update(bucket.stats())
+                buckets_info.append(info)
 
         return buckets_info
@@ -0,0 +1,282 @@
+#
+#   Objects catalog
+#
+#   The metadata of objects is stored as pickled value, as in SqliteDict, and the well-known
+#   fields are copied to typed, indexed columns of the same row. The rest of metadata is kept
+#   as JSON in `extra` column. The search by the fields and the ordering are done by SQLite.
+#
+#   The number of objects and the total of content-length are maintained by triggers
+#   in the `<table>_stats` row, in the same transaction as the change of objects.
+#
+#   The writes of concurrent requests are batched: the rows stored and removed by write() are
+#   committed by one transaction per group of calls, the group is collected for WRITE_BATCH_WINDOW
+#   seconds or until it has WRITE_BATCH_SIZE rows. The lone writer is committed at once, the window
+#   is waited only under concurrent writes. A failed transaction fails all calls of the group.
+#
+
+import re
+import json
+import falcon
+
+from common import prefix_upper_bound
+from sqlitedict import SqliteDict, encode, decode
+from durability import Group, GroupCommitter, committer, database_paths
+
+
+def text(value=u''):
+    ''' returns unicode value of text column
+    '''
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    return unicode(value)
+
+
+# metadata key: (column, type), the columns are NOT NULL, the absent field is 0 or ''
+FIELDS = {
+    'content-length': ('content_length', int),
+    'content-type': ('content_type', text),
+    'content-name': ('content_name', text),
+    'content-md5': ('content_md5', text),
+    'content-sha1': ('content_sha1', text),
+    'content-sha256': ('content_sha256', text),
+    'created': ('created', int),
+}
+
+OPERATORS = ('<=', '>=', '!=', '^=', '=', '<', '>')
+
+PREDICATE = re.compile(r'^\s*([a-z0-9\-]+)\s*(%s)(.*)$' % '|'.join(re.escape(op) for op in OPERATORS))
+
+# the rows are reindexed by batches of this size, in one transaction per batch
+REINDEX_BATCH_SIZE = 1000
+
+# the max time the writes of concurrent requests are collected, in seconds, and the max rows per transaction
+WRITE_BATCH_WINDOW = 0.002
+WRITE_BATCH_SIZE = 500
+
+# the stats row is initialized from existing rows, in the same transaction as the triggers are created.
+# REPLACE deletes the old row without delete triggers, so it's subtracted before insert
+STATS_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS {table}_stats '
+        '(id INTEGER PRIMARY KEY, objects INTEGER NOT NULL, bytes INTEGER NOT NULL)',
+    'CREATE TRIGGER IF NOT EXISTS {table}_stats_replace BEFORE INSERT ON {table} '
+        'WHEN EXISTS (SELECT 1 FROM {table} WHERE key = NEW.key) '
+        'BEGIN UPDATE {table}_stats SET objects = objects - 1, '
+        'bytes = bytes - (SELECT content_length FROM {table} WHERE key = NEW.key) WHERE id = 0; END',
+    'CREATE TRIGGER IF NOT EXISTS {table}_stats_insert AFTER INSERT ON {table} '
+        'BEGIN UPDATE {table}_stats SET objects = objects + 1, bytes = bytes + NEW.content_length WHERE id = 0; END',
+    'CREATE TRIGGER IF NOT EXISTS {table}_stats_update AFTER UPDATE OF content_length ON {table} '
+        'BEGIN UPDATE {table}_stats SET bytes = bytes - OLD.content_length + NEW.content_length WHERE id = 0; END',
+    'CREATE TRIGGER IF NOT EXISTS {table}_stats_delete AFTER DELETE ON {table} '
+        'BEGIN UPDATE {table}_stats SET objects = objects - 1, bytes = bytes - OLD.content_length WHERE id = 0; END',
+    'INSERT OR IGNORE INTO {table}_stats (id, objects, bytes) '
+        'SELECT 0, COUNT(*), IFNULL(SUM(content_length), 0) FROM {table}',
+)
+
+
+def parse_query(predicates):
+    ''' returns the list of (field, operator, value) from the list of predicates like
+    `content-type=image/png` or `content-length>1048576`
+
+    Operators: =, !=, <, <=, >, >=, ^= (starts with)
+    '''
+    parsed = list()
+    for predicate in predicates:
+        matched = PREDICATE.match(predicate)
+        if not matched or matched.group(1) not in FIELDS:
+            raise falcon.HTTPInvalidParam(
+                'The predicate is expected as <field><operator><value>, the fields: %s' % ', '.join(sorted(FIELDS)),
+                param_name='query'
+            )
+        field, operator, value = matched.groups()
+        if operator == '^=' and FIELDS[field][1] is int:
+            raise falcon.HTTPInvalidParam('The ^= operator is supported for text fields', param_name='query')
+        try:
+            value = FIELDS[field][1](value)
+        except ValueError:
+            raise falcon.HTTPInvalidParam('The value of %s shall be integer' % field, param_name='query')
+        parsed.append((field, operator, value))
+    return parsed
+
+
+def parse_order(order):
+    ''' returns (field, descending) from the order parameter like `content-length` or `-created`
+    '''
+    if not order:
+        return None, False
+    descending = order.startswith('-')
+    field = order.lstrip('-')
+    if field not in FIELDS:
+        raise falcon.HTTPInvalidParam(
+            'The objects can be ordered by: %s' % ', '.join(sorted(FIELDS)), param_name='order'
+        )
+    return field, descending
+
+
+def columns(metadata):
+    ''' returns the tuple of typed column values and JSON of the rest of metadata
+    '''
+    values = list()
+    for field, (column, column_type) in sorted(FIELDS.items()):
+        value = metadata.get(field)
+        try:
+            values.append(column_type(value) if value is not None else column_type())
+        except (TypeError, ValueError):
+            values.append(column_type())
+    extra = dict((k, v) for k, v in metadata.items() if k not in FIELDS)
+    values.append(json.dumps(extra, sort_keys=True))
+    return tuple(values)
+
+
+class WriteGroup(Group):
+    ''' the statements of concurrent writes committed by one transaction
+    '''
+    def __init__(self):
+
+        super(WriteGroup, self).__init__()
+        self.catalog = None
+        self.statements = list()
+        self.durable = False
+
+
+    def add(self, catalog, statements, durable=False):
+
+        self.catalog = catalog
+        self.statements.extend(statements)
+        self.size += len(statements)
+        self.durable = self.durable or durable
+
+
+    def flush(self):
+        ''' commits the statements, the log is synced if any write of the group is durable
+        '''
+        self.catalog.conn.execute_batch(self.statements)
+        if self.durable:
+            committer.submit(*database_paths(self.catalog.filename))
+
+
+class ObjectCatalog(SqliteDict):
+    ''' SqliteDict of objects metadata with typed columns, the table is migrated on opening
+    '''
+    def __init__(self, *args, **kwargs):
+
+        # SqliteDict is old-style class in python 2
+        SqliteDict.__init__(self, *args, **kwargs)
+
+        self.conn.transaction(self._migrate)
+        self.reindex()
+        self._writes = GroupCommitter(WriteGroup, window=WRITE_BATCH_WINDOW, max_size=WRITE_BATCH_SIZE)
+
+
+    def _migrate(self, cursor):
+        ''' adds the missing columns, indexes and the stats, in the immediate transaction: the table
+        opened concurrently by requests or processes is migrated once, the others find it migrated
+        '''
+        existing = set(row[1] for row in cursor.execute('PRAGMA table_info(%s)' % self.tablename).fetchall())
+        for field, (column, column_type) in sorted(FIELDS.items()):
+            if column not in existing:
+                cursor.execute('ALTER TABLE %s ADD COLUMN %s %s NOT NULL DEFAULT %s' % (
+                    self.tablename, column, 'INTEGER' if column_type is int else 'TEXT',
+                    '0' if column_type is int else "''"
+                ))
+            cursor.execute('CREATE INDEX IF NOT EXISTS %s_%s ON %s (%s, key)' % (
+                self.tablename, column, self.tablename, column
+            ))
+        if 'extra' not in existing:
+            cursor.execute('ALTER TABLE %s ADD COLUMN extra TEXT' % self.tablename)
+        # the rows to reindex are found by the partial index, it's empty once the table is migrated
+        cursor.execute('CREATE INDEX IF NOT EXISTS %s_unindexed ON %s (key) WHERE extra IS NULL' % (
+            self.tablename, self.tablename
+        ))
+        # the rows not reindexed yet are counted with content-length 0, the reindex replaces them
+        # and the triggers count them again
+        for statement in STATS_SCHEMA:
+            cursor.execute(statement.format(table=self.tablename))
+
+
+    def __setitem__(self, key, value):
+
+        self.conn.execute(self._replace_statement(), (key, encode(value)) + columns(value))
+
+
+    def update(self, items=(), **kwds):
+
+        if hasattr(items, 'items'):
+            items = items.items()
+        self.conn.execute_batch([
+            (self._replace_statement(), (key, encode(value)) + columns(value)) for key, value in items
+        ])
+        if kwds:
+            self.update(kwds)
+
+
+    def write(self, updates=(), deletes=(), durable=False):
+        ''' stores the (key, metadata) pairs of `updates` and removes the keys of `deletes` in 
+        the transaction shared with concurrent calls. Returns when the transaction is committed,
+        and the log is synced to disk if `durable` is True
+        '''
+        statements = [(self._replace_statement(), (key, encode(value)) + columns(value)) for key, value in updates]
+        statements.extend(('DELETE FROM %s WHERE key = ?' % self.tablename, (key,)) for key in deletes)
+        if statements:
+            self._writes.submit(self, statements, durable)
+
+
+    def reindex(self):
+        ''' fills the typed columns of the rows stored before the catalog, by batches
+        '''
+        GET_ROWS = 'SELECT key, value FROM %s WHERE extra IS NULL LIMIT %d' % (self.tablename, REINDEX_BATCH_SIZE)
+        while True:
+            rows = list(self.conn.select(GET_ROWS))
+            if not rows:
+                break
+            self.update((key, decode(value)) for key, value in rows)
+
+
+    def stats(self):
+        ''' returns the dict with the number of objects and the total of content-length, in bytes
+        '''
+        objects, total = self.conn.select_one('SELECT objects, bytes FROM %s_stats WHERE id = 0' % self.tablename)
+        return {'objects': objects, 'bytes': total}
+
+
+    def search(self, predicates=(), order=None, descending=False, after=None, limit=None):
+        ''' returns the list of (key, metadata, order value) of the objects matching all predicates,
+        ordered by the field and the key. `after` is (order value, key) of the last object of
+        the previous page
+        '''
+        conditions, args = list(), list()
+        for field, operator, value in predicates:
+            column = FIELDS[field][0]
+            if operator == '^=':
+                # the prefix is searched as the range of the index
+                upper_bound = prefix_upper_bound(value)
+                conditions.append('%s >= ?' % column)
+                args.append(value)
+                if upper_bound is not None:
+                    conditions.append('%s < ?' % column)
+                    args.append(upper_bound)
+            else:
+                conditions.append('%s %s ?' % (column, operator))
+                args.append(value)
+
+        column = FIELDS[order][0] if order else 'key'
+        if after is not None:
+            operator = '<' if descending else '>'
+            conditions.append('(%s %s ? OR (%s = ? AND key %s ?))' % (column, operator, column, operator))
+            args.extend([after[0], after[0], after[1]])
+
+        SEARCH = 'SELECT key, value, %s FROM %s' % (column, self.tablename)
+        if conditions:
+            SEARCH += ' WHERE ' + ' AND '.join(conditions)
+        direction = ' DESC' if descending else ''
+        SEARCH += ' ORDER BY %s%s, key%s' % (column, direction, direction)
+        if limit is not None:
+            SEARCH += ' LIMIT %d' % limit
+        return [(key, decode(value), order_value) for key, value, order_value in self.conn.select(SEARCH, tuple(args))]
+
+
+    def _replace_statement(self):
+
+        names = [column for _, (column, _) in sorted(FIELDS.items())] + ['extra']
+        return 'REPLACE INTO %s (key, value, %s) VALUES (?, ?, %s)' % (
+            self.tablename, ', '.join(names), ', '.join('?' * len(names))
+        )
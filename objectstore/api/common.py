@@ -1,4 +1,6 @@
 import os
+import sys
+import shutil
 
 class BaseAPI(object):
 
@@ -10,3 +12,58 @@ class BaseAPI(object):
         else:
             raise RuntimeError('The storage path is not configured, "%s"' % storage_path)
 
+
+
+def has_param(req, name):
+    ''' returns True if the query string contains the parameter, with or without a value
+
+    The flags without value, like `?uploads`, are not available via req.params
+    '''
+    if name in req.params:
+        return True
+    return name in [param.split('=', 1)[0] for param in req.query_string.split('&')]
+
+
+def pairtree_path(filehash, pairs=2):
+    ''' returns pairtree path based on filehash value
+    
+    filehash value: string like fa0ec35541f4f17a68e3d03acd04146f39ae5d2e
+    
+    >>> pairtree_path('fa0ec35541f4f17a68e3d03acd04146f39ae5d2e', pairs=2)
+    '/fa/0e/fa0ec35541f4f17a68e3d03acd04146f39ae5d2e
+    '''
+    path = ''
+    if len(filehash) <= 2 * pairs:
+        raise RuntimeError('The file hash is too short. Expected more then %d, detected %d' % (2 * pairs, len(filehash)))
+    for i in range(pairs):
+        path = os.path.join(path, filehash[2*i:2*i+2])
+    return os.path.join(path, filehash)
+
+
+def movefile(source, target):
+    ''' move file from source to target. 
+    If target directory doesn't exist, it will create it
+    '''
+    target_dir = os.path.dirname(target)
+    if not os.path.exists(target_dir):
+        os.makedirs(target_dir)
+    shutil.move(source, target)
+
+
+def prefix_upper_bound(prefix):
+    ''' returns the smallest string which is greater than any string starting with the prefix,
+    None if there's no such string
+
+    >>> prefix_upper_bound(u'ab')
+    u'ac'
+    '''
+    if isinstance(prefix, unicode):
+        max_code, to_char = sys.maxunicode, unichr
+    else:
+        max_code, to_char = 0xff, chr
+
+    for i in reversed(range(len(prefix))):
+        code = ord(prefix[i])
+        if code < max_code:
+            return prefix[:i] + to_char(code + 1)
+    return None
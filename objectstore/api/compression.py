@@ -0,0 +1,150 @@
+#
+#   Compression of stored objects
+#
+#   The codecs are based on stdlib modules. The objects compressed by `gzip` and `zlib` codecs
+#   can be passed to the client as is, with `Content-Encoding: gzip` or `deflate`.
+#
+
+import bz2
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+
+# size of compressed chunks passed to the decompressor
+READ_CHUNK_SIZE = 2 ** 14
+
+
+class Codec(object):
+
+    def __init__(self, name, compressor, decompressor, content_encoding=None, levels=range(10)):
+
+        self.name = name
+        self._compressor = compressor
+        self._decompressor = decompressor
+        self.content_encoding = content_encoding
+        self.levels = levels
+
+
+    def compressor(self, level=None):
+        ''' returns new compressor object with compress(data) and flush() methods
+        '''
+        return self._compressor(level)
+
+
+    def decompressor(self):
+        ''' returns new decompressor object with decompress(data) method
+        '''
+        return self._decompressor()
+
+
+def _zlib_compressor(wbits):
+
+    def compressor(level):
+        return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if level is None else level, zlib.DEFLATED, wbits)
+    return compressor
+
+
+class _Bz2Compressor(object):
+    ''' BZ2Compressor with flush() which can be called once, as for zlib
+    '''
+    def __init__(self, level):
+
+        self._compressor = bz2.BZ2Compressor(9 if level is None else level)
+        self.compress = self._compressor.compress
+
+
+    def flush(self):
+
+        return self._compressor.flush()
+
+
+# the compression levels of zlib, -1 is the default of the library
+ZLIB_LEVELS = range(-1, 10)
+
+CODECS = {
+    'zlib': Codec(
+        'zlib', _zlib_compressor(zlib.MAX_WBITS), lambda: zlib.decompressobj(zlib.MAX_WBITS), 'deflate', ZLIB_LEVELS
+    ),
+    'gzip': Codec(
+        'gzip', _zlib_compressor(16 + zlib.MAX_WBITS), lambda: zlib.decompressobj(16 + zlib.MAX_WBITS), 'gzip', ZLIB_LEVELS
+    ),
+    'bz2': Codec('bz2', _Bz2Compressor, bz2.BZ2Decompressor, levels=range(1, 10)),
+}
+
+if lzma is not None:
+    CODECS['lzma'] = Codec(
+        'lzma',
+        lambda level: lzma.LZMACompressor(preset=level),
+        lzma.LZMADecompressor
+    )
+
+
+def get_codec(name):
+    ''' returns the codec by name, None for unknown codec
+    '''
+    return CODECS.get(name)
+
+
+def accepts_encoding(header, encoding):
+    ''' returns True if the encoding is acceptable according to Accept-Encoding header
+
+    [RFC 7231, Accept-Encoding](https://tools.ietf.org/html/rfc7231#section-5.3.4)
+    '''
+    if not header or not encoding:
+        return False
+
+    # the quality of the coding itself takes precedence over `*`, q=0 refuses the coding
+    qualities = dict()
+    for item in header.split(','):
+        params = item.split(';')
+        coding = params[0].strip().lower()
+        if coding not in (encoding, '*'):
+            continue
+        quality = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities.setdefault(coding, quality)
+    return qualities.get(encoding, qualities.get('*', 0.0)) > 0
+
+
+class DecompressingReader(object):
+    ''' file-like object, decompresses the content of compressed file on the fly
+    '''
+    def __init__(self, fileobj, codec):
+
+        self._file = fileobj
+        self._decompressor = codec.decompressor()
+        self._buffer = b''
+        self._eof = False
+
+
+    def read(self, size=-1):
+
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            data = self._file.read(READ_CHUNK_SIZE)
+            if not data:
+                self._eof = True
+                if hasattr(self._decompressor, 'flush'):
+                    self._buffer += self._decompressor.flush()
+                break
+            self._buffer += self._decompressor.decompress(data)
+
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+    def close(self):
+
+        self._file.close()
@@ -0,0 +1,182 @@
+#
+#   Durability of stored objects
+#
+#   The bucket setting `durability`:
+#   - none, default: the object files and the metadata are left in the page cache, an acknowledged
+#     object can be lost on power loss
+#   - data: the object file and the new directory entries are synced before the metadata is written,
+#     the metadata never refers to a lost file, but the metadata itself can be lost
+#   - data+metadata: the metadata commit is synced too before the response
+#
+#   A fsync per request collapses the throughput of concurrent writes. The requests are synced by
+#   group commit instead: the request which finds no flush in progress becomes the leader, waits
+#   for the window so the concurrent requests join its group, and syncs the union of their files
+#   and directories, one fsync per path. The requests arriving during the flush form the next group.
+#   The window is adaptive: the lone writer, whose previous group had no other members and who
+#   finds no one waiting, flushes at once.
+#   The metadata is synced by fsync of the WAL file of bucket metadata, which is shared by all
+#   requests to the bucket.
+#
+#   GroupCommitter is generic: the metadata writes of concurrent requests are committed by groups
+#   too, see catalog.py
+#
+
+import os
+import time
+import errno
+import threading
+
+from executor import offload
+
+
+DURABILITY_MODES = ('none', 'data', 'data+metadata')
+DEFAULT_DURABILITY = 'none'
+
+# the time the leader waits for concurrent requests to join the group, in seconds
+DEFAULT_WINDOW = 0.002
+
+
+def fsync_path(path):
+    ''' syncs the file or the directory to disk, the path removed concurrently is skipped
+    '''
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError as err:
+        if err.errno == errno.ENOENT:
+            return
+        raise
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def directory_paths(path, root):
+    ''' returns the directories to sync for durability of the new entry in the directory `path`
+    under `root`: the directory and the directories which will be created on the way to it, with
+    the parent of the topmost one
+    '''
+    directories = [path]
+    while not os.path.isdir(path) and path != root:
+        path = os.path.dirname(path)
+        directories.append(path)
+    return directories
+
+
+def file_paths(filepath, root):
+    ''' returns (files, directories) to sync for durability of the file which is going to be placed
+    to `filepath` under `root`
+    '''
+    return [filepath], directory_paths(os.path.dirname(filepath), root)
+
+
+def database_paths(filename):
+    ''' returns (files, directories) to sync for durability of the commits to the sqlite file
+    in WAL mode
+    '''
+    return [filename + '-wal'], [os.path.dirname(filename)]
+
+
+class Group(object):
+    ''' the items of concurrent calls flushed together, `size` is the number of items
+    '''
+    def __init__(self):
+
+        self.size = 0
+        self.done = False
+        self.error = None
+
+
+class SyncGroup(Group):
+    ''' the files and directories of the requests synced together
+    '''
+    def __init__(self):
+
+        super(SyncGroup, self).__init__()
+        self.files = set()
+        self.directories = set()
+
+
+    def add(self, files=(), directories=()):
+
+        self.files.update(files)
+        self.directories.update(directories)
+        self.size += 1
+
+
+    def flush(self):
+
+        offload(self._fsync)
+
+
+    def _fsync(self):
+        ''' syncs the files, then the directories with their entries
+        '''
+        for path in sorted(self.files):
+            fsync_path(path)
+        for path in sorted(self.directories):
+            fsync_path(path)
+
+
+class GroupCommitter(object):
+    ''' flushes the items of concurrent calls by groups. The call which finds no flush in progress
+    becomes the leader: it waits up to `window` seconds, or until the group has `max_size` items,
+    and flushes the group for all its members. The leader does not wait if it's the only member
+    and the previous group had one member too
+    '''
+    def __init__(self, group_class=SyncGroup, window=DEFAULT_WINDOW, max_size=None):
+
+        self.window = window
+        self.max_size = max_size
+        self._group_class = group_class
+        self._condition = threading.Condition(threading.Lock())
+        self._pending = None
+        self._flushing = False
+        self._concurrent = False
+
+
+    def submit(self, *args, **kwargs):
+        ''' adds the item to the group, `group.add(*args, **kwargs)`, and returns when the group is
+        flushed. The error of the flush is raised by all calls of the group
+        '''
+        with self._condition:
+            if self._pending is None:
+                self._pending = self._group_class()
+            group = self._pending
+            group.add(*args, **kwargs)
+            if self._is_full(group):
+                self._condition.notify_all()
+            while self._flushing and not group.done:
+                self._condition.wait()
+
+            leader = not group.done
+            if leader:
+                self._flushing = True
+                deadline = time.time() + self.window if self._concurrent or group.size > 1 else 0
+                while not self._is_full(group) and time.time() < deadline:
+                    self._condition.wait(deadline - time.time())
+                self._pending = None
+
+        if leader:
+            try:
+                group.flush()
+            except Exception as err:
+                group.error = err
+            finally:
+                with self._condition:
+                    group.done = True
+                    self._flushing = False
+                    self._concurrent = group.size > 1
+                    self._condition.notify_all()
+
+        if group.error is not None:
+            raise group.error
+
+
+    def _is_full(self, group):
+
+        return self.max_size is not None and group.size >= self.max_size
+
+
+# the committer of file syncs of the process, the groups are shared by all buckets
+committer = GroupCommitter(SyncGroup)
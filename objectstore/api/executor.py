@@ -0,0 +1,55 @@
+#
+#   Executor of blocking work
+#
+#   Under gunicorn gevent workers the requests are greenlets of one event loop, so a slow client
+#   waits on its socket without holding a worker, but CPU-bound and disk work blocks every
+#   connection of the process. offload() runs such work in the bounded pool of native threads
+#   and the calling greenlet waits for the result cooperatively. hashlib, zlib and file writes
+#   release the GIL, so the pool also runs them in parallel.
+#
+#   Without gevent, under sync or gthread workers, the work is run in place.
+#
+#   The sqlite statements are offloaded too: under gevent SqliteDict uses the direct backend,
+#   the connections belong to the executor threads (see sqlitedict.py). The locks shared by
+#   the greenlets and the executor threads need gevent 20.12 or later, `pip install objectstore[gevent]`
+#
+
+import os
+
+try:
+    from gevent import monkey as gevent_monkey
+    from gevent.threadpool import ThreadPool as GeventThreadPool
+except ImportError:
+    gevent_monkey = None
+
+
+# the max number of native threads running offloaded work, per process
+DEFAULT_MAX_WORKERS = int(os.environ.get('OBJECTSTORE_EXECUTOR_WORKERS', 16))
+
+_executor = {'pool': None, 'max_workers': DEFAULT_MAX_WORKERS}
+
+
+def is_cooperative():
+    ''' returns True if the process is served by gevent: the socket module is monkey-patched
+    '''
+    return gevent_monkey is not None and gevent_monkey.is_module_patched('socket')
+
+
+def configure(max_workers=DEFAULT_MAX_WORKERS):
+    ''' sets the max number of native threads, the pool is created by the first offloaded call
+    '''
+    if _executor['pool'] is not None:
+        _executor['pool'].kill()
+        _executor['pool'] = None
+    _executor['max_workers'] = max_workers
+
+
+def offload(func, *args, **kwargs):
+    ''' returns func(*args, **kwargs), run by the pool of native threads if the process
+    is cooperative, otherwise in place
+    '''
+    if not is_cooperative():
+        return func(*args, **kwargs)
+    if _executor['pool'] is None:
+        _executor['pool'] = GeventThreadPool(_executor['max_workers'])
+    return _executor['pool'].apply(func, args, kwargs)
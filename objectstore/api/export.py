@@ -0,0 +1,110 @@
+#
+#   Bucket export
+#
+#   The objects of a bucket are streamed as tar archive: the member `data/<object-id>` per object,
+#   with the original (decompressed) content, and `manifest.ndjson` at the end of the archive
+#   with one JSON line of object id and metadata per object.
+#
+#   The archive is generated lazily: the keys and the metadata are read by batches, the content
+#   is copied by blocks and the manifest is spooled to a temp file in the bucket, so the memory
+#   does not depend on the number or the size of objects.
+#
+
+import os
+import json
+import tarfile
+import tempfile
+
+from objects import BucketObject
+
+
+EXPORT_FORMATS = ('tar',)
+
+MANIFEST_NAME = 'manifest.ndjson'
+DATA_DIR = 'data'
+
+# the size of blocks copied from object files
+EXPORT_BLOCK_SIZE = 2 ** 16
+
+
+def tar_header(name, size, mtime=0):
+    ''' returns the tar header block(s) of the regular file
+    '''
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = mtime
+    info.mode = 0644
+    return info.tobuf(format=tarfile.GNU_FORMAT, encoding='utf-8', errors='strict')
+
+
+def tar_padding(size):
+    ''' returns the padding of member data to the tar block size
+    '''
+    remainder = size % tarfile.BLOCKSIZE
+    return tarfile.NUL * (tarfile.BLOCKSIZE - remainder) if remainder else ''
+
+
+def iter_copy(fileobj, length, block_size=EXPORT_BLOCK_SIZE):
+    ''' yields `length` bytes of the file by blocks. The archive is broken if the file
+    is shorter, so IOError is raised to abort the transfer
+    '''
+    remaining = length
+    while remaining > 0:
+        data = fileobj.read(min(block_size, remaining))
+        if not data:
+            raise IOError('The object content is shorter than its content-length')
+        remaining -= len(data)
+        yield data
+
+
+def iter_tar(entries, open_content, temp_path, block_size=EXPORT_BLOCK_SIZE):
+    ''' yields the tar archive of the objects and the manifest. `entries` yields (object id, metadata),
+    `open_content(object_id, metadata)` returns the file-like object of the original content
+    '''
+    written = 0
+    manifest = tempfile.TemporaryFile(dir=temp_path)
+    try:
+        for object_id, metadata in entries:
+            length = int(metadata['content-length'])
+            header = tar_header('%s/%s' % (DATA_DIR, object_id), length, metadata.get('created', 0))
+            yield header
+
+            content = open_content(object_id, metadata)
+            try:
+                for data in iter_copy(content, length, block_size):
+                    yield data
+            finally:
+                content.close()
+
+            padding = tar_padding(length)
+            yield padding
+            written += len(header) + length + len(padding)
+            manifest.write(json.dumps({u'object-id': object_id, u'metadata': metadata}) + '\n')
+
+        length = manifest.tell()
+        manifest.seek(0)
+        header = tar_header(MANIFEST_NAME, length)
+        yield header
+        for data in iter_copy(manifest, length, block_size):
+            yield data
+        padding = tar_padding(length)
+        yield padding
+        written += len(header) + length + len(padding)
+    finally:
+        manifest.close()
+
+    # the end of archive is two zero blocks, the archive is padded to the record size
+    written += 2 * tarfile.BLOCKSIZE
+    yield tarfile.NUL * (2 * tarfile.BLOCKSIZE + (-written % tarfile.RECORDSIZE))
+
+
+def export_bucket(bucket, prefix=u'', marker=None):
+    ''' yields the tar archive of the bucket objects with the keys starting with the prefix and
+    following the marker, in key order. The ranges of keys can be exported in parallel
+    '''
+    def open_content(object_id, metadata):
+        return BucketObject(object_id, bucket=bucket).open_content(metadata)
+
+    return iter_tar(
+        bucket.iter_objects(prefix=prefix, marker=marker), open_content, os.path.join(bucket.bucket_path, 'tmp')
+    )
@@ -0,0 +1,268 @@
+#
+#   Registry of open SqliteDict handles
+#
+#   Every SqliteDict starts its own worker thread and sqlite connection. The registry
+#   keeps the handles opened for bucket metadata files and shares them between requests.
+#
+#   The requests borrow the handles: get() returns the borrowed handle, the reference shared
+#   by all current borrowers, and the handle is released when the last reference to it is
+#   dropped. A handle evicted from the registry or found stale is closed on its last release,
+#   not under a request which still uses it.
+#
+
+import os
+import atexit
+import weakref
+import threading
+
+from functools import partial
+from collections import OrderedDict
+
+from sqlitedict import SqliteDict
+
+
+# max number of open handles per process
+DEFAULT_CAPACITY = 128
+
+# the metadata files are in WAL mode: readers do not block the writer, the commit appends to the log
+# without fsync and the file stays consistent on power loss. The commits of the buckets with durable
+# metadata are made durable by the group commit of the log, see durability.py
+JOURNAL_MODE = 'WAL'
+SYNCHRONOUS = 'NORMAL'
+
+
+class BorrowedHandle(object):
+    ''' the reference to the handle in the registry, the attributes and the mapping interface
+    are of the handle
+    '''
+    def __init__(self, handle):
+
+        object.__setattr__(self, '_handle', handle)
+
+
+    def __getattr__(self, name):
+
+        return getattr(self._handle, name)
+
+
+    def __setattr__(self, name, value):
+
+        setattr(self._handle, name, value)
+
+
+    def __getitem__(self, key):
+
+        return self._handle[key]
+
+
+    def __setitem__(self, key, value):
+
+        self._handle[key] = value
+
+
+    def __delitem__(self, key):
+
+        del self._handle[key]
+
+
+    def __contains__(self, key):
+
+        return key in self._handle
+
+
+    def __iter__(self):
+
+        return iter(self._handle)
+
+
+    def __len__(self):
+
+        return len(self._handle)
+
+
+    def __nonzero__(self):
+
+        return bool(self._handle)
+
+
+    def __repr__(self):
+
+        return 'BorrowedHandle(%r)' % self._handle
+
+
+class HandleEntry(object):
+    ''' the handle in the registry: the inode of the file it was opened for, the weak reference
+    to its current borrowed handle and whether it's removed from the registry
+    '''
+    def __init__(self, handle, inode):
+
+        self.handle = handle
+        self.inode = inode
+        self.borrowed = None
+        self.retired = False
+        self.closed = False
+
+
+class HandleRegistry(object):
+    ''' bounded LRU registry of open handles, keyed by (filename, tablename)
+    '''
+    def __init__(self, capacity=DEFAULT_CAPACITY, journal_mode=JOURNAL_MODE, synchronous=SYNCHRONOUS):
+
+        if capacity < 1:
+            raise RuntimeError('The registry capacity shall be positive, value: %s' % capacity)
+
+        self._capacity = capacity
+        self._journal_mode = journal_mode
+        self._synchronous = synchronous
+        self._handles = OrderedDict()
+        # reentrant: the borrowed handle can be released by the garbage collector at any moment
+        self._lock = threading.RLock()
+
+
+    def __len__(self):
+
+        return len(self._handles)
+
+
+    def __contains__(self, key):
+
+        return key in self._handles
+
+
+    def get(self, filename, tablename, factory=SqliteDict):
+        ''' returns the borrowed handle for the table in the sqlite file
+
+        The handle is opened by `factory(filename, tablename, autocommit=True, journal_mode=...,
+        synchronous=...)` if it's not in the registry yet, the factory is called without the registry
+        lock. If the file was removed or replaced since the handle was opened (a bucket removed outside
+        of the service), the stale handle is removed and reopened.
+        '''
+        key = (filename, tablename)
+        inode = self._inode(filename)
+
+        with self._lock:
+            entry = self._handles.pop(key, None)
+            if entry is not None and entry.inode == inode:
+                self._handles[key] = entry
+                return self._borrow(entry)
+            retired = self._retire([entry] if entry is not None else [])
+        self._close(retired)
+
+        handle = factory(
+            filename, tablename, autocommit=True, journal_mode=self._journal_mode, synchronous=self._synchronous
+        )
+        entry = HandleEntry(handle, self._inode(filename))
+        with self._lock:
+            current = self._handles.get(key)
+            if current is not None and current.inode == entry.inode:
+                # the handle is opened by concurrent request, the new one is not used
+                retired = [handle]
+                borrowed = self._borrow(current)
+            else:
+                self._handles[key] = entry
+                retired = self._retire([current] if current is not None else []) + self._evict()
+                borrowed = self._borrow(entry)
+        self._close(retired)
+        return borrowed
+
+
+    def invalidate(self, path):
+        ''' closes and removes all handles opened for files under the path, the borrowed too
+        '''
+        path = os.path.join(os.path.abspath(path), '')
+        with self._lock:
+            keys = [key for key in self._handles if os.path.abspath(key[0]).startswith(path)]
+            entries = [self._handles.pop(key) for key in keys]
+            handles = self._take(entries)
+
+        for handle in handles:
+            handle.close()
+
+
+    def clear(self):
+        ''' closes all handles, the borrowed too
+        '''
+        with self._lock:
+            handles = self._take(self._handles.values())
+            self._handles.clear()
+
+        for handle in handles:
+            handle.close()
+
+
+    def _borrow(self, entry):
+        ''' returns the borrowed handle of the entry, shared by current borrowers. The lock shall be held
+        '''
+        borrowed = entry.borrowed() if entry.borrowed is not None else None
+        if borrowed is None:
+            borrowed = BorrowedHandle(entry.handle)
+            entry.borrowed = weakref.ref(borrowed, partial(self._release, entry))
+        return borrowed
+
+
+    def _release(self, entry, reference):
+        ''' called when the last reference to the borrowed handle is dropped, the retired handle is closed
+        '''
+        with self._lock:
+            if entry.borrowed is reference:
+                entry.borrowed = None
+            handles = self._take([entry], unused=True)
+        self._close(handles)
+
+
+    def _evict(self):
+        ''' removes the least recently used handles above the capacity, returns the handles to close.
+        The lock shall be held
+        '''
+        entries = list()
+        while len(self._handles) > self._capacity:
+            entries.append(self._handles.popitem(last=False)[1])
+        return self._retire(entries)
+
+
+    def _retire(self, entries):
+        ''' marks the entries removed from the registry, returns the handles which are not borrowed
+        to close. The lock shall be held
+        '''
+        for entry in entries:
+            entry.retired = True
+        return self._take(entries, unused=True)
+
+
+    @staticmethod
+    def _take(entries, unused=False):
+        ''' returns the handles of the entries to close, once per handle: all or, if `unused`,
+        retired and not borrowed ones. The lock shall be held
+        '''
+        handles = list()
+        for entry in entries:
+            if entry.closed:
+                continue
+            if unused and (not entry.retired or (entry.borrowed is not None and entry.borrowed() is not None)):
+                continue
+            entry.closed = True
+            handles.append(entry.handle)
+        return handles
+
+
+    @staticmethod
+    def _close(handles):
+
+        for handle in handles:
+            handle.close()
+
+
+    @staticmethod
+    def _inode(filename):
+
+        try:
+            return os.stat(filename).st_ino
+        except OSError:
+            return None
+
+
+# process-wide registry, used by buckets and objects
+registry = HandleRegistry()
+
+# the handles are closed before the interpreter shutdown clears module globals
+atexit.register(registry.clear)
@@ -0,0 +1,315 @@
+#
+#   Bulk ingest
+#
+#   Loads the files of a directory tree into a bucket without HTTP: the files are hashed
+#   in a process pool, placed into the pairtree (copied, moved or hardlinked) and the metadata
+#   is committed by batches, one transaction per batch.
+#
+#   The journal in the bucket's tmp directory makes the ingest resumable: each batch is recorded
+#   before its files are placed and marked as committed after the metadata is committed. The batch
+#   interrupted after placing the files is recovered from the journal on the next run.
+#
+#   In move mode the file is renamed straight to the pairtree, so it's either in the source tree
+#   or in the bucket at any moment. The file on other filesystem is copied and removed from
+#   the source tree after it's placed. The duplicates, the files with the content already in
+#   the bucket, are removed from the source tree once their batch is committed, the rejected
+#   files are left there. Copy mode reads each file twice: by hashing worker and by copying,
+#   use link or move mode for large trees on the storage filesystem.
+#
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import mimetypes
+
+from multiprocessing import Pool
+
+from common import movefile
+from objects import StreamDigest
+from packs import PackStore
+from blobs import BlobPool, blob_key
+from durability import committer, file_paths, directory_paths, database_paths
+
+
+MODES = ('copy', 'move', 'link')
+
+# the number of files committed in one transaction
+DEFAULT_BATCH_SIZE = 1000
+
+# the size of blocks read by hashing workers
+READ_BLOCK_SIZE = 2 ** 20
+
+
+def hash_file(path):
+    ''' returns (path, dictionary of digests and content-length of the file), runs in worker processes
+    '''
+    digest = StreamDigest()
+    with open(path, 'rb') as _file:
+        while True:
+            data = _file.read(READ_BLOCK_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    hashes = digest.hexdigests()
+    hashes['content-length'] = digest.size
+    return path, hashes
+
+
+def walk(path):
+    ''' yields the paths of regular files in the directory tree, in sorted order. Symlinks are skipped
+    '''
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            filepath = os.path.join(dirpath, filename)
+            if os.path.isfile(filepath) and not os.path.islink(filepath):
+                yield filepath
+
+
+class Journal(object):
+    ''' append-only journal of ingested batches, one JSON record per line
+    '''
+    def __init__(self, path):
+
+        self.path = path
+
+
+    def load(self):
+        ''' returns (the set of paths of committed batches, the entries of the last uncommitted batch)
+        '''
+        done, pending = set(), list()
+        if not os.path.exists(self.path):
+            return done, pending
+
+        with open(self.path) as _file:
+            for line in _file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # the last line can be torn by crash
+                    break
+                if 'pending' in record:
+                    pending = record['pending']
+                elif 'committed' in record:
+                    done.update(entry['path'] for entry in pending)
+                    pending = list()
+        return done, pending
+
+
+    def append(self, record):
+        ''' appends the record, it's on disk when the method returns
+        '''
+        with open(self.path, 'a') as _file:
+            _file.write(json.dumps(record) + '\n')
+            _file.flush()
+            os.fsync(_file.fileno())
+
+
+    def remove(self):
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class BulkIngest(object):
+
+    def __init__(self, bucket, source_path, mode='copy', batch_size=DEFAULT_BATCH_SIZE, workers=None):
+
+        if mode not in MODES:
+            raise ValueError('Unknown mode %r, expected one of %s' % (mode, ', '.join(MODES)))
+
+        self._bucket = bucket
+        self._config = bucket.config
+        if self._config.compression:
+            raise RuntimeError('The bucket stores compressed objects, the files cannot be placed as is')
+
+        self._source_path = os.path.abspath(source_path)
+        self._mode = mode
+        self._batch_size = batch_size
+        self._workers = workers
+        self._temp_path = os.path.join(bucket.bucket_path, 'tmp')
+        self._objects = bucket.objects_metadata()
+        self._packs = PackStore(bucket.bucket_path, self._config.pack_segment_size)
+
+        self.journal = Journal(os.path.join(
+            self._temp_path, 'ingest-%s.journal' % hashlib.md5(self._source_path).hexdigest()
+        ))
+        self.stats = {'files': 0, 'bytes': 0, 'skipped': 0, 'duplicates': 0, 'rejected': 0, 'recovered': 0}
+
+
+    def run(self, progress=None):
+        ''' ingests the files which are not ingested by previous runs, returns the stats.
+        `progress(stats, elapsed)` is called after each committed batch
+        '''
+        started = time.time()
+        done, pending = self.journal.load()
+        if pending:
+            done.update(self._recover(pending))
+
+        pool = Pool(self._workers)
+        try:
+            batch = list()
+            for path, hashes in pool.imap_unordered(hash_file, self._paths(done), chunksize=16):
+                entry = self._entry(path, hashes)
+                if entry is not None:
+                    batch.append(entry)
+                if len(batch) >= self._batch_size:
+                    self._commit(batch)
+                    batch = list()
+                    if progress:
+                        progress(self.stats, time.time() - started)
+            if batch:
+                self._commit(batch)
+        finally:
+            pool.close()
+            pool.join()
+
+        self.journal.remove()
+        if progress:
+            progress(self.stats, time.time() - started)
+        return self.stats
+
+
+    def _paths(self, done):
+        ''' yields the paths of files to ingest, the files of committed batches are skipped
+        '''
+        for path in walk(self._source_path):
+            if self._relpath(path) in done:
+                self.stats['skipped'] += 1
+            else:
+                yield path
+
+
+    def _relpath(self, path):
+
+        return os.path.relpath(path, self._source_path).decode('utf-8', 'replace')
+
+
+    def _entry(self, path, hashes):
+        ''' returns the journal entry of the file, None if the file is rejected: empty or too large
+        '''
+        if hashes['content-length'] == 0 or \
+            (self._config.max_object_size and hashes['content-length'] > self._config.max_object_size):
+            self.stats['rejected'] += 1
+            return None
+
+        metadata = dict(hashes)
+        metadata['content-name'] = self._relpath(path)
+        content_type = mimetypes.guess_type(path)[0]
+        if content_type:
+            metadata['content-type'] = content_type
+        if self._config.dedup and hashes['content-length'] >= self._config.pack_threshold:
+            metadata['stored-blob'] = blob_key(hashes)
+        return {'path': self._relpath(path), 'object-id': hashes[self._config.object_key], 'metadata': metadata}
+
+
+    def _commit(self, batch):
+        ''' places the files of the batch and commits the metadata in one transaction. The objects
+        existing in the bucket or repeated in the batch are not placed, in move mode their files
+        are removed after the commit
+        '''
+        existing = self._objects.get_many(set(entry['object-id'] for entry in batch))
+        seen = set(existing)
+        created = int(time.time())
+        for entry in batch:
+            if entry['object-id'] in seen:
+                entry['duplicate'] = True
+                self.stats['duplicates'] += 1
+            else:
+                seen.add(entry['object-id'])
+                entry['metadata']['created'] = created
+
+        entries = [entry for entry in batch if not entry.get('duplicate')]
+        self.journal.append({'pending': batch})
+        files, directories = set(), set()
+        for entry in entries:
+            placed_files, placed_directories = self._place(entry)
+            files.update(placed_files)
+            directories.update(placed_directories)
+        # the batch is synced by one group, before the metadata refers to it
+        if self._config.durability != 'none':
+            committer.submit(files, directories)
+        self._objects.update((entry['object-id'], entry['metadata']) for entry in entries)
+        if self._config.durability == 'data+metadata':
+            committer.submit(*database_paths(self._bucket.metadata_path))
+        self.journal.append({'committed': len(entries)})
+        if self._mode == 'move':
+            for entry in batch:
+                if entry.get('duplicate'):
+                    os.remove(self._source(entry))
+
+        self.stats['files'] += len(entries)
+        self.stats['bytes'] += sum(entry['metadata']['content-length'] for entry in entries)
+
+
+    def _place(self, entry):
+        ''' moves the content of the file to the pack segment, the blob pool or the pairtree,
+        returns (files, directories) to sync for durability of the content
+        '''
+        source = self._source(entry)
+        object_id = entry['object-id']
+        if entry['metadata']['content-length'] < self._config.pack_threshold:
+            directories = directory_paths(os.path.join(self._bucket.bucket_path, 'packs'), self._bucket.bucket_path)
+            segment, _, _ = self._packs.store(object_id, source)
+            if self._mode == 'move':
+                os.remove(source)
+            return [self._packs.segment_path(segment)], directories
+
+        target = self._bucket.object_path(object_id, self._config)
+        files, directories = file_paths(target, self._bucket.bucket_path)
+        staged = self._stage(source)
+        if 'stored-blob' in entry['metadata']:
+            pool = BlobPool(self._bucket.storage_path)
+            directories.extend(pool.directory_paths(entry['metadata']['stored-blob']))
+            pool.link(entry['metadata']['stored-blob'], staged, target)
+        else:
+            movefile(staged, target)
+        if self._mode == 'move' and staged != source:
+            os.remove(source)
+        return files, directories
+
+
+    def _source(self, entry):
+
+        return os.path.join(self._source_path, entry['path'].encode('utf-8'))
+
+
+    def _stage(self, source):
+        ''' returns the path of the file with the content of source file, which is renamed to 
+        the pairtree afterwards. In move mode it's the source file itself, if it's on the storage 
+        filesystem; otherwise the copy or the hardlink in the bucket tmp directory
+        '''
+        if self._mode == 'move' and os.stat(source).st_dev == os.stat(self._temp_path).st_dev:
+            return source
+
+        handler, staged = tempfile.mkstemp(dir=self._temp_path)
+        os.close(handler)
+        if self._mode == 'link':
+            os.remove(staged)
+            os.link(source, staged)
+        else:
+            shutil.copyfile(source, staged)
+        return staged
+
+
+    def _recover(self, pending):
+        ''' commits the metadata of the placed objects of the interrupted batch, returns the paths
+        of recovered entries. The entries which were not placed are ingested again
+        '''
+        existing = self._objects.get_many(set(entry['object-id'] for entry in pending))
+        recovered = list()
+        for entry in pending:
+            if entry.get('duplicate') or entry['object-id'] in existing:
+                continue
+            placed = os.path.exists(self._bucket.object_path(entry['object-id'], self._config))
+            if placed or self._packs.location(entry['object-id']):
+                recovered.append(entry)
+
+        self.journal.append({'pending': recovered})
+        self._objects.update((entry['object-id'], entry['metadata']) for entry in recovered)
+        self.journal.append({'committed': len(recovered)})
+        self.stats['recovered'] = len(recovered)
+        return set(entry['path'] for entry in recovered)
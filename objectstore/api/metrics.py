@@ -0,0 +1,383 @@
+#
+#   Metrics
+#
+#   Counters and latency histograms kept in memory of the process, exposed by `/metrics`
+#   in Prometheus text format. A sample costs a lock and a few dict operations.
+#
+#   Each gunicorn worker has its own registry. If OBJECTSTORE_METRICS_DIR is set, the worker
+#   writes the snapshot of its registry to `metrics-<pid>-<started>.json` in the directory, at most
+#   once per FLUSH_INTERVAL seconds, and `/metrics` returns the sum of snapshots of all workers.
+#   The start time in the name keeps the worker with reused pid from overwriting the snapshot of
+#   the stopped one. The snapshots of stopped workers are added to `metrics-base.json` and removed,
+#   so the counters do not go back and the directory does not grow.
+#
+
+import os
+import json
+import time
+import fcntl
+import errno
+import bisect
+import logging
+import tempfile
+import threading
+
+import falcon
+
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+# the upper bounds of latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# the min interval between the writes of worker snapshot, in seconds
+FLUSH_INTERVAL = 1.0
+
+# the snapshot with the totals of stopped workers
+BASE_SNAPSHOT = 'metrics-base.json'
+
+# name: (type, help)
+METRICS = {
+    'objectstore_requests_total': ('counter', 'The number of requests by route, method and status'),
+    'objectstore_request_duration_seconds': ('histogram', 'The request latency by route and method'),
+    'objectstore_request_bytes_total': ('counter', 'The bytes of request bodies by route'),
+    'objectstore_response_bytes_total': ('counter', 'The bytes of response bodies with known length by route'),
+    'objectstore_stage_duration_seconds': ('histogram', 'The time of object storing stages'),
+    'objectstore_sqlite_queue_wait_seconds': ('histogram', 'The time of sqlite requests in the queue of connection thread'),
+    'objectstore_sqlite_execute_seconds': ('histogram', 'The time of sqlite requests execution'),
+}
+
+
+def labels_key(labels):
+    ''' returns the hashable key of the labels dict
+    '''
+    return tuple(sorted(labels.items()))
+
+
+def snapshot_pid(filename):
+    ''' returns the pid of the worker from the name of snapshot file, None for the base snapshot
+    '''
+    try:
+        return int(filename[len('metrics-'):-len('.json')].split('-')[0])
+    except ValueError:
+        return None
+
+
+def is_running(pid):
+    ''' returns True if the process exists
+    '''
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        return err.errno != errno.ESRCH
+    return True
+
+
+def merge(snapshots):
+    ''' returns (counters, histograms) dictionaries with the sums of snapshots
+    '''
+    counters, histograms = dict(), dict()
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in snapshot['histograms']:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            total = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                total[i] += value
+    return counters, histograms
+
+
+def format_labels(labels, extra=()):
+
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, unicode(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+
+
+def format_value(value):
+
+    if isinstance(value, (int, long)):
+        return str(value)
+    if isinstance(value, float) and value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class MetricsRegistry(object):
+
+    def __init__(self, metrics_dir=None):
+
+        self.metrics_dir = metrics_dir
+        self._lock = threading.Lock()
+        self._counters = dict()
+        self._histograms = dict()
+        self._flushed = 0
+        self._worker = None
+
+
+    def inc(self, name, value=1, **labels):
+        ''' increases the counter
+        '''
+        key = (name, labels_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+
+    def observe(self, name, seconds, **labels):
+        ''' adds the sample to the histogram
+        '''
+        key = (name, labels_key(labels))
+        position = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # the counts of buckets, +Inf bucket, the sum of samples
+                histogram = self._histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+            histogram[position] += 1
+            histogram[-1] += seconds
+
+
+    def timer(self, name, **labels):
+        ''' returns the context manager observing the time of the block
+        '''
+        return Timer(self, name, labels)
+
+
+    def snapshot(self):
+        ''' returns the JSON-serializable copy of the registry
+        '''
+        with self._lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, labels, list(values)] for (name, labels), values in self._histograms.items()],
+            }
+
+
+    def flush(self, force=False):
+        ''' writes the snapshot to the metrics directory, at most once per FLUSH_INTERVAL
+        '''
+        now = time.time()
+        if not self.metrics_dir or (not force and now - self._flushed < FLUSH_INTERVAL):
+            return
+        self._flushed = now
+        self._write(self.worker_snapshot, self.snapshot())
+
+
+    @property
+    def worker_snapshot(self):
+        ''' returns the name of snapshot file of this process, the forked process gets a new one
+        '''
+        if self._worker is None or self._worker[0] != os.getpid():
+            self._worker = (os.getpid(), 'metrics-%d-%d.json' % (os.getpid(), int(time.time() * 1000)))
+        return self._worker[1]
+
+
+    def collect(self):
+        ''' returns the list of snapshots: of all workers if the metrics directory is set,
+        otherwise of this process
+        '''
+        if not self.metrics_dir:
+            return [self.snapshot()]
+
+        self.flush(force=True)
+        filenames = self._snapshots()
+        stopped = [
+            filename for filename in filenames
+            if filename != self.worker_snapshot and snapshot_pid(filename) is not None \
+                and not is_running(snapshot_pid(filename))
+        ]
+        if stopped:
+            self._merge_stopped(stopped)
+
+        # the snapshots are read consistently with the merge, a stopped worker is counted once
+        snapshots = list()
+        with self._lock_directory(fcntl.LOCK_SH):
+            for filename in self._snapshots():
+                snapshot = self._read(filename)
+                if snapshot is not None:
+                    snapshots.append(snapshot)
+        return snapshots
+
+
+    def _merge_stopped(self, filenames):
+        ''' adds the snapshots of stopped workers to the base snapshot and removes them. The base
+        snapshot records the merged files, so the snapshot is not added twice if the process stops
+        before the file is removed
+        '''
+        with self._lock_directory(fcntl.LOCK_EX):
+            base = self._read(BASE_SNAPSHOT) or {'counters': [], 'histograms': [], 'merged': []}
+            existing = set(self._snapshots())
+            merged = [filename for filename in base.get('merged', []) if filename in existing]
+            snapshots = [base]
+            for filename in filenames:
+                if filename in existing and filename not in merged:
+                    snapshot = self._read(filename)
+                    if snapshot is not None:
+                        snapshots.append(snapshot)
+                        merged.append(filename)
+
+            counters, histograms = merge(snapshots)
+            self._write(BASE_SNAPSHOT, {
+                'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+                'histograms': [[name, labels, values] for (name, labels), values in histograms.items()],
+                'merged': merged,
+            })
+            for filename in merged:
+                os.remove(os.path.join(self.metrics_dir, filename))
+
+
+    @contextmanager
+    def _lock_directory(self, operation):
+        ''' holds the lock of the metrics directory, shared or exclusive
+        '''
+        with open(os.path.join(self.metrics_dir, '.metrics.lock'), 'a') as lock:
+            fcntl.flock(lock, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+    def _snapshots(self):
+
+        return sorted(
+            filename for filename in os.listdir(self.metrics_dir)
+            if filename.startswith('metrics-') and filename.endswith('.json')
+        )
+
+
+    def _read(self, filename):
+        ''' returns the snapshot from the file, None if the file is removed or incomplete
+        '''
+        try:
+            with open(os.path.join(self.metrics_dir, filename)) as _file:
+                return json.load(_file)
+        except (IOError, ValueError):
+            return None
+
+
+    def _write(self, filename, snapshot):
+
+        handler, temp_path = tempfile.mkstemp(dir=self.metrics_dir, prefix='.metrics-')
+        with os.fdopen(handler, 'w') as _file:
+            json.dump(snapshot, _file)
+        os.rename(temp_path, os.path.join(self.metrics_dir, filename))
+
+
+    def render(self):
+        ''' returns the sum of snapshots in Prometheus text format
+        '''
+        counters, histograms = merge(self.collect())
+
+        lines = list()
+        for name in sorted(METRICS):
+            metric_type, description = METRICS[name]
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, metric_type))
+            if metric_type == 'counter':
+                for (_name, labels), value in sorted(counters.items()):
+                    if _name == name:
+                        lines.append('%s%s %s' % (name, format_labels(labels), format_value(value)))
+                continue
+            for (_name, labels), values in sorted(histograms.items()):
+                if _name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), values[:-1]):
+                    cumulative += count
+                    lines.append('%s_bucket%s %d' % (name, format_labels(labels, [('le', bound)]), cumulative))
+                lines.append('%s_sum%s %s' % (name, format_labels(labels), format_value(values[-1])))
+                lines.append('%s_count%s %d' % (name, format_labels(labels), cumulative))
+        return '\n'.join(lines) + '\n'
+
+
+class Timer(object):
+
+    def __init__(self, registry, name, labels):
+
+        self._registry = registry
+        self._name = name
+        self._labels = labels
+
+
+    def __enter__(self):
+
+        self._started = time.time()
+        return self
+
+
+    def __exit__(self, *exc_info):
+
+        self._registry.observe(self._name, time.time() - self._started, **self._labels)
+
+
+class MetricsMiddleware(object):
+    ''' counts the requests and observes their latency and body sizes, by route and method.
+    `routes` maps the id of resource to its URI template
+    '''
+    def __init__(self, registry, routes=None):
+
+        self._registry = registry
+        self.routes = routes if routes is not None else dict()
+
+
+    def process_request(self, req, resp):
+
+        req.context['metrics_started'] = time.time()
+
+
+    def process_response(self, req, resp, resource):
+
+        started = req.context.get('metrics_started')
+        if started is None:
+            return
+        route = self.routes.get(id(resource), 'unknown')
+        status = resp.status.split(' ', 1)[0] if resp.status else '200'
+        self._registry.inc('objectstore_requests_total', route=route, method=req.method, status=status)
+        self._registry.observe(
+            'objectstore_request_duration_seconds', time.time() - started, route=route, method=req.method
+        )
+        if req.content_length:
+            self._registry.inc('objectstore_request_bytes_total', req.content_length, route=route)
+        if resp.data is not None:
+            self._registry.inc('objectstore_response_bytes_total', len(resp.data), route=route)
+        elif resp.body is not None:
+            self._registry.inc('objectstore_response_bytes_total', len(resp.body), route=route)
+        elif resp.stream_len:
+            self._registry.inc('objectstore_response_bytes_total', resp.stream_len, route=route)
+        self._registry.flush()
+
+
+    def handle_error(self, ex, req, resp, params):
+        ''' the error handler of the application: falcon 0.3 calls the response middleware before
+        it composes the response of raised HTTPError, with the default status. The error is raised
+        again, the response is composed and the middleware is called with its status. Other errors
+        are logged and answered by 500
+        '''
+        if isinstance(ex, falcon.HTTPError):
+            raise
+        logger.exception('The request %s %s failed', req.method, req.path)
+        raise falcon.HTTPInternalServerError('Internal Server Error', 'The request failed, see the service log')
+
+
+class MetricsAPI(object):
+    ''' the metrics of the service in Prometheus text format
+    '''
+    def __init__(self, registry=None):
+
+        self._registry = registry or metrics
+
+
+    def on_get(self, req, resp):
+
+        resp.content_type = 'text/plain; version=0.0.4'
+        resp.data = self._registry.render()
+
+
+# the registry of the process
+metrics = MetricsRegistry(metrics_dir=os.environ.get('OBJECTSTORE_METRICS_DIR'))
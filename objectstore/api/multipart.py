@@ -0,0 +1,228 @@
+#
+#   Multipart upload
+#
+#   The parts are uploaded to the bucket's tmp/<upload-id>/ directory, concurrently
+#   if needed. On completion the parts are assembled into one object in the storage.
+#
+#   Links:
+#   - http://docs.aws.amazon.com/AmazonS3/latest/dev/mpuoverview.html
+#
+
+import os
+import time
+import uuid
+import shutil
+import falcon
+import hashlib
+import binascii
+
+from handles import registry
+from common import prefix_upper_bound
+
+
+# max number of parts in one upload
+MAX_PARTS = 10000
+
+
+class PartsReader(object):
+    ''' reads the part files one after another as one stream
+    '''
+    def __init__(self, paths):
+
+        self._paths = list(paths)
+        self._file = None
+
+
+    def read(self, size=-1):
+
+        while True:
+            if self._file is None:
+                if not self._paths:
+                    return b''
+                self._file = open(self._paths.pop(0), 'rb')
+            data = self._file.read(size)
+            if data:
+                return data
+            self._file.close()
+            self._file = None
+
+
+def multipart_etag(part_digests):
+    ''' returns the combined digest of multipart upload: md5 of concatenated binary md5 digests
+    of the parts and the number of parts, as S3 does
+    '''
+    combined = hashlib.md5()
+    for part_digest in part_digests:
+        combined.update(binascii.unhexlify(part_digest))
+    return '%s-%d' % (combined.hexdigest(), len(part_digests))
+
+
+class MultipartUpload(object):
+
+    def __init__(self, bucket, upload_id=None):
+
+        self._bucket = bucket
+        self.upload_id = upload_id
+
+        self._uploads = registry.get(bucket.metadata_path, 'uploads')
+        self._parts = registry.get(bucket.metadata_path, 'upload_parts')
+
+
+    @property
+    def upload_path(self):
+        ''' returns the path to the directory with uploaded parts
+        '''
+        return os.path.join(self._bucket.bucket_path, 'tmp', self.upload_id)
+
+
+    @property
+    def info(self):
+        ''' returns the upload info: content-name, metadata and initiated
+        '''
+        return self._uploads[self.upload_id]
+
+
+    def exists(self):
+
+        if self.upload_id and self.upload_id in self._uploads:
+            return True
+        else:
+            return False
+
+
+    def initiate(self, content_name, metadata):
+        ''' initiates new upload, returns upload id
+        '''
+        self.upload_id = uuid.uuid4().hex
+        os.makedirs(self.upload_path)
+        self._uploads[self.upload_id] = {
+            'content-name': content_name,
+            'metadata': metadata,
+            'initiated': int(time.time()),
+        }
+        self._uploads.commit()
+        return self.upload_id
+
+
+    def upload_part(self, content_name, part_number, part_object, stream):
+        ''' stores the part of the upload, `content_name` is the object id of request URL, 
+        `part_object` is BucketObject with the part metadata from request headers. Returns 
+        the part info.
+
+        The part uploaded again with the same number replaces the previous one
+        '''
+        self._check_exists()
+        if content_name != self.info['content-name']:
+            raise falcon.HTTPBadRequest(
+                title='InvalidRequest',
+                description='The upload is initiated for another object: %s' % self.info['content-name']
+            )
+
+        # the parts are stored as is, the assembled object is compressed on completion
+        temp_filepath, hashes = part_object.ingest(stream, temp_path=self.upload_path, compress=False)
+        part_object.validate(temp_filepath, hashes)
+
+        os.rename(temp_filepath, self._part_path(part_number))
+
+        info = dict(hashes)
+        info['part-number'] = part_number
+        self._parts[self._part_key(part_number)] = info
+        self._parts.commit()
+        return info
+
+
+    def parts(self):
+        ''' returns the list of uploaded parts info, ordered by part number
+        '''
+        prefix = '%s/' % self.upload_id
+        keys = self._parts.keys_range(start=prefix, stop=prefix_upper_bound(prefix))
+        found = self._parts.get_many(keys)
+        # the part removed after the keys are read is skipped
+        return [found[key] for key in keys if key in found]
+
+
+    def complete(self, bucket_object, expected_parts=None):
+        ''' assembles the parts into the object, `bucket_object` is new BucketObject with
+        the upload metadata.
+
+        The parts are read once, while the object content is written and hashed in one pass.
+        `expected_parts` is the optional list of dicts with `part-number` and `etag` (content-md5
+        of the part), to assemble a subset of uploaded parts.
+        '''
+        self._check_exists()
+
+        parts = self.parts()
+        if expected_parts is not None:
+            parts = self._select_parts(parts, expected_parts)
+        if not parts:
+            raise falcon.HTTPBadRequest(
+                title='InvalidPart',
+                description='The upload has no parts'
+            )
+        bucket_object.check_length(sum(part['content-length'] for part in parts))
+
+        try:
+            temp_filepath, hashes = bucket_object.ingest(
+                PartsReader([self._part_path(part['part-number']) for part in parts])
+            )
+        except (IOError, OSError):
+            raise falcon.HTTPConflict(
+                title='InvalidPart',
+                description='The upload is completed or aborted by another request'
+            )
+
+        bucket_object.metadata = dict(
+            bucket_object.metadata,
+            **{'multipart-etag': multipart_etag([part['content-md5'] for part in parts])}
+        )
+        try:
+            bucket_object.commit(temp_filepath, hashes)
+        finally:
+            self.abort()
+
+
+    def abort(self):
+        ''' removes the uploaded parts and the upload info
+        '''
+        self._check_exists()
+
+        for part in self.parts():
+            del self._parts[self._part_key(part['part-number'])]
+        del self._uploads[self.upload_id]
+        self._parts.commit()
+        shutil.rmtree(self.upload_path, ignore_errors=True)
+
+
+    def _select_parts(self, parts, expected_parts):
+
+        uploaded = dict((part['part-number'], part) for part in parts)
+        selected = list()
+        for expected in expected_parts:
+            part = uploaded.get(expected.get('part-number'))
+            if part is None or expected.get('etag', '').strip('"') != part['content-md5'] or \
+                (selected and selected[-1]['part-number'] >= part['part-number']):
+                raise falcon.HTTPBadRequest(
+                    title='InvalidPart',
+                    description='The part is not uploaded, does not match the etag or is out of order: %s' % expected
+                )
+            selected.append(part)
+        return selected
+
+
+    def _check_exists(self):
+
+        if not self.exists():
+            raise falcon.HTTPNotFound(
+                title='NoSuchUpload',
+                description='The specified multipart upload does not exist'
+            )
+
+
+    def _part_key(self, part_number):
+
+        return '%s/%05d' % (self.upload_id, part_number)
+
+
+    def _part_path(self, part_number):
+
+        return os.path.join(self.upload_path, 'part-%05d' % part_number)
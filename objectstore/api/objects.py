@@ -6,17 +6,46 @@
 #
 
 import os
+import re
 import json
+import errno
+import time
+import uuid
 import falcon
-import shutil
 import hashlib
 import tempfile
 import gunicorn
 
-from common import BaseAPI
+from email.utils import formatdate, parsedate_tz, mktime_tz
+
+from common import BaseAPI, has_param, pairtree_path, movefile
 from buckets import Bucket
+from multipart import MultipartUpload, MAX_PARTS
+from packs import PackStore
+from compression import get_codec, accepts_encoding, DecompressingReader
+from blobs import BlobPool, blob_key
+from executor import offload
+from metrics import metrics
+from durability import committer, file_paths, directory_paths
+
+
+# default size of chunks read from the request stream and written to the temp file
+DEFAULT_BUFFER_SIZE = 2 ** 16
+
+# max number of ranges in the Range header, the header is ignored if there are more ranges
+MAX_RANGES = 16
+
+# the histogram of object storing stages: hashing, temp-write, validate, movefile, sync-data, metadata
+STAGE_METRIC = 'objectstore_stage_duration_seconds'
 
-from sqlitedict import SqliteDict
+RANGE_SPEC = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+
+# digests calculated for each stored object, in order: metadata key, hash constructor
+HASH_ALGORITHMS = (
+    ('content-md5', hashlib.md5),
+    ('content-sha1', hashlib.sha1),
+    ('content-sha256', hashlib.sha256),
+)
 
 
 def get_metadata_from_headers(headers):
@@ -44,39 +73,263 @@ def get_metadata_from_headers(headers):
     return metadata
 
 
-def pairtree_path(filehash, pairs=2):
-    ''' returns pairtree path based on filehash value
-    
-    filehash value: string like fa0ec35541f4f17a68e3d03acd04146f39ae5d2e
-    
-    >>> pairtree_path('fa0ec35541f4f17a68e3d03acd04146f39ae5d2e', pairs=2)
-    '/fa/0e/fa0ec35541f4f17a68e3d03acd04146f39ae5d2e
+def parse_range(header, length):
+    ''' returns the list of (first, last) byte positions requested by the Range header
+    for the content of `length` bytes, None if the header is absent or shall be ignored
+
+    [RFC 7233, Range Requests](https://tools.ietf.org/html/rfc7233)
+
+    >>> parse_range('bytes=0-1,-2', 10)
+    [(0, 1), (8, 9)]
     '''
-    path = ''
-    if len(filehash) <= 2 * pairs:
-        raise RuntimeError('The file hash is too short. Expected more then %d, detected %d' % (2 * pairs, len(filehash)))
-    for i in range(pairs):
-        path = os.path.join(path, filehash[2*i:2*i+2])
-    return os.path.join(path, filehash)
+    if not header:
+        return None
+
+    unit, _, specs = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+
+    specs = specs.split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+
+    ranges = list()
+    for spec in specs:
+        matched = RANGE_SPEC.match(spec)
+        if not matched or matched.groups() == ('', ''):
+            return None
+        first, last = matched.groups()
+        if not first:
+            # suffix range, the last N bytes
+            if int(last) == 0:
+                continue
+            first, last = max(length - int(last), 0), length - 1
+        else:
+            first = int(first)
+            if last and int(last) < first:
+                return None
+            last = min(int(last), length - 1) if last else length - 1
+        if first < length:
+            ranges.append((first, last))
+
+    if not ranges:
+        raise falcon.HTTPRangeNotSatisfiable(length)
+    return ranges
 
 
-def movefile(source, target):
-    ''' move file from source to target. 
-    If target directory doesn't exist, it will create it
+def parse_etags(header):
+    ''' returns the list of entity tags from If-Match/If-None-Match header, ['*'] for any
     '''
-    target_dir = os.path.dirname(target)
-    if not os.path.exists(target_dir):
-        os.makedirs(target_dir)
-    shutil.move(source, target)
+    if not header:
+        return None
+    if header.strip() == '*':
+        return ['*']
+    return [etag.strip() for etag in header.split(',') if etag.strip()]
+
+
+def etag_matches(etags, etag, weak=False):
+    ''' returns True if the entity tag matches one of the list
+
+    The strong comparison (If-Match, If-Range) never matches weak tags, the weak comparison 
+    (If-None-Match) ignores W/ prefix
+    '''
+    for candidate in etags:
+        if candidate == '*':
+            return True
+        if candidate.startswith('W/'):
+            if weak and candidate[2:] == etag:
+                return True
+        elif candidate == etag:
+            return True
+    return False
+
+
+def parse_http_date(value):
+    ''' returns the timestamp of HTTP-date, None if the value is absent or invalid
+    '''
+    if not value:
+        return None
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    try:
+        return mktime_tz(parsed)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def http_date(timestamp):
+    ''' returns HTTP-date for the timestamp
+    '''
+    return formatdate(timestamp, usegmt=True)
+
+
+def evaluate_preconditions(req, etag, last_modified):
+    ''' evaluates the conditional headers of GET/HEAD request, returns True if the object 
+    is not modified (304), raises 412 if a precondition failed
+
+    [RFC 7232, Conditional Requests](https://tools.ietf.org/html/rfc7232#section-6)
+    '''
+    if_match = parse_etags(req.get_header('if-match'))
+    if if_match is not None:
+        if not etag_matches(if_match, etag):
+            raise falcon.HTTPPreconditionFailed('PreconditionFailed', 'The If-Match precondition failed')
+    else:
+        if_unmodified_since = parse_http_date(req.get_header('if-unmodified-since'))
+        if if_unmodified_since is not None and last_modified > if_unmodified_since:
+            raise falcon.HTTPPreconditionFailed('PreconditionFailed', 'The If-Unmodified-Since precondition failed')
+
+    if_none_match = parse_etags(req.get_header('if-none-match'))
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag, weak=True)
+
+    if_modified_since = parse_http_date(req.get_header('if-modified-since'))
+    if if_modified_since is not None and last_modified <= if_modified_since:
+        return True
+    return False
+
+
+def if_range_matches(req, etag, last_modified):
+    ''' returns True if the Range header shall be applied according to If-Range header
+    '''
+    if_range = req.get_header('if-range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return etag_matches([if_range.strip()], etag)
+    return parse_http_date(if_range) == last_modified
+
+
+class FileSlice(object):
+    ''' read-only file-like view of `length` bytes of the file, starting from `offset`
+
+    The file is positioned at `offset`, so the WSGI server can send the slice by sendfile() 
+    using fileno() and Content-Length; other servers read it by chunks.
+    '''
+    def __init__(self, fileobj, offset, length):
+
+        self._file = fileobj
+        self._file.seek(offset)
+        self._remaining = length
+
+
+    def read(self, size=-1):
+
+        if self._remaining <= 0:
+            return b''
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+
+    def fileno(self):
+
+        return self._file.fileno()
+
+
+    def close(self):
+
+        self._file.close()
+
+
+def iter_byteranges(open_range, ranges, length, content_type, boundary, block_size=2 ** 16):
+    ''' yields multipart/byteranges body of the ranges, `open_range(first, length)` returns
+    the file-like object of the range content
+    '''
+    for part_header, (first, last) in zip(byteranges_headers(ranges, length, content_type, boundary), ranges):
+        yield part_header
+        part = open_range(first, last - first + 1)
+        try:
+            while True:
+                data = part.read(block_size)
+                if not data:
+                    break
+                yield data
+        finally:
+            part.close()
+    yield '\r\n--%s--\r\n' % boundary
+
+
+def byteranges_headers(ranges, length, content_type, boundary):
+    ''' returns the list of part headers of multipart/byteranges body
+    '''
+    return [
+        '\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n' % (
+            boundary, content_type, first, last, length
+        ) for first, last in ranges
+    ]
+
+
+def byteranges_length(ranges, length, content_type, boundary):
+    ''' returns the size of multipart/byteranges body
+    '''
+    headers = byteranges_headers(ranges, length, content_type, boundary)
+    return sum(len(header) for header in headers) + \
+        sum(last - first + 1 for first, last in ranges) + \
+        len('\r\n--%s--\r\n' % boundary)
+
+
+class StreamDigest(object):
+    ''' calculates several digests in one pass over the data
+    '''
+    def __init__(self, algorithms=HASH_ALGORITHMS):
+
+        self._hashes = [(name, hashfunc()) for name, hashfunc in algorithms]
+        self.size = 0
+
+
+    def update(self, data):
+
+        self.size += len(data)
+        for _, hashfunc in self._hashes:
+            hashfunc.update(data)
+
+
+    def hexdigests(self):
+        ''' returns the dictionary of hex digests, the metadata key is used as dictionary key
+        '''
+        return dict((name, hashfunc.hexdigest()) for name, hashfunc in self._hashes)
+
+
+def write_chunk(fileobj, chunk, digest, compressor=None):
+    ''' adds the chunk to the digests and writes it to the file, compressed if the compressor
+    is given. The call is offloaded from the event loop under cooperative workers.
+
+    Returns the time of hashing and the time of compressing and writing, in seconds
+    '''
+    started = time.time()
+    digest.update(chunk)
+    hashed = time.time()
+    if compressor:
+        chunk = compressor.compress(chunk)
+    fileobj.write(chunk)
+    return hashed - started, time.time() - hashed
+
+
+def content_encoding(req, metadata):
+    ''' returns the content-coding of the response, if the compressed object can be passed as is:
+    the client accepts the codec's content-coding
+    '''
+    codec = get_codec(metadata.get('stored-codec'))
+    if codec is None:
+        return None
+    if accepts_encoding(req.get_header('accept-encoding'), codec.content_encoding):
+        return codec.content_encoding
+    return None
 
 
 class ObjectAPI(BaseAPI):
 
-    def __init__(self, storage_path):
+    def __init__(self, storage_path, buffer_size=DEFAULT_BUFFER_SIZE):
         ''' __init__
+
+        - buffer_size, the size of chunks used for reading the request body during object storing
         '''
         super(ObjectAPI, self).__init__(storage_path)
         self._bucket_path = None
+        self._buffer_size = buffer_size
 
 
     def on_put(self, req, resp, bucket_name, object_id):
@@ -90,13 +343,17 @@ class ObjectAPI(BaseAPI):
         '''
         metadata = get_metadata_from_headers(req.headers)
 
-        # in case of adding object to a bucket, the object-id attribute is used as a content name
-        metadata['content-name'] = object_id
-
         bucket = Bucket(bucket_name=bucket_name, storage_path=self._storage_path)
 
         if bucket.exists():
-            bucket_object = BucketObject(bucket=bucket)
+            bucket_object = BucketObject(bucket=bucket, buffer_size=self._buffer_size)
+            if req.get_param('upload-id'):
+                self._upload_part(req, resp, bucket, object_id, bucket_object, metadata)
+                return
+
+            # in case of adding object to a bucket, the object-id attribute is used as a content name
+            metadata['content-name'] = object_id
+
             bucket_object.metadata = metadata
             if not bucket_object.exists():
                 bucket_object.store(req.stream)
@@ -108,7 +365,7 @@ class ObjectAPI(BaseAPI):
             )
 
 
-    def on_post(self, req, resp, bucket_name):
+    def on_post(self, req, resp, bucket_name, object_id):
         ''' _POST_ Object
 
         adds an object to a specified bucket using HTML forms. POST is an alternate form of PUT that 
@@ -117,16 +374,78 @@ class ObjectAPI(BaseAPI):
         encoded message body. The service never stores partial objects: if you receive a successful response, 
         you can be confident the entire object was stored.
 
-        Based on: [POST Object](http://docs.aws.amazon.com/AmazonS3/latest/API/RESTObjectPOST.html)
+        Multipart upload, the object-id is used as a content name:
+        - `POST ?uploads` initiates the upload and returns `upload-id`, the Content-Type header is stored 
+          as object metadata
+        - `PUT ?upload-id=<id>&part-number=<1..10000>` uploads the part, parts can be uploaded concurrently
+        - `POST ?upload-id=<id>` completes the upload, the optional JSON body `{"parts": [{"part-number": 1, 
+          "etag": "<content-md5>"}, ...]}` selects the parts, by default all uploaded parts are used
+        - `DELETE ?upload-id=<id>` aborts the upload
+
+        Based on: [POST Object](http://docs.aws.amazon.com/AmazonS3/latest/API/RESTObjectPOST.html), 
+        [Multipart Upload](http://docs.aws.amazon.com/AmazonS3/latest/dev/mpuoverview.html)
+        '''
+        bucket = Bucket(bucket_name=bucket_name, storage_path=self._storage_path)
+
+        if has_param(req, 'uploads'):
+            if not bucket.exists():
+                raise falcon.HTTPBadRequest(
+                    title='InvalidBucketName', 
+                    description='The specified bucket is not valid',
+                )
+            metadata = dict((k, v) for k, v in get_metadata_from_headers(req.headers).items() if k == 'content-type')
+            upload = MultipartUpload(bucket)
+            upload.initiate(object_id, metadata)
+            resp.data = json.dumps({
+                u'upload-id': upload.upload_id,
+                u'content-name': object_id,
+            })
+
+        elif req.get_param('upload-id'):
+            bucket_object = BucketObject(bucket=bucket, buffer_size=self._buffer_size)
+            upload = MultipartUpload(bucket, req.get_param('upload-id'))
+            if not upload.exists():
+                raise falcon.HTTPNotFound(title='NoSuchUpload', description='The specified multipart upload does not exist')
+
+            expected_parts = None
+            body = req.stream.read()
+            if body:
+                try:
+                    expected_parts = json.loads(body)['parts']
+                except (ValueError, KeyError, TypeError):
+                    raise falcon.HTTPBadRequest(
+                        title='MalformedJSON',
+                        description='The list of parts is expected as {"parts": [{"part-number": 1, "etag": "..."}]}'
+                    )
+
+            info = upload.info
+            metadata = dict(info['metadata'])
+            metadata['content-name'] = info['content-name']
+            bucket_object.metadata = metadata
+            upload.complete(bucket_object, expected_parts)
+            resp.data = json.dumps(bucket_object.info())
+
+        else:
+            raise NotImplementedError()        
+
+
+    def _upload_part(self, req, resp, bucket, object_id, part_object, metadata):
+        ''' uploads the part of multipart upload
         '''
-        raise NotImplementedError()        
+        part_number = req.get_param_as_int('part-number', required=True, min=1, max=MAX_PARTS)
+        upload = MultipartUpload(bucket, req.get_param('upload-id'))
+        part_object.metadata = metadata
+        info = upload.upload_part(object_id, part_number, part_object, req.stream)
+        info['etag'] = '"%s"' % info['content-md5']
+        resp.data = json.dumps(info)
 
 
     def on_head(self, req, resp, bucket_name, object_id):
         ''' _HEAD_ Object
 
         retrieves metadata from an object without returning the object itself. This operation is useful 
-        if you are interested only in an object's metadata.
+        if you are interested only in an object's metadata. Conditional headers and Accept-Encoding 
+        are supported as for GET.
 
         Based on: [HEAD Object](http://docs.aws.amazon.com/AmazonS3/latest/API/RESTObjectHEAD.html)
         '''
@@ -135,12 +454,31 @@ class ObjectAPI(BaseAPI):
             bucket=Bucket(bucket_name=bucket_name, storage_path=self._storage_path)
         )
         if bucket_object.exists():
-            for k,v in bucket_object.metadata.items():
-                resp.set_header(k,v)
+            metadata = bucket_object.metadata
+            encoding = content_encoding(req, metadata)
+            etag, last_modified = bucket_object.validators(metadata, encoding)
+            self._set_object_headers(resp, metadata, etag, last_modified, encoding)
+            if evaluate_preconditions(req, etag, last_modified):
+                resp.status = falcon.HTTP_304
         else:
             raise falcon.HTTPNotFound()
 
 
+    def _set_object_headers(self, resp, metadata, etag, last_modified, encoding=None):
+        ''' sets object metadata, ETag and Last-Modified response headers, and Content-Encoding
+        if the compressed object is passed as is
+        '''
+        # WSGI servers accept only string header values
+        for k,v in metadata.items():
+            resp.set_header(k, v if isinstance(v, basestring) else str(v))
+        resp.set_header('etag', etag)
+        resp.set_header('last-modified', http_date(last_modified))
+        if 'stored-codec' in metadata:
+            resp.set_header('vary', 'Accept-Encoding')
+        if encoding:
+            resp.set_header('content-encoding', encoding)
+            resp.set_header('content-length', str(metadata['stored-length']))
+
 
     def on_get(self, req, resp, bucket_name, object_id):
         ''' _GET_ Object
@@ -150,6 +488,17 @@ class ObjectAPI(BaseAPI):
         key names that imply a folder structure. For example, instead of naming an object sample.jpg, you can 
         name it photos/2006/February/sample.jpg. 
 
+        The Range header is supported: one range is returned as 206 Partial Content with Content-Range,
+        several ranges as multipart/byteranges, 416 if no range is satisfiable. The file is passed to 
+        wsgi.file_wrapper, so the WSGI server can send it by sendfile().
+
+        The strong ETag is based on the object digest. If-Match, If-None-Match, If-Modified-Since,
+        If-Unmodified-Since and If-Range are supported.
+
+        The object stored compressed by gzip or zlib codec is passed as is, with Content-Encoding, if 
+        the client accepts it; otherwise the object is decompressed on the fly. The Range header is 
+        ignored for compressed objects.
+
         Based on: [GET Object](http://docs.aws.amazon.com/AmazonS3/latest/API/RESTObjectGET.html)
         '''
         bucket_object = BucketObject(
@@ -157,12 +506,57 @@ class ObjectAPI(BaseAPI):
             bucket=Bucket(bucket_name=bucket_name, storage_path=self._storage_path)
         )
         if bucket_object.exists():
-            if 'content-type' in bucket_object.metadata:
-                resp.content_type = bucket_object.metadata['content-type']
-            for k,v in bucket_object.metadata.items():
-                resp.set_header(k,v)
-            resp.stream = open(bucket_object.filepath, 'rb')
-            resp.stream_len = bucket_object.metadata['content-length']
+            metadata = bucket_object.metadata
+            if 'content-type' in metadata:
+                resp.content_type = metadata['content-type']
+            encoding = content_encoding(req, metadata)
+            etag, last_modified = bucket_object.validators(metadata, encoding)
+            self._set_object_headers(resp, metadata, etag, last_modified, encoding)
+            compressed = 'stored-codec' in metadata
+            resp.set_header('accept-ranges', 'none' if compressed else 'bytes')
+
+            # conditional requests are answered from metadata, the data file is not opened
+            if evaluate_preconditions(req, etag, last_modified):
+                resp.status = falcon.HTTP_304
+                return
+
+            length = metadata['content-length']
+            ranges = None
+            if not compressed and if_range_matches(req, etag, last_modified):
+                ranges = parse_range(req.get_header('range'), length)
+
+            if encoding and bucket_object.pack_location:
+                resp.data = bucket_object.read()
+
+            elif encoding:
+                resp.stream = bucket_object.open()
+                resp.stream_len = metadata['stored-length']
+
+            elif compressed:
+                resp.stream = bucket_object.open_content(metadata)
+                resp.stream_len = length
+
+            elif ranges is None and bucket_object.pack_location:
+                resp.data = bucket_object.read()
+
+            elif ranges is None:
+                resp.stream = bucket_object.open()
+                resp.stream_len = length
+
+            elif len(ranges) == 1:
+                first, last = ranges[0]
+                resp.status = falcon.HTTP_206
+                resp.set_header('content-range', 'bytes %d-%d/%d' % (first, last, length))
+                resp.stream = bucket_object.open(first, last - first + 1)
+                resp.stream_len = last - first + 1
+
+            else:
+                boundary = uuid.uuid4().hex
+                content_type = metadata.get('content-type', 'application/octet-stream')
+                resp.status = falcon.HTTP_206
+                resp.content_type = 'multipart/byteranges; boundary=%s' % boundary
+                resp.stream = iter_byteranges(bucket_object.open, ranges, length, content_type, boundary)
+                resp.stream_len = byteranges_length(ranges, length, content_type, boundary)
 
         else:
             raise falcon.HTTPNotFound()
@@ -171,10 +565,17 @@ class ObjectAPI(BaseAPI):
     def on_delete(self, req, resp, bucket_name, object_id):
         ''' _DELETE_ Object
 
-        removes the object
+        removes the object, or aborts the multipart upload if `upload-id` parameter is given
 
         Based on: [DELETE Object](http://docs.aws.amazon.com/AmazonS3/latest/API/RESTObjectDELETE.html)
         '''
+        if req.get_param('upload-id'):
+            bucket = Bucket(bucket_name=bucket_name, storage_path=self._storage_path)
+            if not bucket.exists():
+                raise falcon.HTTPNotFound()
+            MultipartUpload(bucket, req.get_param('upload-id')).abort()
+            return
+
         bucket_object = BucketObject(
             object_id=object_id,
             bucket=Bucket(bucket_name=bucket_name, storage_path=self._storage_path)
@@ -188,9 +589,10 @@ class ObjectAPI(BaseAPI):
 
 class BucketObject(object):
 
-    def __init__(self, object_id=None, metadata={}, bucket=None):
+    def __init__(self, object_id=None, metadata={}, bucket=None, buffer_size=DEFAULT_BUFFER_SIZE):
 
         self.object_id = object_id
+        self._buffer_size = buffer_size
 
         self._bucket = bucket
         if bucket and isinstance(bucket, Bucket) and bucket.exists():
@@ -205,11 +607,15 @@ class BucketObject(object):
 
         # metadata key used for object identification in the storage
         self._metadata = dict()
-        if 'object-key' in self._bucket.metadata and self._bucket.metadata['object-key'] in ['content-md5', 'content-sha1']:            
-            self.OBJECT_KEY_BASE=self._bucket.metadata['object-key']
-        else:
-            self.OBJECT_KEY_BASE='content-sha1'
-        self._objects_metadata = SqliteDict(os.path.join(bucket.bucket_path,'metadata.sqlite'), 'objects', autocommit=True)
+        self._config = self._bucket.config
+        self.OBJECT_KEY_BASE = self._config.object_key
+        self._objects_metadata = self._bucket.objects_metadata()
+
+        # the pack index is checked only if the bucket has packed objects or packing is enabled
+        self._packs = None
+        self._pack_location = None
+        if self._config.pack_threshold or os.path.isdir(os.path.join(self._bucket.bucket_path, 'packs')):
+            self._packs = PackStore(self._bucket.bucket_path, self._config.pack_segment_size)
 
 
     @property
@@ -226,29 +632,123 @@ class BucketObject(object):
 
         if value and isinstance(value, dict):
 
-            # object_id doesn't set but object_id is in the value 
-            if not self.object_id and self.OBJECT_KEY_BASE in value:
-                self.object_id = value[self.OBJECT_KEY_BASE]
-
-            # object_id is assigned
+            # object_id is assigned, the metadata is committed in the batch with concurrent writes
             if self.object_id:
-                self._objects_metadata[self.object_id] = value
+                self._objects_metadata.write(
+                    updates=[(self.object_id, value)], durable=self._config.durability == 'data+metadata'
+                )
             
-            # no object_id, stored temporary
+            # no object_id, stored temporary. The object id is assigned by store() when the 
+            # content is validated, the digests from request headers are not trusted before
             else:
                 self._metadata = value    
 
         else:
-            raise RuntimeError('Incorrect metadata type. Found "%s", expected "dict"') % type(value)
+            raise RuntimeError('Incorrect metadata type. Found "%s", expected "dict"' % type(value))
 
     @property
     def filepath(self):
         ''' returns the path to file in storage
         '''
         if self.object_id:
-            return os.path.join(self._data_path, pairtree_path(self.object_id))
+            return self._bucket.object_path(self.object_id, self._config)
+        else:
+            return self._bucket.object_path(self._metadata[self.OBJECT_KEY_BASE], self._config)
+
+
+    def validators(self, metadata=None, encoding=None):
+        ''' returns (etag, last_modified) of the object: the strong entity tag based on object digest
+        and the time of object creation, in seconds since the epoch. The representation with 
+        Content-Encoding has its own entity tag
+        '''
+        if metadata is None:
+            metadata = self.metadata
+        etag = '"%s"' % metadata.get('content-md5', self.object_id)
+        if encoding:
+            etag = '"%s+%s"' % (metadata.get('content-md5', self.object_id), encoding)
+        if 'created' in metadata:
+            last_modified = metadata['created']
         else:
-            return os.path.join(self._data_path, pairtree_path(self._metadata[self.OBJECT_KEY_BASE]))
+            # the objects stored before the creation time was recorded
+            last_modified = int(os.path.getmtime(self.filepath))
+        return etag, last_modified
+
+
+    @property
+    def pack_location(self):
+        ''' returns (segment, offset, length) if the object is stored in a pack segment, otherwise None
+        '''
+        if self._pack_location is None and self._packs is not None and self.object_id:
+            self._pack_location = self._packs.location(self.object_id)
+        return self._pack_location
+
+
+    def _read_packed(self, func):
+        ''' returns `func(location)` of the packed object. If the segment is removed by compaction
+        after the location was looked up, the object is in other segment: the location is looked up
+        again
+        '''
+        try:
+            return func(self.pack_location)
+        except (IOError, OSError) as err:
+            if err.errno != errno.ENOENT:
+                raise
+            self._pack_location = None
+            if not self.pack_location:
+                raise
+            return func(self.pack_location)
+
+
+    def open(self, first=0, length=None):
+        ''' returns the file object of object content, or of `length` bytes starting from `first`
+        '''
+        if self.pack_location:
+
+            def open_slice(location):
+                segment, offset, size = location
+                return FileSlice(
+                    open(self._packs.segment_path(segment), 'rb'), offset + first, size - first if length is None else length
+                )
+
+            return self._read_packed(open_slice)
+
+        if first == 0 and length is None:
+            return self._open_file()
+        return FileSlice(self._open_file(), first, length)
+
+
+    def _open_file(self):
+        ''' returns the file object of the object file. If the file is moved by resharding after its
+        path was resolved, the path is resolved again with the current layouts of the bucket
+        '''
+        try:
+            return open(self.filepath, 'rb')
+        except IOError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            self._config = self._bucket.config
+            return open(self.filepath, 'rb')
+
+
+    def open_content(self, metadata=None):
+        ''' returns the file-like object of original object content, the compressed object 
+        is decompressed on the fly
+        '''
+        if metadata is None:
+            metadata = self.metadata
+        codec = get_codec(metadata.get('stored-codec'))
+        if codec:
+            return DecompressingReader(self.open(), codec)
+        return self.open()
+
+
+    def read(self):
+        ''' returns the stored object content, the packed object is read by single pread
+        '''
+        if self.pack_location:
+            return self._read_packed(self._packs.read)
+        with self.open() as _file:
+            return _file.read()
 
 
     def exists(self):
@@ -278,29 +778,104 @@ class BucketObject(object):
                 description = 'Attempt to store empty file'
             )
 
+        temp_filepath, hashes = self.ingest(stream)
+        self.commit(temp_filepath, hashes)
+
+
+    def ingest(self, stream, temp_path=None, compress=True):
+        ''' writes the stream to a new temp file, returns the path to the file and the dictionary 
+        of content digests and content length. 
+
+        If the bucket has compression setting and `compress` is True, the data is compressed 
+        before writing, the codec and the size of compressed data are added to the dictionary 
+        as `stored-codec` and `stored-length`. The digests and length are of original content.
+
+        The reading stops as soon as the content exceeds the declared Content-Length or the max 
+        object size of the bucket, the temp file is removed on any error.
+        '''
+        declared_length = self._metadata.get('content-length')
+        self.check_length(declared_length or 0)
+
+        # one byte over the limit is enough to reject the content
+        limits = [size for size in (declared_length, self._config.max_object_size) if size]
+        limit = min(limits) + 1 if limits else None
+
+        # the digests are calculated in the same loop which writes the chunks to the temp file,
+        # so the stored data is not re-read from disk
+        digest = StreamDigest()
+        codec = get_codec(self._config.compression) if compress else None
+        compressor = codec.compressor(self._config.compression_level) if codec else None
         temp_filepath = None
-        with tempfile.NamedTemporaryFile(dir=self._temp_path, mode="wb", delete=False) as _file:
-            temp_filepath = _file.name
-            while True:
-                chunk = stream.read(4096)
-                if not chunk:
-                    break
-                _file.write(chunk)
+        timings = {'hashing': 0.0, 'temp-write': 0.0}
+        try:
+            with tempfile.NamedTemporaryFile(dir=temp_path or self._temp_path, mode="wb", delete=False) as _file:
+                temp_filepath = _file.name
+                while True:
+                    size = min(self._buffer_size, limit - digest.size) if limit else self._buffer_size
+                    chunk = stream.read(size)
+                    if not chunk:
+                        break
+                    hashing, writing = offload(write_chunk, _file, chunk, digest, compressor)
+                    timings['hashing'] += hashing
+                    timings['temp-write'] += writing
+                    self.check_length(digest.size, declared_length)
+                if compressor:
+                    _file.write(compressor.flush())
+                stored_length = _file.tell()
+        except Exception:
+            if temp_filepath and os.path.exists(temp_filepath):
+                os.remove(temp_filepath)
+            raise
+
+        # the stages are timed per chunk and observed once per object
+        for stage, seconds in timings.items():
+            metrics.observe(STAGE_METRIC, seconds, stage=stage)
+
+        hashes = digest.hexdigests()
+        hashes['content-length'] = digest.size
+        if codec:
+            hashes['stored-codec'] = codec.name
+            hashes['stored-length'] = stored_length
+        return temp_filepath, hashes
+
+
+    def check_length(self, length, declared_length=None):
+        ''' raises 413 if the content length exceeds the max object size of the bucket, 
+        400 if it exceeds the declared Content-Length
+        '''
+        if self._config.max_object_size and length > self._config.max_object_size:
+            raise falcon.HTTPRequestEntityTooLarge(
+                title='EntityTooLarge',
+                description='The object exceeds the max object size of the bucket, %d bytes' % self._config.max_object_size
+            )
+        if declared_length and length > declared_length:
+            raise falcon.HTTPBadRequest(
+                title='BadContentLength',
+                description='The content exceeds the declared Content-Length'
+            )
 
-        hashes = {
-            'content-md5': self.filehash(temp_filepath, hashlib.md5()),
-            'content-sha1': self.filehash(temp_filepath, hashlib.sha1()),
-            'content-sha256': self.filehash(temp_filepath, hashlib.sha256())        
-        }
 
-        if self.validate(temp_filepath, hashes):
+    def commit(self, temp_filepath, hashes):
+        ''' validates the content of the temp file and moves it into the storage: to the pack 
+        segment, the blob pool or the bucket data directory, according to bucket settings
+        '''
+        with metrics.timer(STAGE_METRIC, stage='validate'):
+            valid = self.validate(temp_filepath, hashes)
+        if valid:
             self._metadata.update(hashes)
+            self._metadata['created'] = int(time.time())
 
             self.object_id = self._metadata[self.OBJECT_KEY_BASE]
 
             if hashes[self.OBJECT_KEY_BASE] not in self._objects_metadata:
-                movefile(temp_filepath, self.filepath)
-                self.metadata = self._metadata
+                with metrics.timer(STAGE_METRIC, stage='movefile'):
+                    synced_paths = self._place(temp_filepath, hashes)
+                # the metadata is written after the content is synced, so it never refers to lost content
+                if self._config.durability != 'none':
+                    with metrics.timer(STAGE_METRIC, stage='sync-data'):
+                        committer.submit(*synced_paths)
+                with metrics.timer(STAGE_METRIC, stage='metadata'):
+                    self.metadata = self._metadata
             else:
                 os.remove(temp_filepath)
                 raise falcon.HTTPConflict(
@@ -314,6 +889,29 @@ class BucketObject(object):
                 )
 
 
+    def _place(self, temp_filepath, hashes):
+        ''' moves the temp file to the pack segment, the blob pool or the bucket data directory, 
+        returns (files, directories) to sync for durability of the content
+        '''
+        if os.path.getsize(temp_filepath) < self._config.pack_threshold:
+            packs = PackStore(self._bucket.bucket_path, self._config.pack_segment_size)
+            directories = directory_paths(os.path.join(self._bucket.bucket_path, 'packs'), self._bucket.bucket_path)
+            segment, _, _ = packs.store(self.object_id, temp_filepath)
+            os.remove(temp_filepath)
+            return [packs.segment_path(segment)], directories
+
+        files, directories = file_paths(self.filepath, self._bucket.bucket_path)
+        if self._config.dedup:
+            # the known content is not stored again, only linked to the bucket
+            self._metadata['stored-blob'] = blob_key(hashes)
+            pool = BlobPool(self._bucket.storage_path)
+            directories.extend(pool.directory_paths(self._metadata['stored-blob']))
+            pool.link(self._metadata['stored-blob'], temp_filepath, self.filepath)
+        else:
+            movefile(temp_filepath, self.filepath)
+        return files, directories
+
+
     def filehash(self, filepath, hashfunc):
         ''' returns file hash
         '''
@@ -330,7 +928,7 @@ class BucketObject(object):
     def validate(self, filepath, filehashes):
         ''' validate recieved file object
         '''
-        if os.path.getsize(filepath) == 0:
+        if filehashes['content-length'] == 0:
             os.remove(filepath)
             raise falcon.HTTPBadRequest(
                 title='ZeroContentLength',
@@ -338,7 +936,7 @@ class BucketObject(object):
             )
 
         if 'content-length' in self._metadata and \
-            os.path.getsize(filepath) != self._metadata['content-length']:
+            filehashes['content-length'] != self._metadata['content-length']:
             os.remove(filepath)
             raise falcon.HTTPBadRequest(
                 title='BadContentLength',
@@ -346,7 +944,7 @@ class BucketObject(object):
             )
 
         if 'content-md5' in self._metadata and \
-            filehashes['md5'] != self._metadata['content-md5']:
+            filehashes['content-md5'] != self._metadata['content-md5']:
             os.remove(filepath)
             raise falcon.HTTPBadRequest(
                 title='BadDigest',
@@ -354,7 +952,7 @@ class BucketObject(object):
             )
 
         if 'content-sha1' in self._metadata and \
-            filehashes['sha1'] != self._metadata['content-sha1']:
+            filehashes['content-sha1'] != self._metadata['content-sha1']:
             os.remove(filepath)
             raise falcon.HTTPBadRequest(
                 title='BadDigest',
@@ -367,11 +965,17 @@ class BucketObject(object):
         ''' delete object
         '''
         if self.exists():
-            if os.path.exists(self.filepath):
+            if self.pack_location:
+                self._packs.remove(self.object_id)
+            elif os.path.exists(self.filepath) and 'stored-blob' in self.metadata:
+                BlobPool(self._bucket.storage_path).unlink(self.metadata['stored-blob'], self.filepath)
+            elif os.path.exists(self.filepath):
                 os.remove(self.filepath)
             else:
                 raise falcon.HTTPNotFound()
-            self._objects_metadata.pop(self.object_id)
+            self._objects_metadata.write(
+                deletes=[self.object_id], durable=self._config.durability == 'data+metadata'
+            )
 
 
     def info(self):
@@ -0,0 +1,197 @@
+#
+#   Pack files
+#
+#   Small objects are appended to rolling pack segments instead of being stored as separate
+#   files in the pairtree. The location of the object (segment, offset, length) is recorded
+#   in the `pack_index` table of bucket metadata file.
+#
+#   Compaction holds the lock of the pack directory, so the appends wait for it. The index row
+#   is moved to the new location only if it's unchanged since the snapshot, so the objects
+#   deleted or replaced during compaction are not restored. A reader which looked up the location
+#   before the segment was removed gets ENOENT and looks up the location again.
+#
+
+import os
+import time
+import fcntl
+
+from contextlib import contextmanager
+
+from handles import registry
+from sqlitedict import encode, decode
+
+
+# default max size of pack segment
+DEFAULT_SEGMENT_SIZE = 256 * 2 ** 20
+
+# the segments modified recently can have appends in progress, they are not compacted
+COMPACTION_GRACE_PERIOD = 60
+
+# the min share of deleted data in the segment to compact it
+COMPACTION_GARBAGE_RATIO = 0.5
+
+SEGMENT_NAME = 'pack-%06d'
+
+# the table of object locations in bucket metadata file
+INDEX_TABLE = 'pack_index'
+
+
+def pread(fd, length, offset):
+    ''' reads `length` bytes from the file descriptor starting from `offset`
+    '''
+    if hasattr(os, 'pread'):
+        return os.pread(fd, length, offset)
+    # the descriptor is private, so seek + read is safe
+    os.lseek(fd, offset, os.SEEK_SET)
+    chunks = list()
+    while length > 0:
+        data = os.read(fd, length)
+        if not data:
+            break
+        chunks.append(data)
+        length -= len(data)
+    return b''.join(chunks)
+
+
+class PackStore(object):
+
+    def __init__(self, bucket_path, segment_size=DEFAULT_SEGMENT_SIZE):
+
+        self._packs_path = os.path.join(bucket_path, 'packs')
+        self._segment_size = segment_size
+        self.index = registry.get(os.path.join(bucket_path, 'metadata.sqlite'), INDEX_TABLE)
+
+
+    def location(self, object_id):
+        ''' returns (segment, offset, length) of the object, None if the object is not packed
+        '''
+        try:
+            return self.index[object_id]
+        except KeyError:
+            return None
+
+
+    def segment_path(self, segment):
+
+        return os.path.join(self._packs_path, segment)
+
+
+    def segments(self):
+        ''' returns the list of segment names, ordered
+        '''
+        if not os.path.isdir(self._packs_path):
+            return list()
+        return sorted(name for name in os.listdir(self._packs_path) if name.startswith('pack-'))
+
+
+    def store(self, object_id, source_path):
+        ''' appends the content of source file to the active segment and records its location
+        '''
+        with open(source_path, 'rb') as source:
+            location = self._append(source.read())
+        self.index[object_id] = location
+        self.index.commit()
+        return location
+
+
+    def read(self, location):
+        ''' returns the object content by single pread
+        '''
+        segment, offset, length = location
+        fd = os.open(self.segment_path(segment), os.O_RDONLY)
+        try:
+            return pread(fd, length, offset)
+        finally:
+            os.close(fd)
+
+
+    def remove(self, object_id):
+        ''' removes the object location, the space is reclaimed by compaction
+        '''
+        del self.index[object_id]
+
+
+    def compact(self, garbage_ratio=COMPACTION_GARBAGE_RATIO, grace_period=COMPACTION_GRACE_PERIOD):
+        ''' rewrites the live objects of segments with the share of deleted data above `garbage_ratio`
+        to the active segment and removes those segments. Returns the dict with the numbers of
+        compacted segments and reclaimed bytes
+        '''
+        stats = {'segments': 0, 'bytes': 0}
+        if not self.segments():
+            return stats
+
+        with self._lock():
+            # the raw values of the rows are kept for compare-and-set of the new locations
+            live = dict()
+            for object_id, value in self.index.conn.select('SELECT key, value FROM %s' % INDEX_TABLE):
+                segment, offset, length = decode(value)
+                live.setdefault(segment, list()).append((offset, length, object_id, value))
+
+            segments = self.segments()
+            for segment in segments[:-1]:
+                path = self.segment_path(segment)
+                size = os.path.getsize(path)
+                if time.time() - os.path.getmtime(path) < grace_period:
+                    continue
+
+                live_bytes = sum(length for _, length, _, _ in live.get(segment, []))
+                if size and float(size - live_bytes) / size < garbage_ratio:
+                    continue
+
+                statements = list()
+                for offset, length, object_id, value in sorted(live.get(segment, [])):
+                    location = self._write(self.read((segment, offset, length)))
+                    statements.append((
+                        'UPDATE %s SET value = ? WHERE key = ? AND value = ?' % INDEX_TABLE,
+                        (encode(location), object_id, value)
+                    ))
+                self.index.conn.execute_batch(statements)
+                os.remove(path)
+
+                stats['segments'] += 1
+                stats['bytes'] += size - live_bytes
+        return stats
+
+
+    def _append(self, data):
+        ''' appends the data to the active segment under exclusive lock, returns the location of the data
+        '''
+        with self._lock():
+            return self._write(data)
+
+
+    @contextmanager
+    def _lock(self):
+        ''' holds the exclusive lock of the pack directory
+        '''
+        if not os.path.isdir(self._packs_path):
+            try:
+                os.makedirs(self._packs_path)
+            except OSError:
+                if not os.path.isdir(self._packs_path):
+                    raise
+
+        with open(os.path.join(self._packs_path, 'lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+    def _write(self, data):
+        ''' appends the data to the active segment, a new segment is started when the active one
+        is full. Returns the location of the data, the lock shall be held by the caller
+        '''
+        segments = self.segments()
+        segment = segments[-1] if segments else SEGMENT_NAME % 1
+        path = self.segment_path(segment)
+        if os.path.exists(path) and os.path.getsize(path) > 0 and \
+            os.path.getsize(path) + len(data) > self._segment_size:
+            segment = SEGMENT_NAME % (int(segment.split('-')[1]) + 1)
+            path = self.segment_path(segment)
+
+        with open(path, 'ab') as _file:
+            offset = os.fstat(_file.fileno()).st_size
+            _file.write(data)
+        return (segment, offset, len(data))
@@ -33,8 +33,13 @@ import tempfile
 import random
 import logging
 import traceback
+import time
+import weakref
 
-from threading import Thread
+from threading import Thread, Lock, local
+
+from metrics import metrics
+from executor import offload, is_cooperative
 
 major_version = sys.version_info[0]
 if major_version < 3:  # py <= 2.x
@@ -102,7 +107,7 @@ def decode(obj):
 
 class SqliteDict(DictClass):
     def __init__(self, filename=None, tablename='unnamed', flag='c',
-                 autocommit=False, journal_mode="DELETE"):
+                 autocommit=False, journal_mode=None, backend=None, synchronous=None):
         """
         Initialize a thread-safe sqlite-backed dictionary. The dictionary will
         be a table `tablename` in database file `filename`. A single file (=database)
@@ -116,7 +121,19 @@ class SqliteDict(DictClass):
         `self.clear()` and `self.close()`.
 
         Set `journal_mode` to 'OFF' if you're experiencing sqlite I/O problems
-        or if you need performance and don't care about crash-consistency.
+        or if you need performance and don't care about crash-consistency. By default
+        it's 'DELETE' for the 'multithread' backend and 'WAL' for the 'direct' one.
+
+        The `synchronous` parameter is `PRAGMA synchronous` of the connections, 'OFF' by
+        default: the commits are not synced to disk. With the WAL journal mode 'NORMAL' keeps
+        the database consistent on power loss without fsync per commit, the log is synced
+        by checkpoints or by the caller.
+
+        The `backend` parameter:
+          'multithread': default, all statements are queued to one worker thread (`SqliteMultithread`).
+          'direct': each thread uses its own connection, readers run concurrently (`SqliteDirect`).
+            The default if the process is served by gevent: the statements are run by the executor
+            threads, so they don't block the event loop.
 
         The `flag` parameter:
           'c': default mode, open for read/write, creating the db/table if necessary.
@@ -137,12 +154,21 @@ class SqliteDict(DictClass):
             if not os.path.exists(dirname):
                 raise RuntimeError('Error! The directory does not exist, %s' % dirname)
 
+        if backend is None:
+            backend = 'direct' if is_cooperative() else 'multithread'
+        if backend not in BACKENDS:
+            raise ValueError('Unknown backend %r, expected one of %s' % (backend, sorted(BACKENDS)))
+        if journal_mode is None:
+            journal_mode = 'WAL' if backend == 'direct' else 'DELETE'
+
         self.filename = filename
         self.tablename = tablename
 
         logger.info("opening Sqlite table %r in %s" % (tablename, filename))
         MAKE_TABLE = 'CREATE TABLE IF NOT EXISTS %s (key TEXT PRIMARY KEY, value BLOB)' % self.tablename
-        self.conn = SqliteMultithread(filename, autocommit=autocommit, journal_mode=journal_mode)
+        self.conn = BACKENDS[backend](
+            filename, autocommit=autocommit, journal_mode=journal_mode, synchronous=synchronous or 'OFF'
+        )
         self.conn.execute(MAKE_TABLE)
         self.conn.commit()
         if flag == 'w':
@@ -181,6 +207,44 @@ class SqliteDict(DictClass):
         GET_KEYS = 'SELECT key FROM %s ORDER BY rowid' % self.tablename
         return [key[0] for key in self.conn.select(GET_KEYS)]
 
+    def keys_range(self, start=None, stop=None, after=None, limit=None):
+        """
+        Return keys in key order, walking the primary key index instead of the whole table:
+        `start` <= key < `stop` and key > `after`, at most `limit` keys.
+        """
+        conditions, args = [], []
+        if start is not None:
+            conditions.append('key >= ?')
+            args.append(start)
+        if after is not None:
+            conditions.append('key > ?')
+            args.append(after)
+        if stop is not None:
+            conditions.append('key < ?')
+            args.append(stop)
+
+        GET_KEYS = 'SELECT key FROM %s' % self.tablename
+        if conditions:
+            GET_KEYS += ' WHERE ' + ' AND '.join(conditions)
+        GET_KEYS += ' ORDER BY key'
+        if limit is not None:
+            GET_KEYS += ' LIMIT %d' % limit
+        return [key[0] for key in self.conn.select(GET_KEYS, tuple(args))]
+
+    def get_many(self, keys, batch_size=500):
+        """
+        Return the dict of found items for the list of keys, by one `SELECT ... WHERE key IN (...)`
+        per `batch_size` keys (sqlite limits the number of statement parameters).
+        """
+        keys = list(keys)
+        items = {}
+        for i in range(0, len(keys), batch_size):
+            batch = keys[i:i + batch_size]
+            GET_ITEMS = 'SELECT key, value FROM %s WHERE key IN (%s)' % (self.tablename, ', '.join('?' * len(batch)))
+            for key, value in self.conn.select(GET_ITEMS, tuple(batch)):
+                items[key] = decode(value)
+        return items
+
     def values(self):
         GET_VALUES = 'SELECT value FROM %s ORDER BY rowid' % self.tablename
         return [decode(value[0]) for value in self.conn.select(GET_VALUES)]
@@ -294,11 +358,12 @@ class SqliteMultithread(Thread):
     in a separate thread (in the same order they arrived).
 
     """
-    def __init__(self, filename, autocommit, journal_mode):
+    def __init__(self, filename, autocommit, journal_mode, synchronous='OFF'):
         super(SqliteMultithread, self).__init__()
         self.filename = filename
         self.autocommit = autocommit
         self.journal_mode = journal_mode
+        self.synchronous = synchronous
         # use request queue of unlimited size
         self.reqs = Queue()
         self.setDaemon(True)  # python2.5-compatible
@@ -314,11 +379,13 @@ class SqliteMultithread(Thread):
         conn.execute('PRAGMA journal_mode = %s' % self.journal_mode)
         conn.text_factory = str
         cursor = conn.cursor()
-        cursor.execute('PRAGMA synchronous=OFF')
+        cursor.execute('PRAGMA synchronous=%s' % self.synchronous)
 
         res = None
         while True:
-            req, arg, res, outer_stack = self.reqs.get()
+            req, arg, res, outer_stack, enqueued = self.reqs.get()
+            started = time.time()
+            metrics.observe('objectstore_sqlite_queue_wait_seconds', started - enqueued)
             if req == '--close--':
                 assert res, ('--close-- without return queue', res)
                 break
@@ -326,6 +393,27 @@ class SqliteMultithread(Thread):
                 conn.commit()
                 if res:
                     res.put('--no more--')
+            elif req == '--batch--':
+                try:
+                    if self.autocommit:
+                        cursor.execute('BEGIN')
+                    for statement, statement_arg in arg:
+                        cursor.execute(statement, statement_arg)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    self.exception = sys.exc_info()
+                    self.log.error('The batch is rolled back, the exception will be re-raised at next call.')
+                if res:
+                    res.put('--no more--')
+            elif req == '--transaction--':
+                try:
+                    run_transaction(conn, arg)
+                except Exception:
+                    self.exception = sys.exc_info()
+                    self.log.error('The transaction is rolled back, the exception will be re-raised at next call.')
+                if res:
+                    res.put('--no more--')
             else:
                 try:
                     cursor.execute(req, arg)
@@ -363,6 +451,7 @@ class SqliteMultithread(Thread):
 
                 if self.autocommit:
                     conn.commit()
+            metrics.observe('objectstore_sqlite_execute_seconds', time.time() - started)
 
         self.log.debug('received: %s, send: --no more--', req)
         conn.close()
@@ -407,13 +496,29 @@ class SqliteMultithread(Thread):
         # jython take a severe performance impact for throwing exceptions
         # so often.
         stack = traceback.extract_stack()[:-1]
-        self.reqs.put((req, arg or tuple(), res, stack))
+        self.reqs.put((req, arg or tuple(), res, stack, time.time()))
 
     def executemany(self, req, items):
         for item in items:
             self.execute(req, item)
         self.check_raise_error()
 
+    def execute_batch(self, statements):
+        """
+        Execute the list of (statement, arguments) in one transaction, blocking.
+        The transaction is rolled back and the exception is re-raised if any statement fails.
+        """
+        self.select_one('--batch--', [(req, arg or tuple()) for req, arg in statements])
+
+    def transaction(self, func):
+        """
+        Call `func(cursor)` in one immediate transaction, blocking: the write lock of the database
+        is taken at the start, so the statements of `func` can depend on what it reads.
+        The transaction is rolled back and the exception is re-raised if `func` fails.
+        """
+        self.check_raise_error()
+        self.select_one('--transaction--', func)
+
     def select(self, req, arg=None):
         """
         Unlike sqlite's native select, this select doesn't handle iteration efficiently.
@@ -456,3 +561,180 @@ class SqliteMultithread(Thread):
         self.select_one('--close--')
         self.join()
 #endclass SqliteMultithread
+
+
+class SqliteDirect(object):
+    """
+    Sqlite connections owned by the calling threads, an alternative to `SqliteMultithread`.
+
+    Each thread opens its own connection on first use, so statements are not serialized
+    through a queue. With the WAL journal mode readers don't block each other nor the writer.
+    The rows of `select` are fetched from the cursor in batches of `batch_size`.
+
+    Without `autocommit`, `commit` persists only the transaction of the calling thread.
+
+    The connection is closed when its thread (or greenlet) ends and the thread-local data is released,
+    so the short-lived threads do not leak connections.
+
+    The calls are offloaded to the executor threads (see executor.py), so under gevent workers
+    the connections belong to the executor threads and sqlite does not block the event loop.
+    Use `autocommit` there: the statements of one greenlet can be run by different threads.
+
+    """
+    def __init__(self, filename, autocommit, journal_mode, synchronous='OFF', batch_size=256, timeout=30.0):
+        if filename == ':memory:':
+            raise ValueError('The direct backend cannot share an in-memory database between threads')
+        self.filename = filename
+        self.autocommit = autocommit
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.log = logging.getLogger('sqlitedict.SqliteDirect')
+        self._local = local()
+        self._lock = Lock()
+        self._connections = weakref.WeakSet()
+        self._closed = False
+
+    def connection(self):
+        """Return the connection of the calling thread, open it if needed."""
+        owner = getattr(self._local, 'owner', None)
+        if owner is None:
+            if self._closed:
+                raise RuntimeError('The connection to %s is closed' % self.filename)
+            if self.autocommit:
+                conn = sqlite3.connect(self.filename, isolation_level=None,
+                                       check_same_thread=False, timeout=self.timeout)
+            else:
+                conn = sqlite3.connect(self.filename, check_same_thread=False, timeout=self.timeout)
+            conn.execute('PRAGMA journal_mode = %s' % self.journal_mode)
+            conn.execute('PRAGMA synchronous=%s' % self.synchronous)
+            conn.text_factory = str
+            owner = ThreadConnection(conn)
+            self._local.owner = owner
+            with self._lock:
+                self._connections.add(owner)
+        return owner.conn
+
+    def execute(self, req, arg=None, res=None):
+        """
+        `execute` calls are blocking, `res` is accepted for compatibility with `SqliteMultithread`.
+        """
+        rows = offload(self._execute, req, arg, res is not None)
+        if res is not None:
+            for rec in rows:
+                res.put(rec)
+            res.put('--no more--')
+
+    def _execute(self, req, arg, fetch):
+        with metrics.timer('objectstore_sqlite_execute_seconds'):
+            cursor = self.connection().execute(req, arg or tuple())
+        if fetch:
+            return cursor.fetchall()
+
+    def executemany(self, req, items):
+        offload(lambda: self.connection().executemany(req, items))
+
+    def execute_batch(self, statements):
+        """
+        Execute the list of (statement, arguments) in one transaction.
+        The transaction is rolled back and the exception is raised if any statement fails.
+        """
+        offload(self._execute_batch, statements)
+
+    def _execute_batch(self, statements):
+        conn = self.connection()
+        with metrics.timer('objectstore_sqlite_execute_seconds'):
+            try:
+                if self.autocommit:
+                    conn.execute('BEGIN')
+                for req, arg in statements:
+                    conn.execute(req, arg or tuple())
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def transaction(self, func):
+        """
+        Call `func(cursor)` in one immediate transaction, see `SqliteMultithread.transaction`.
+        """
+        offload(lambda: run_transaction(self.connection(), func))
+
+    def select(self, req, arg=None):
+        cursor = offload(lambda: self.connection().execute(req, arg or tuple()))
+        while True:
+            rows = offload(cursor.fetchmany, self.batch_size)
+            if not rows:
+                break
+            for rec in rows:
+                yield rec
+
+    def select_one(self, req, arg=None):
+        """Return only the first row of the SELECT, or None if there are no matching rows."""
+        return offload(self._select_one, req, arg)
+
+    def _select_one(self, req, arg):
+        with metrics.timer('objectstore_sqlite_execute_seconds'):
+            return self.connection().execute(req, arg or tuple()).fetchone()
+
+    def commit(self, blocking=True):
+        offload(self._commit)
+
+    def _commit(self):
+        owner = getattr(self._local, 'owner', None)
+        if owner is not None:
+            owner.conn.commit()
+
+    def close(self):
+        with self._lock:
+            owners, self._connections = list(self._connections), weakref.WeakSet()
+            self._closed = True
+        for owner in owners:
+            owner.conn.close()
+#endclass SqliteDirect
+
+
+class ThreadConnection(object):
+    """
+    The connection of one thread, kept in the thread-local data of `SqliteDirect`.
+    The connection is closed when the thread ends and its thread-local data is released.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __del__(self):
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+#endclass ThreadConnection
+
+
+def run_transaction(conn, func):
+    """Call `func(cursor)` in the immediate transaction of the connection, commit or roll back."""
+    # without autocommit the python module would commit the open transaction before other statements than DML
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            func(cursor)
+            cursor.execute('COMMIT')
+        except Exception:
+            exc_info = sys.exc_info()
+            try:
+                cursor.execute('ROLLBACK')
+            except sqlite3.Error:
+                # some errors roll the transaction back by themselves
+                pass
+            reraise(*exc_info)
+    finally:
+        conn.isolation_level = isolation_level
+
+
+BACKENDS = {
+    'multithread': SqliteMultithread,
+    'direct': SqliteDirect,
+}
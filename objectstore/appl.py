@@ -1,19 +1,59 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+#
+#   WSGI application
+#
+#   Sync workers, one request per process at a time:
+#
+#       gunicorn -b 0.0.0.0 objectstore.appl
+#
+#   Gevent workers, thousands of concurrent slow connections per process. The bodies are read
+#   and sent by cooperative sockets, hashing, compression and file writes are offloaded to
+#   the bounded pool of native threads (OBJECTSTORE_EXECUTOR_WORKERS, 16 by default):
+#
+#       gunicorn -b 0.0.0.0 -k gevent --worker-connections 2000 objectstore.appl
+#
+#   The metrics are served by `/metrics`, set OBJECTSTORE_METRICS_DIR to the empty directory
+#   shared by the workers to aggregate the metrics of all workers.
+#
 
+import os
 import falcon
 
-from objectstore.api import service 
-from objectstore.api import buckets 
-from objectstore.api import objects 
+from objectstore.api import service
+from objectstore.api import buckets
+from objectstore.api import objects
+from objectstore.api import executor
+from objectstore.api import metrics
 
-api = application = falcon.API()
 
-storage_path='/data/objectstore/'
+DEFAULT_STORAGE_PATH = '/data/objectstore/'
 
-api.add_route('/service', service.ServiceAPI(storage_path=storage_path))
-api.add_route('/bucket', buckets.BucketCollectionAPI(storage_path=storage_path))
-api.add_route('/bucket/{bucket_name}', buckets.BucketAPI(storage_path=storage_path))
-api.add_route('/bucket/{bucket_name}/object/{object_id}', objects.ObjectAPI(storage_path=storage_path))
 
+def create_app(storage_path=None, executor_workers=None):
+    ''' returns the WSGI application serving the storage, the path is taken from
+    OBJECTSTORE_STORAGE_PATH environment variable if it's not given
+    '''
+    if storage_path is None:
+        storage_path = os.environ.get('OBJECTSTORE_STORAGE_PATH', DEFAULT_STORAGE_PATH)
+    if executor_workers is not None:
+        executor.configure(executor_workers)
 
+    routes = (
+        ('/service', service.ServiceAPI(storage_path=storage_path)),
+        ('/bucket', buckets.BucketCollectionAPI(storage_path=storage_path)),
+        ('/bucket/{bucket_name}', buckets.BucketAPI(storage_path=storage_path)),
+        ('/bucket/{bucket_name}/object/{object_id}', objects.ObjectAPI(storage_path=storage_path)),
+        ('/metrics', metrics.MetricsAPI()),
+    )
+    middleware = metrics.MetricsMiddleware(metrics.metrics)
+    api = falcon.API(middleware=[middleware])
+    # the status of the errors is known to the middleware only if the error is handled
+    api.add_error_handler(Exception, middleware.handle_error)
+    for uri_template, resource in routes:
+        api.add_route(uri_template, resource)
+        middleware.routes[id(resource)] = uri_template
+    return api
+
+
+api = application = create_app()
@@ -0,0 +1,152 @@
+#
+#   Command line tools
+#
+
+import os
+import sys
+import argparse
+
+import falcon
+
+from objectstore.api.buckets import Bucket, MAX_PAIRTREE_DEPTH
+from objectstore.api import packs
+from objectstore.api import blobs
+from objectstore.api import ingest as bulk
+from objectstore.api import export as exporter
+
+
+def open_bucket(parser, storage_path, bucket_name):
+    ''' returns existing bucket or exits with the usage error
+    '''
+    try:
+        bucket = Bucket(bucket_name, storage_path=storage_path)
+    except falcon.HTTPError as err:
+        parser.error(err.description)
+    if not bucket.exists():
+        parser.error('The bucket does not exist, "%s"' % bucket_name)
+    return bucket
+
+
+def compact(argv=None):
+    ''' objectstore-compact: reclaims the space of deleted objects in pack segments of the bucket
+    '''
+    parser = argparse.ArgumentParser(
+        prog='objectstore-compact',
+        description='Reclaims the space of deleted objects in pack segments of the bucket'
+    )
+    parser.add_argument('storage_path', help='the path to the storage')
+    parser.add_argument('bucket', help='the bucket name')
+    parser.add_argument('--garbage-ratio', type=float, default=packs.COMPACTION_GARBAGE_RATIO,
+                        help='the min share of deleted data in the segment to compact it, default: %(default)s')
+    parser.add_argument('--grace-period', type=int, default=packs.COMPACTION_GRACE_PERIOD,
+                        help='the segments modified within this period (seconds) are skipped, default: %(default)s')
+    args = parser.parse_args(argv)
+
+    bucket = open_bucket(parser, args.storage_path, args.bucket)
+    store = packs.PackStore(bucket.bucket_path, bucket.config.pack_segment_size)
+    stats = store.compact(garbage_ratio=args.garbage_ratio, grace_period=args.grace_period)
+    print 'compacted segments: %(segments)d, reclaimed bytes: %(bytes)d' % stats
+
+
+def repair_blobs(argv=None):
+    ''' objectstore-repair-blobs: rebuilds the refcount table of the blob pool and removes 
+    the blobs which are not linked to buckets
+    '''
+    parser = argparse.ArgumentParser(
+        prog='objectstore-repair-blobs',
+        description='Rebuilds the refcount table of the blob pool and removes unused blobs'
+    )
+    parser.add_argument('storage_path', help='the path to the storage')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(os.path.join(args.storage_path, blobs.BLOB_POOL_NAME)):
+        parser.error('The storage has no blob pool, "%s"' % args.storage_path)
+    stats = blobs.BlobPool(args.storage_path).repair()
+    print 'blobs: %(blobs)d, removed blobs: %(removed)d' % stats
+
+
+def reshard(argv=None):
+    ''' objectstore-reshard: moves the object files of the bucket to the pairtree of the given depth,
+    the objects are served from both layouts while the files are moved
+    '''
+    parser = argparse.ArgumentParser(
+        prog='objectstore-reshard',
+        description='Moves the object files of the bucket to the pairtree of the given depth'
+    )
+    parser.add_argument('storage_path', help='the path to the storage')
+    parser.add_argument('bucket', help='the bucket name')
+    parser.add_argument('depth', type=int, choices=range(MAX_PAIRTREE_DEPTH + 1),
+                        help='the directory levels of the pairtree')
+    args = parser.parse_args(argv)
+
+    bucket = open_bucket(parser, args.storage_path, args.bucket)
+    try:
+        stats = bucket.reshard(args.depth)
+    except RuntimeError as err:
+        parser.error(str(err))
+    print 'moved files: %(moved)d, skipped files: %(skipped)d, removed directories: %(directories)d' % stats
+
+
+def report_progress(stats, elapsed):
+    ''' prints the number of ingested files and the rates
+    '''
+    elapsed = max(elapsed, 0.001)
+    print 'files: %d, bytes: %d, files/sec: %.1f, MB/sec: %.2f' % (
+        stats['files'], stats['bytes'], stats['files'] / elapsed, stats['bytes'] / elapsed / 2 ** 20
+    )
+
+
+def ingest(argv=None):
+    ''' objectstore-ingest: loads the files of the directory tree into the bucket
+    '''
+    parser = argparse.ArgumentParser(
+        prog='objectstore-ingest',
+        description='Loads the files of the directory tree into the bucket, the interrupted ingest is resumed'
+    )
+    parser.add_argument('storage_path', help='the path to the storage')
+    parser.add_argument('bucket', help='the bucket name')
+    parser.add_argument('source_path', help='the directory to load')
+    parser.add_argument('--mode', choices=bulk.MODES, default='copy',
+                        help='how the files are placed into the bucket, default: %(default)s')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='the number of hashing processes, default: the number of CPUs')
+    parser.add_argument('--batch-size', type=int, default=bulk.DEFAULT_BATCH_SIZE,
+                        help='the number of files committed in one transaction, default: %(default)s')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.source_path):
+        parser.error('The source path is not a directory, "%s"' % args.source_path)
+    bucket = open_bucket(parser, args.storage_path, args.bucket)
+    try:
+        loader = bulk.BulkIngest(
+            bucket, args.source_path, mode=args.mode, batch_size=args.batch_size, workers=args.workers
+        )
+    except RuntimeError as err:
+        parser.error(str(err))
+    stats = loader.run(progress=report_progress)
+    print 'ingested files: %(files)d, duplicates: %(duplicates)d, rejected: %(rejected)d, ' \
+          'skipped: %(skipped)d, recovered: %(recovered)d' % stats
+
+
+def export(argv=None):
+    ''' objectstore-export: writes the tar archive of the bucket objects and the metadata manifest
+    '''
+    parser = argparse.ArgumentParser(
+        prog='objectstore-export',
+        description='Writes the tar archive of the bucket objects and the metadata manifest'
+    )
+    parser.add_argument('storage_path', help='the path to the storage')
+    parser.add_argument('bucket', help='the bucket name')
+    parser.add_argument('--prefix', default=u'', help='exports the objects with the keys starting with the prefix')
+    parser.add_argument('--marker', default=None, help='exports the objects with the keys after the marker')
+    parser.add_argument('-o', '--output', default=None, help='the path to the archive, default: stdout')
+    args = parser.parse_args(argv)
+
+    bucket = open_bucket(parser, args.storage_path, args.bucket)
+    output = open(args.output, 'wb') if args.output else sys.stdout
+    try:
+        for data in exporter.export_bucket(bucket, prefix=args.prefix, marker=args.marker):
+            output.write(data)
+    finally:
+        if args.output:
+            output.close()
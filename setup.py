@@ -10,7 +10,19 @@ setup_args = {
     'maintainer': objectstore.__author__,
     'maintainer_email': 'ownport@gmail.com',
     'license': 'Apache 2.0',
-    'packages': ['objectstore', ],
+    'packages': ['objectstore', 'objectstore.api', ],
+    'extras_require': {
+        'gevent': ['gevent>=20.12'],
+    },
+    'entry_points': {
+        'console_scripts': [
+            'objectstore-compact = objectstore.cli:compact',
+            'objectstore-repair-blobs = objectstore.cli:repair_blobs',
+            'objectstore-reshard = objectstore.cli:reshard',
+            'objectstore-ingest = objectstore.cli:ingest',
+            'objectstore-export = objectstore.cli:export',
+        ],
+    },
     'classifiers': [
         'Programming Language :: Python',
         'Programming Language :: Python :: 2.6',
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import falcon
+import shutil
+import tempfile
+import unittest
+
+from objectstore.api import blobs
+
+from test_objectstore import ObjectStoreTestBase
+
+
+KEY = '9d56858ab62ca2d6de624b262a3d7b522403026982a01b6b4f82e46f0146ee51'
+
+
+class TestBlobPool(unittest.TestCase):
+
+    def setUp(self):
+
+        self.storage_path = tempfile.mkdtemp(dir='/tmp/')
+        self.pool = blobs.BlobPool(self.storage_path)
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.storage_path, ignore_errors=True)
+
+
+    def temp_file(self, data):
+
+        handler, path = tempfile.mkstemp(dir=self.storage_path)
+        os.write(handler, data)
+        os.close(handler)
+        return path
+
+
+    def test_blob_key(self):
+
+        self.assertEqual(blobs.blob_key({'content-sha256': KEY}), KEY)
+        self.assertEqual(blobs.blob_key({'content-sha256': KEY, 'stored-codec': 'gzip', 'stored-length': 25}), KEY + '.gzip.25')
+
+
+    def test_link_unlink(self):
+
+        target1 = os.path.join(self.storage_path, 'b1', 'data', KEY)
+        target2 = os.path.join(self.storage_path, 'b2', 'data', KEY)
+
+        self.assertFalse(self.pool.link(KEY, self.temp_file('#####'), target1))
+        self.assertTrue(self.pool.link(KEY, self.temp_file('#####'), target2))
+        self.assertEqual(self.pool.refcount[KEY], 2)
+        self.assertEqual(os.stat(target1).st_ino, os.stat(self.pool.blob_path(KEY)).st_ino)
+        self.assertEqual(os.stat(target2).st_ino, os.stat(self.pool.blob_path(KEY)).st_ino)
+
+        self.pool.unlink(KEY, target1)
+        self.assertEqual(self.pool.refcount[KEY], 1)
+        self.assertTrue(os.path.exists(self.pool.blob_path(KEY)))
+
+        self.pool.unlink(KEY, target2)
+        self.assertFalse(KEY in self.pool.refcount)
+        self.assertFalse(os.path.exists(self.pool.blob_path(KEY)))
+
+
+    def test_repair(self):
+
+        target = os.path.join(self.storage_path, 'b1', 'data', KEY)
+        self.pool.link(KEY, self.temp_file('#####'), target)
+
+        # the crash between removing the object file and updating the refcount
+        os.remove(target)
+        self.pool.refcount['unknown'] = 1
+        self.assertEqual(self.pool.repair(), {'blobs': 0, 'removed': 1})
+        self.assertEqual(self.pool.refcount.keys(), [])
+        self.assertFalse(os.path.exists(self.pool.blob_path(KEY)))
+
+
+class TestObjectStoreDedupObjects(ObjectStoreTestBase):
+
+    def before(self):
+
+        super(TestObjectStoreDedupObjects, self).before()
+        self.simulate_request('/bucket', method='PUT', query_string='name=test_dedup1&dedup=1')
+        self.simulate_request('/bucket', method='PUT', query_string='name=test_dedup2&dedup=1')
+
+
+    def test_reserved_bucket_name(self):
+
+        body = self.simulate_request('/bucket', method='PUT', query_string='name=%s' % blobs.BLOB_POOL_NAME)
+        self.assertEqual(self.srmock.status, falcon.HTTP_400)
+
+        body = self.simulate_request('/service', method='GET')
+        self.assertEqual(
+            sorted(bucket[u'name'] for bucket in json.loads(body[0])[u'buckets']),
+            [u'test_dedup1', u'test_dedup2']
+        )
+
+
+    def test_dedup_objects(self):
+
+        for bucket_name in ('test_dedup1', 'test_dedup2'):
+            body = self.simulate_request('/bucket/%s/object/content' % bucket_name, method='PUT', body='#####')
+            self.assertEqual(self.srmock.status, falcon.HTTP_200)
+            self.assertEqual(json.loads(body[0])[u'stored-blob'], KEY)
+
+        pool = blobs.BlobPool(self.storage_path)
+        self.assertEqual(pool.refcount[KEY], 2)
+
+        object_path = '/bucket/test_dedup1/object/c51d430a95691338da6a2455353eb0ab5fe08ef6'
+        body = self.simulate_request(object_path, method='DELETE')
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        self.assertEqual(pool.refcount[KEY], 1)
+
+        body = self.simulate_request(
+            '/bucket/test_dedup2/object/c51d430a95691338da6a2455353eb0ab5fe08ef6', method='GET')
+        self.assertEqual(''.join(body), '#####')
+
+        body = self.simulate_request('/bucket/test_dedup2/object/c51d430a95691338da6a2455353eb0ab5fe08ef6', method='DELETE')
+        self.assertFalse(KEY in pool.refcount)
+        self.assertFalse(os.path.exists(pool.blob_path(KEY)))
+
+
+    def test_dedup_compression_levels(self):
+
+        data = 'abcdefghij' * 1000
+        lengths = list()
+        for level in (1, 9):
+            bucket_name = 'test_dedup_level%d' % level
+            self.simulate_request('/bucket', method='PUT', query_string='name=%s&dedup=1&compression=zlib&compression-level=%d' % (bucket_name, level))
+            body = self.simulate_request('/bucket/%s/object/content' % bucket_name, method='PUT', body=data)
+            self.assertEqual(self.srmock.status, falcon.HTTP_200)
+            object_id = json.loads(body[0])[u'content-sha1']
+
+            # the content compressed at other level is not linked to the same blob
+            self.simulate_request('/bucket/%s/object/%s' % (bucket_name, object_id), method='HEAD', headers={'accept-encoding': 'deflate'})
+            self.assertEqual(self.srmock.status, falcon.HTTP_200)
+            headers = dict(self.srmock.headers)
+            bucket_path = os.path.join(self.storage_path, bucket_name)
+            filepath = [os.path.join(path, name) for path, _, names in os.walk(os.path.join(bucket_path, 'data')) for name in names][0]
+            self.assertEqual(int(headers['content-length']), os.path.getsize(filepath))
+            lengths.append(os.path.getsize(filepath))
+
+        self.assertNotEqual(lengths[0], lengths[1])
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import falcon
+import sqlite3
 
 from objectstore.api import buckets
 
@@ -29,6 +30,65 @@ class TestBucket(ObjectStoreTestBase):
         self.assertRaises(falcon.HTTPNotFound, bucket.delete)
 
 
+    def test_object_list_delimiter(self):
+
+        bucket = buckets.Bucket('delimiter-check', storage_path=self.storage_path)
+        bucket.create()
+        objects = bucket.objects_metadata()
+        objects.update(dict((key, {}) for key in ('a', 'b/1', 'b/2', 'c/1/x', 'c/2', 'd')))
+        objects.commit()
+
+        listing = bucket.object_list(delimiter='/')
+        self.assertEqual(listing['objects'], ['a', 'd'])
+        self.assertEqual(listing['common-prefixes'], ['b/', 'c/'])
+        self.assertFalse(listing['is-truncated'])
+
+        listing = bucket.object_list(prefix='c/', delimiter='/')
+        self.assertEqual(listing['objects'], ['c/2'])
+        self.assertEqual(listing['common-prefixes'], ['c/1/'])
+
+        listing = bucket.object_list(delimiter='/', max_keys=2)
+        self.assertEqual(listing['objects'], ['a'])
+        self.assertEqual(listing['common-prefixes'], ['b/'])
+        self.assertTrue(listing['is-truncated'])
+
+        marker = buckets.decode_continuation_token(listing['next-continuation-token'])
+        listing = bucket.object_list(delimiter='/', marker=marker, max_keys=2)
+        self.assertEqual(listing['objects'], ['d'])
+        self.assertEqual(listing['common-prefixes'], ['c/'])
+        self.assertFalse(listing['is-truncated'])
+
+
+    def test_bucket_config_cache(self):
+
+        bucket = buckets.Bucket('config-check', storage_path=self.storage_path)
+        bucket.metadata = {'name': 'config-check', 'object-key': 'content-md5'}
+        bucket.create()
+
+        config = bucket.config
+        self.assertEqual(config.object_key, 'content-md5')
+        self.assertTrue(config is buckets.Bucket('config-check', storage_path=self.storage_path).config)
+
+        # the change of metadata from another connection invalidates the cached config
+        conn = sqlite3.connect(bucket.metadata_path, isolation_level=None)
+        conn.execute('DELETE FROM bucket WHERE key = ?', ('object-key',))
+        conn.close()
+
+        config = bucket.config
+        self.assertEqual(config.object_key, 'content-sha1')
+        self.assertEqual(config.metadata, {'name': 'config-check'})
+
+        bucket.metadata = {'object-key': 'content-md5'}
+        self.assertEqual(bucket.config.object_key, 'content-md5')
+
+
+    def test_prefix_upper_bound(self):
+
+        self.assertEqual(buckets.prefix_upper_bound(u'ab'), u'ac')
+        self.assertEqual(buckets.prefix_upper_bound('a\xff'), 'b')
+        self.assertEqual(buckets.prefix_upper_bound('\xff'), None)
+
+
 class TestBucketCollection(ObjectStoreTestBase):
 
     def test_incorrect_storage_path(self):
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+import os
+import falcon
+import shutil
+import tempfile
+import unittest
+import threading
+
+from objectstore.api import catalog
+from objectstore.api.sqlitedict import SqliteDict
+
+
+OBJECTS = {
+    'o1': {'content-length': 10, 'content-type': 'image/png', 'content-name': 'a.png', 'created': 3},
+    'o2': {'content-length': 20, 'content-type': 'image/png', 'content-name': 'b.png', 'created': 2},
+    'o3': {'content-length': 30, 'content-type': 'text/plain', 'content-name': 'c.txt', 'created': 1},
+}
+
+
+class TestObjectCatalog(unittest.TestCase):
+
+    def setUp(self):
+
+        self.path = tempfile.mkdtemp(dir='/tmp/')
+        self.filename = os.path.join(self.path, 'metadata.sqlite')
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+    def test_parse_query(self):
+
+        self.assertEqual(
+            catalog.parse_query(['content-type=image/png', 'content-length>=10', 'content-name^=a']),
+            [('content-type', '=', u'image/png'), ('content-length', '>=', 10), ('content-name', '^=', u'a')]
+        )
+        self.assertRaises(falcon.HTTPInvalidParam, catalog.parse_query, ['unknown=1'])
+        self.assertRaises(falcon.HTTPInvalidParam, catalog.parse_query, ['content-length=a'])
+        self.assertRaises(falcon.HTTPInvalidParam, catalog.parse_query, ['content-length^=1'])
+        self.assertEqual(catalog.parse_order('-created'), ('created', True))
+        self.assertRaises(falcon.HTTPInvalidParam, catalog.parse_order, 'unknown')
+
+
+    def test_columns(self):
+
+        self.assertEqual(
+            catalog.columns({'content-length': '5', 'stored-codec': 'gzip'}),
+            (5, u'', u'', u'', u'', u'', 0, '{"stored-codec": "gzip"}')
+        )
+
+
+    def test_migration(self):
+
+        with SqliteDict(self.filename, 'objects', autocommit=True) as objects:
+            objects.update(OBJECTS)
+
+        with catalog.ObjectCatalog(self.filename, 'objects', autocommit=True) as objects:
+            self.assertEqual(objects['o1'], OBJECTS['o1'])
+            self.assertEqual(
+                [key for key, _, _ in objects.search([('content-type', '=', u'image/png')])], ['o1', 'o2'])
+
+
+    def test_concurrent_migration(self):
+
+        with SqliteDict(self.filename, 'objects', autocommit=True) as objects:
+            objects.update(OBJECTS)
+
+        # the table is migrated by one of the catalogs opened concurrently, the others find it migrated
+        errors, catalogs = list(), list()
+
+        def open_catalog(backend):
+            try:
+                catalogs.append(catalog.ObjectCatalog(
+                    self.filename, 'objects', autocommit=True, journal_mode='WAL', backend=backend
+                ))
+            except Exception as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=open_catalog, args=(backend,)) for backend in ['multithread', 'direct'] * 6]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for objects in catalogs:
+            objects.close()
+        self.assertEqual(errors, [])
+        with catalog.ObjectCatalog(self.filename, 'objects', autocommit=True) as objects:
+            self.assertEqual(objects.stats(), {'objects': 3, 'bytes': 60})
+
+
+    def test_search(self):
+
+        with catalog.ObjectCatalog(self.filename, 'objects', autocommit=True) as objects:
+            objects.update(OBJECTS)
+            objects['o4'] = {'content-length': 40, 'content-type': 'image/jpeg', 'created': 4}
+
+            search = lambda *args, **kwargs: [key for key, _, _ in objects.search(*args, **kwargs)]
+            self.assertEqual(search([('content-type', '^=', u'image/')]), ['o1', 'o2', 'o4'])
+            self.assertEqual(search([('content-type', '^=', u'image/'), ('content-length', '>', 10)]), ['o2', 'o4'])
+            self.assertEqual(search(order='created'), ['o3', 'o2', 'o1', 'o4'])
+            self.assertEqual(search(order='created', descending=True, limit=2), ['o4', 'o1'])
+            self.assertEqual(search(order='created', descending=True, after=(3, 'o1')), ['o2', 'o3'])
+            self.assertEqual(search([('content-name', '=', u'')]), ['o4'])
+
+            del objects['o4']
+            self.assertEqual(search([('content-length', '>=', 30)]), ['o3'])
+
+
+    def test_stats(self):
+
+        with SqliteDict(self.filename, 'objects', autocommit=True) as objects:
+            objects.update(OBJECTS)
+
+        with catalog.ObjectCatalog(self.filename, 'objects', autocommit=True) as objects:
+            self.assertEqual(objects.stats(), {'objects': 3, 'bytes': 60})
+
+            objects['o1'] = {'content-length': 15}
+            objects['o4'] = {'content-length': 40}
+            del objects['o2']
+            self.assertEqual(objects.stats(), {'objects': 3, 'bytes': 85})
+
+            objects.conn.execute('UPDATE objects SET content_length = 5 WHERE key = ?', ('o1',))
+            self.assertEqual(objects.stats(), {'objects': 3, 'bytes': 75})
+
+        # the counters are initialized once
+        with catalog.ObjectCatalog(self.filename, 'objects', autocommit=True) as objects:
+            self.assertEqual(objects.stats(), {'objects': 3, 'bytes': 75})
+
+
+    def test_write_batch(self):
+
+        with catalog.ObjectCatalog(self.filename, 'objects', autocommit=True) as objects:
+            transactions = list()
+            execute_batch = objects.conn.execute_batch
+
+            def counted_batch(statements):
+                transactions.append(len(statements))
+                execute_batch(statements)
+
+            objects.conn.execute_batch = counted_batch
+            objects._writes.window = 0.05
+            threads = [
+                threading.Thread(target=objects.write, args=([('o%d' % i, {'content-length': i})],))
+                for i in range(20)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            # the concurrent writes are committed by fewer transactions, each write is visible on return
+            self.assertEqual(sum(transactions), 20)
+            self.assertTrue(len(transactions) < 20)
+            self.assertEqual(objects.stats(), {'objects': 20, 'bytes': 190})
+
+            objects.write(updates=[('o0', {'content-length': 100})], deletes=['o1', 'o2'], durable=True)
+            self.assertEqual(objects.stats(), {'objects': 18, 'bytes': 287})
+            self.assertEqual(objects['o0'], {'content-length': 100})
+
+            # the group is committed without waiting for the window once it has max rows
+            objects._writes.window, objects._writes.max_size = 10, 2
+            objects.write(updates=[('o30', {}), ('o31', {})])
+            self.assertEqual(len(objects), 20)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+import os
+import gzip
+import json
+import zlib
+import falcon
+import unittest
+
+from StringIO import StringIO
+
+from objectstore.api import compression
+
+from test_objectstore import ObjectStoreTestBase
+
+
+CONTENT = '{"key": "value"}\n' * 1000
+
+
+class TestCompression(unittest.TestCase):
+
+    def compress(self, codec, data):
+
+        compressor = codec.compressor()
+        return compressor.compress(data) + compressor.flush()
+
+
+    def test_codecs(self):
+
+        for name, codec in compression.CODECS.items():
+            compressed = self.compress(codec, CONTENT)
+            self.assertTrue(len(compressed) < len(CONTENT), name)
+            reader = compression.DecompressingReader(StringIO(compressed), codec)
+            self.assertEqual(reader.read(10) + reader.read(), CONTENT, name)
+
+
+    def test_content_encodings(self):
+
+        self.assertEqual(zlib.decompress(self.compress(compression.get_codec('zlib'), CONTENT)), CONTENT)
+        compressed = StringIO(self.compress(compression.get_codec('gzip'), CONTENT))
+        self.assertEqual(gzip.GzipFile(fileobj=compressed).read(), CONTENT)
+        self.assertEqual(compression.get_codec('unknown'), None)
+
+
+    def test_accepts_encoding(self):
+
+        self.assertTrue(compression.accepts_encoding('gzip, deflate', 'gzip'))
+        self.assertTrue(compression.accepts_encoding('deflate;q=0.5', 'deflate'))
+        self.assertTrue(compression.accepts_encoding('*', 'gzip'))
+        self.assertFalse(compression.accepts_encoding('gzip;q=0', 'gzip'))
+        self.assertFalse(compression.accepts_encoding('identity', 'gzip'))
+        self.assertFalse(compression.accepts_encoding(None, 'gzip'))
+        self.assertFalse(compression.accepts_encoding('gzip', None))
+        # the coding itself takes precedence over *
+        self.assertFalse(compression.accepts_encoding('*, gzip;q=0', 'gzip'))
+        self.assertFalse(compression.accepts_encoding('gzip;q=0, *', 'gzip'))
+        self.assertTrue(compression.accepts_encoding('*;q=0, gzip', 'gzip'))
+        self.assertFalse(compression.accepts_encoding('*;q=0, deflate', 'gzip'))
+
+
+class TestObjectStoreCompressedObjects(ObjectStoreTestBase):
+
+    def before(self):
+
+        super(TestObjectStoreCompressedObjects, self).before()
+        self.simulate_request('/bucket', method='PUT', query_string='name=test_gzip&compression=gzip&compression-level=9')
+        self.simulate_request('/bucket', method='PUT', query_string='name=test_bz2&compression=bz2&pack-threshold=4096')
+
+
+    def test_unknown_codec(self):
+
+        body = self.simulate_request('/bucket', method='PUT', query_string='name=test_codec&compression=rar')
+        self.assertEqual(self.srmock.status, falcon.HTTP_400)
+
+
+    def test_compression_level(self):
+
+        for query_string in ('compression=zlib&compression-level=42', 'compression=gzip&compression-level=-2',
+                             'compression=bz2&compression-level=0', 'compression=zlib&compression-level=fast',
+                             'compression-level=fast'):
+            body = self.simulate_request('/bucket', method='PUT', query_string='name=test_level&' + query_string)
+            self.assertEqual(self.srmock.status, falcon.HTTP_400, query_string)
+
+        for codec, level in (('zlib', -1), ('zlib', 0), ('bz2', 1), ('gzip', 9)):
+            bucket_name = 'test_level_%s_%s' % (codec, level)
+            self.simulate_request(
+                '/bucket', method='PUT', query_string='name=%s&compression=%s&compression-level=%s' % (bucket_name, codec, level)
+            )
+            self.assertEqual(self.srmock.status, falcon.HTTP_200)
+            self.simulate_request('/bucket/%s/object/content' % bucket_name, method='PUT', body=CONTENT)
+            self.assertEqual(self.srmock.status, falcon.HTTP_200)
+
+
+    def test_compressed_object(self):
+
+        body = self.simulate_request(
+            '/bucket/test_gzip/object/content.json', method='PUT', body=CONTENT,
+            headers={'Content-Type': 'application/json'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        info = json.loads(body[0])
+        self.assertEqual(info[u'content-length'], len(CONTENT))
+        self.assertEqual(info[u'stored-codec'], u'gzip')
+        self.assertTrue(info[u'stored-length'] < len(CONTENT))
+
+        object_path = '/bucket/test_gzip/object/%s' % info[u'content-sha1']
+        filepath = os.path.join(
+            self.storage_path, 'test_gzip', 'data',
+            info[u'content-sha1'][:2], info[u'content-sha1'][2:4], info[u'content-sha1'])
+        self.assertEqual(os.path.getsize(filepath), info[u'stored-length'])
+
+        # decompressed on the fly, the range is ignored
+        body = self.simulate_request(object_path, method='GET', headers={'Range': 'bytes=0-1'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        self.assertEqual(''.join(body), CONTENT)
+        headers = dict(self.srmock.headers)
+        self.assertEqual(headers['content-length'], str(len(CONTENT)))
+        self.assertEqual(headers['accept-ranges'], 'none')
+        self.assertEqual(headers['etag'], '"%s"' % info[u'content-md5'])
+        self.assertFalse('content-encoding' in headers)
+
+        # passed as is
+        body = self.simulate_request(object_path, method='GET', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        content = ''.join(body)
+        self.assertEqual(len(content), info[u'stored-length'])
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(content)).read(), CONTENT)
+        headers = dict(self.srmock.headers)
+        self.assertEqual(headers['content-encoding'], 'gzip')
+        self.assertEqual(headers['content-length'], str(info[u'stored-length']))
+        self.assertEqual(headers['etag'], '"%s+gzip"' % info[u'content-md5'])
+        self.assertEqual(headers['vary'], 'Accept-Encoding')
+
+
+    def test_packed_compressed_object(self):
+
+        body = self.simulate_request('/bucket/test_bz2/object/content.json', method='PUT', body=CONTENT)
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        info = json.loads(body[0])
+        self.assertEqual(info[u'stored-codec'], u'bz2')
+        self.assertEqual(os.listdir(os.path.join(self.storage_path, 'test_bz2', 'data')), [])
+
+        # bz2 is not a content-coding, the object is always decompressed
+        body = self.simulate_request(
+            '/bucket/test_bz2/object/%s' % info[u'content-sha1'], method='GET', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        self.assertEqual(''.join(body), CONTENT)
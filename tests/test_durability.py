@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import errno
+import falcon
+import threading
+
+from objectstore.api import buckets
+from objectstore.api import durability
+
+from test_objectstore import ObjectStoreTestBase
+
+
+class TestGroupCommitter(ObjectStoreTestBase):
+
+    def test_file_paths(self):
+
+        data_path = os.path.join(self.storage_path, 'data')
+        os.makedirs(os.path.join(data_path, 'ab'))
+        self.assertEqual(
+            durability.file_paths(os.path.join(data_path, 'ab', 'cd', 'abcdef'), self.storage_path),
+            ([os.path.join(data_path, 'ab', 'cd', 'abcdef')], [os.path.join(data_path, 'ab', 'cd'), os.path.join(data_path, 'ab')])
+        )
+        self.assertEqual(
+            durability.file_paths(os.path.join(data_path, 'ab', 'abcdef'), self.storage_path),
+            ([os.path.join(data_path, 'ab', 'abcdef')], [os.path.join(data_path, 'ab')])
+        )
+
+
+    def test_group_sync(self):
+
+        synced, groups = list(), list()
+        flush = durability.SyncGroup._fsync
+
+        def counted_flush(group):
+            groups.append(sorted(group.files))
+            flush(group)
+
+        paths = [os.path.join(self.storage_path, 'file-%d' % i) for i in range(8)]
+        for path in paths:
+            open(path, 'w').close()
+
+        committer = durability.GroupCommitter(window=0.05)
+        threads = [
+            threading.Thread(target=lambda path=path: synced.append(committer.submit([path], [self.storage_path])))
+            for path in paths
+        ]
+        durability.SyncGroup._fsync = counted_flush
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            durability.SyncGroup._fsync = flush
+
+        # the concurrent calls share the syncs, each path is synced once
+        self.assertEqual(len(synced), len(paths))
+        self.assertTrue(len(groups) < len(paths))
+        self.assertEqual(sorted(sum(groups, [])), sorted(paths))
+
+        # the removed file is skipped, the error of the sync is raised
+        committer.submit([os.path.join(self.storage_path, 'removed')])
+
+        def failed_fsync(path):
+            raise OSError(errno.EIO, 'Input/output error')
+
+        fsync_path = durability.fsync_path
+        durability.fsync_path = failed_fsync
+        try:
+            self.assertRaises(OSError, committer.submit, paths[:1])
+        finally:
+            durability.fsync_path = fsync_path
+
+
+    def test_lone_writer(self):
+
+        path = os.path.join(self.storage_path, 'file')
+        open(path, 'w').close()
+
+        # the only writer does not wait for the window
+        committer = durability.GroupCommitter(window=10)
+        for _ in range(3):
+            started = time.time()
+            committer.submit([path])
+            self.assertTrue(time.time() - started < 5)
+
+
+    def test_durable_bucket(self):
+
+        self.simulate_request('/bucket', method='PUT', query_string='name=durable&durability=unknown')
+        self.assertEqual(self.srmock.status, falcon.HTTP_400)
+
+        modes = (('data', ''), ('data%2Bmetadata', ''), ('data%2Bmetadata', '&pack-threshold=100'))
+        for i, (mode, packed) in enumerate(modes):
+            bucket_name = 'durable-%d' % i
+            self.simulate_request('/bucket', method='PUT', query_string='name=%s&durability=%s%s' % (bucket_name, mode, packed))
+            self.assertEqual(self.srmock.status, falcon.HTTP_200)
+            bucket = buckets.Bucket(bucket_name, storage_path=self.storage_path)
+            self.assertEqual(bucket.config.durability, mode.replace('%2B', '+'))
+
+            body = self.simulate_request('/bucket/%s/object/content' % bucket_name, method='PUT', body='0123456789')
+            self.assertEqual(self.srmock.status, falcon.HTTP_200)
+            object_id = json.loads(body[0])[u'content-sha1']
+            body = self.simulate_request('/bucket/%s/object/%s' % (bucket_name, object_id), method='GET')
+            self.assertEqual(''.join(body), '0123456789')
+
+        self.assertTrue(os.path.exists(bucket.metadata_path + '-wal'))
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import shutil
+import thread
+import tempfile
+import unittest
+
+import falcon
+import falcon.testing as testing
+
+from StringIO import StringIO
+
+from objectstore.api import executor
+from objectstore.api import sqlitedict
+from objectstore.api.objects import StreamDigest, write_chunk
+from objectstore.api.compression import get_codec
+
+os.environ.setdefault('OBJECTSTORE_STORAGE_PATH', tempfile.gettempdir())
+from objectstore import appl
+
+try:
+    import gevent
+except ImportError:
+    gevent = None
+
+
+class TestExecutor(unittest.TestCase):
+
+    def test_offload_in_place(self):
+
+        self.assertFalse(executor.is_cooperative())
+        self.assertEqual(executor.offload(sum, [1, 2, 3]), 6)
+        self.assertEqual(executor.offload(int, '10', base=16), 16)
+        self.assertRaises(ValueError, executor.offload, int, 'x')
+
+
+    def test_write_chunk(self):
+
+        output, digest = StringIO(), StreamDigest()
+        codec = get_codec('zlib')
+        compressor = codec.compressor()
+        write_chunk(output, '#####', digest, compressor)
+        output.write(compressor.flush())
+        self.assertEqual(digest.size, 5)
+        self.assertEqual(codec.decompressor().decompress(output.getvalue()), '#####')
+
+
+@unittest.skipIf(gevent is None, 'gevent is not installed')
+class TestCooperativeExecutor(unittest.TestCase):
+
+    def setUp(self):
+
+        self.path = tempfile.mkdtemp(dir='/tmp/')
+        self.is_cooperative = executor.is_cooperative
+        executor.is_cooperative = sqlitedict.is_cooperative = lambda: True
+        executor.configure(4)
+
+
+    def tearDown(self):
+
+        executor.is_cooperative = sqlitedict.is_cooperative = self.is_cooperative
+        executor.configure()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+    def test_offload_to_threads(self):
+
+        self.assertNotEqual(executor.offload(thread.get_ident), thread.get_ident())
+
+
+    def test_sqlite_statements(self):
+
+        table = sqlitedict.SqliteDict(os.path.join(self.path, 'test.sqlite'), 'test', autocommit=True, journal_mode='WAL')
+        self.assertTrue(isinstance(table.conn, sqlitedict.SqliteDirect))
+
+        # the statements of greenlets are run by the executor threads
+        idents = set()
+        connection = table.conn.connection
+
+        def traced_connection():
+            idents.add(thread.get_ident())
+            return connection()
+
+        table.conn.connection = traced_connection
+        greenlets = [gevent.spawn(table.__setitem__, 'key-%d' % i, i) for i in range(16)]
+        gevent.joinall(greenlets, raise_error=True)
+        self.assertEqual(sorted(table.values()), range(16))
+        self.assertEqual(table.get_many(['key-1', 'key-2']), {'key-1': 1, 'key-2': 2})
+        self.assertFalse(thread.get_ident() in idents)
+        table.close()
+
+
+class TestCreateApp(testing.TestBase):
+
+    def before(self):
+
+        self.storage_path = tempfile.mkdtemp(dir='/tmp/')
+        self.api = appl.create_app(self.storage_path)
+
+
+    def after(self):
+
+        shutil.rmtree(self.storage_path, ignore_errors=True)
+
+
+    def test_routes(self):
+
+        self.simulate_request('/bucket', method='PUT', query_string='name=test_app')
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        body = self.simulate_request('/service', method='GET')
+        self.assertEqual([bucket[u'name'] for bucket in json.loads(body[0])[u'buckets']], [u'test_app'])
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import falcon
+import tarfile
+import unittest
+
+from StringIO import StringIO
+
+from objectstore import cli
+from objectstore.api import export
+
+from test_objectstore import ObjectStoreTestBase
+
+
+CONTENT = '{"key": "value"}\n' * 100
+
+
+class TestTarStream(unittest.TestCase):
+
+    def test_iter_tar(self):
+
+        entries = [('o1', {'content-length': 5, 'created': 1400000000}), ('o2', {'content-length': 1024})]
+        content = {'o1': '#####', 'o2': '0' * 1024}
+        archive = ''.join(export.iter_tar(entries, lambda k, m: StringIO(content[k]), '/tmp/', block_size=100))
+        self.assertEqual(len(archive) % tarfile.RECORDSIZE, 0)
+
+        with tarfile.open(fileobj=StringIO(archive)) as tar:
+            self.assertEqual(tar.getnames(), ['data/o1', 'data/o2', export.MANIFEST_NAME])
+            self.assertEqual(tar.extractfile('data/o2').read(), content['o2'])
+            self.assertEqual(tar.getmember('data/o1').mtime, 1400000000)
+            manifest = [json.loads(line) for line in tar.extractfile(export.MANIFEST_NAME)]
+            self.assertEqual([line[u'object-id'] for line in manifest], [u'o1', u'o2'])
+
+
+    def test_short_content(self):
+
+        entries = [('o1', {'content-length': 10})]
+        stream = export.iter_tar(entries, lambda k, m: StringIO('#####'), '/tmp/')
+        self.assertRaises(IOError, list, stream)
+
+
+class TestObjectStoreExport(ObjectStoreTestBase):
+
+    def before(self):
+
+        super(TestObjectStoreExport, self).before()
+        self.simulate_request('/bucket', method='PUT', query_string='name=test_export&pack-threshold=16')
+        self.simulate_request('/bucket', method='PUT', query_string='name=test_gzip&compression=gzip')
+
+        self.object_ids = dict()
+        for bucket_name in ('test_export', 'test_gzip'):
+            for data in ('#####', CONTENT):
+                body = self.simulate_request('/bucket/%s/object/content' % bucket_name, method='PUT', body=data)
+                self.object_ids[data] = json.loads(body[0])[u'content-sha1']
+
+
+    def get_archive(self, bucket_name, query_string='export=tar'):
+
+        body = self.simulate_request('/bucket/%s' % bucket_name, method='GET', query_string=query_string)
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        return tarfile.open(fileobj=StringIO(''.join(body)))
+
+
+    def test_export(self):
+
+        for bucket_name in ('test_export', 'test_gzip'):
+            with self.get_archive(bucket_name) as tar:
+                self.assertEqual(
+                    tar.getnames(),
+                    ['data/%s' % k for k in sorted(self.object_ids.values())] + [export.MANIFEST_NAME]
+                )
+                for data, object_id in self.object_ids.items():
+                    self.assertEqual(tar.extractfile('data/%s' % object_id).read(), data)
+                manifest = [json.loads(line) for line in tar.extractfile(export.MANIFEST_NAME)]
+                self.assertEqual(
+                    sorted(line[u'metadata'][u'content-length'] for line in manifest), [5, len(CONTENT)]
+                )
+
+        headers = dict(self.srmock.headers)
+        self.assertEqual(headers['content-type'], 'application/x-tar')
+        self.assertEqual(headers['content-disposition'], 'attachment; filename="test_gzip.tar"')
+
+
+    def test_export_range(self):
+
+        first, last = sorted(self.object_ids.values())
+        with self.get_archive('test_export', 'export=tar&prefix=%s' % last[:4]) as tar:
+            self.assertEqual(tar.getnames(), ['data/%s' % last, export.MANIFEST_NAME])
+        with self.get_archive('test_export', 'export=tar&marker=%s' % first) as tar:
+            self.assertEqual(tar.getnames(), ['data/%s' % last, export.MANIFEST_NAME])
+
+
+    def test_export_incorrect_params(self):
+
+        self.simulate_request('/bucket/test_export', method='GET', query_string='export=zip')
+        self.assertEqual(self.srmock.status, falcon.HTTP_400)
+        self.simulate_request('/bucket/unknown', method='GET', query_string='export=tar')
+        self.assertEqual(self.srmock.status, falcon.HTTP_404)
+
+
+    def test_cli(self):
+
+        output = os.path.join(self.storage_path, 'test_export.tar')
+        cli.export([self.storage_path, 'test_export', '-o', output])
+        with tarfile.open(output) as tar:
+            self.assertEqual(len(tar.getnames()), 3)
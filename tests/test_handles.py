@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from objectstore.api import handles
+
+
+class TestHandleRegistry(unittest.TestCase):
+
+    def setUp(self):
+
+        self.path = tempfile.mkdtemp(dir='/tmp/')
+        self.registry = handles.HandleRegistry(capacity=2)
+
+
+    def tearDown(self):
+
+        self.registry.clear()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+    def test_incorrect_capacity(self):
+
+        self.assertRaises(RuntimeError, handles.HandleRegistry, capacity=0)
+
+
+    def test_shared_handle(self):
+
+        filename = os.path.join(self.path, 'metadata.sqlite')
+        handle = self.registry.get(filename, 'bucket')
+        self.assertTrue(handle is self.registry.get(filename, 'bucket'))
+        self.assertFalse(handle is self.registry.get(filename, 'objects'))
+        self.assertEqual(len(self.registry), 2)
+
+
+    def test_lru_eviction(self):
+
+        filename = os.path.join(self.path, 'metadata.sqlite')
+        self.registry.get(filename, 't1')
+        self.registry.get(filename, 't2')
+        self.registry.get(filename, 't1')
+        self.registry.get(filename, 't3')
+
+        self.assertEqual(len(self.registry), 2)
+        self.assertTrue((filename, 't1') in self.registry)
+        self.assertFalse((filename, 't2') in self.registry)
+        self.assertTrue((filename, 't3') in self.registry)
+
+
+    def test_close_on_last_release(self):
+
+        filename = os.path.join(self.path, 'metadata.sqlite')
+        handle = self.registry.get(filename, 't1')
+        handle['k'] = 'v'
+        conn = handle.conn
+        self.registry.get(filename, 't2')
+        self.registry.get(filename, 't3')
+
+        # the evicted handle is closed when the request releases it
+        self.assertFalse((filename, 't1') in self.registry)
+        self.assertEqual(handle['k'], 'v')
+        del handle
+        self.assertFalse(conn.is_alive())
+
+
+    def test_open_without_lock(self):
+
+        filename = os.path.join(self.path, 'metadata.sqlite')
+        opened = list()
+
+        def factory(*args, **kwargs):
+            # the registry is not locked while the handle is opened
+            thread = threading.Thread(target=lambda: opened.append(self.registry.get(filename, 't2')))
+            thread.start()
+            thread.join(5)
+            return handles.SqliteDict(*args, **kwargs)
+
+        self.registry.get(filename, 't1', factory=factory)
+        self.assertEqual(len(opened), 1)
+        self.assertEqual(len(self.registry), 2)
+
+
+    def test_invalidate(self):
+
+        os.makedirs(os.path.join(self.path, 'b1'))
+        os.makedirs(os.path.join(self.path, 'b10'))
+        h1 = self.registry.get(os.path.join(self.path, 'b1', 'metadata.sqlite'), 'bucket')
+        h10 = self.registry.get(os.path.join(self.path, 'b10', 'metadata.sqlite'), 'bucket')
+
+        self.registry.invalidate(os.path.join(self.path, 'b1'))
+        self.assertEqual(len(self.registry), 1)
+        self.assertEqual(h1.conn, None)
+        self.assertNotEqual(h10.conn, None)
+
+
+    def test_reopen_replaced_file(self):
+
+        filename = os.path.join(self.path, 'metadata.sqlite')
+        handle = self.registry.get(filename, 'bucket')
+        handle['k'] = 'v'
+        handle.commit()
+        os.remove(filename)
+
+        conn = handle.conn
+        reopened = self.registry.get(filename, 'bucket')
+        self.assertFalse(handle is reopened)
+        self.assertFalse('k' in reopened)
+        del handle
+        self.assertFalse(conn.is_alive())
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+import os
+import falcon
+import shutil
+import tempfile
+
+from objectstore import cli
+from objectstore.api import ingest
+from objectstore.api.buckets import Bucket
+from objectstore.api.common import pairtree_path
+
+from test_objectstore import ObjectStoreTestBase
+
+
+FILES = {
+    'content.txt': '#####',
+    'dir/content.json': '{"key": "value"}',
+    'dir/subdir/copy.txt': '#####',
+    'empty': '',
+}
+
+SHA1 = {
+    'content.txt': 'c51d430a95691338da6a2455353eb0ab5fe08ef6',
+    'dir/content.json': 'e735dd8e68d8938109f02c383cc9d056c942a514',
+}
+
+
+class TestBulkIngest(ObjectStoreTestBase):
+
+    def before(self):
+
+        super(TestBulkIngest, self).before()
+        self.source_path = tempfile.mkdtemp(dir='/tmp/')
+        for name, data in FILES.items():
+            path = os.path.join(self.source_path, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as _file:
+                _file.write(data)
+
+
+    def after(self):
+
+        super(TestBulkIngest, self).after()
+        shutil.rmtree(self.source_path, ignore_errors=True)
+
+
+    def create_bucket(self, query_string):
+
+        self.simulate_request('/bucket', method='PUT', query_string=query_string)
+        return Bucket(query_string.split('&')[0].split('=')[1], storage_path=self.storage_path)
+
+
+    def assert_ingested(self, bucket_name):
+
+        for name, object_id in SHA1.items():
+            body = self.simulate_request('/bucket/%s/object/%s' % (bucket_name, object_id), method='GET')
+            self.assertEqual(self.srmock.status, falcon.HTTP_200)
+            self.assertEqual(''.join(body), FILES[name])
+
+        body = self.simulate_request('/bucket/%s/object/%s' % (bucket_name, SHA1['dir/content.json']), method='HEAD')
+        headers = dict(self.srmock.headers)
+        self.assertEqual(headers['content-type'], 'application/json')
+
+
+    def test_walk(self):
+
+        self.assertEqual(
+            [os.path.relpath(path, self.source_path) for path in ingest.walk(self.source_path)],
+            ['content.txt', 'empty', 'dir/content.json', 'dir/subdir/copy.txt']
+        )
+
+
+    def test_copy(self):
+
+        bucket = self.create_bucket('name=test_ingest')
+        loader = ingest.BulkIngest(bucket, self.source_path, batch_size=2, workers=2)
+        stats = loader.run()
+        self.assertEqual(stats['files'], 2)
+        self.assertEqual(stats['bytes'], len(FILES['content.txt']) + len(FILES['dir/content.json']))
+        self.assertEqual(stats['duplicates'], 1)
+        self.assertEqual(stats['rejected'], 1)
+        self.assertFalse(os.path.exists(loader.journal.path))
+
+        self.assert_ingested('test_ingest')
+        self.assertEqual(bucket.stats()[u'object-count'], 2)
+        self.assertTrue(os.path.exists(os.path.join(self.source_path, 'content.txt')))
+
+        # the objects are not ingested twice
+        stats = ingest.BulkIngest(bucket, self.source_path).run()
+        self.assertEqual((stats['files'], stats['duplicates']), (0, 3))
+
+
+    def test_move_to_packs(self):
+
+        bucket = self.create_bucket('name=test_ingest&pack-threshold=10')
+        stats = ingest.BulkIngest(bucket, self.source_path, mode='move', workers=1).run()
+        self.assertEqual(stats['files'], 2)
+
+        self.assert_ingested('test_ingest')
+        self.assertFalse(os.path.exists(os.path.join(self.source_path, 'content.txt')))
+        self.assertFalse(os.path.exists(os.path.join(self.source_path, 'dir', 'content.json')))
+        self.assertEqual(os.listdir(os.path.join(bucket.bucket_path, 'data')), ['e7'])
+
+
+    def test_move(self):
+
+        bucket = self.create_bucket('name=test_ingest')
+        stats = ingest.BulkIngest(bucket, self.source_path, mode='move', workers=1).run()
+        self.assertEqual((stats['files'], stats['duplicates']), (2, 1))
+
+        self.assert_ingested('test_ingest')
+        self.assertFalse(os.path.exists(os.path.join(self.source_path, 'content.txt')))
+        self.assertFalse(os.path.exists(os.path.join(self.source_path, 'dir', 'content.json')))
+        self.assertEqual(os.listdir(os.path.join(bucket.bucket_path, 'tmp')), [])
+        # the duplicate is removed, the rejected empty file is left
+        self.assertFalse(os.path.exists(os.path.join(self.source_path, 'dir', 'subdir', 'copy.txt')))
+        self.assertTrue(os.path.exists(os.path.join(self.source_path, 'empty')))
+
+
+    def test_resume(self):
+
+        bucket = self.create_bucket('name=test_ingest')
+        loader = ingest.BulkIngest(bucket, self.source_path, mode='link', workers=1)
+
+        # the run is interrupted after placing the first file of the batch
+        metadata = dict(ingest.hash_file(os.path.join(self.source_path, 'content.txt'))[1])
+        metadata['content-name'] = u'content.txt'
+        loader.journal.append({'committed': 0})
+        loader.journal.append({'pending': [
+            {'path': u'content.txt', 'object-id': SHA1['content.txt'], 'metadata': metadata},
+            {'path': u'dir/content.json', 'object-id': SHA1['dir/content.json'], 'metadata': {}},
+        ]})
+        target = os.path.join(bucket.bucket_path, 'data', pairtree_path(SHA1['content.txt']))
+        os.makedirs(os.path.dirname(target))
+        os.link(os.path.join(self.source_path, 'content.txt'), target)
+
+        stats = loader.run()
+        self.assertEqual(stats['recovered'], 1)
+        self.assertEqual(stats['skipped'], 1)
+        self.assertEqual(stats['files'], 1)
+        self.assertEqual(stats['duplicates'], 1)
+
+        self.assert_ingested('test_ingest')
+        target = os.path.join(bucket.bucket_path, 'data', pairtree_path(SHA1['dir/content.json']))
+        self.assertEqual(os.stat(target).st_nlink, 2)
+
+
+    def test_journal(self):
+
+        journal = ingest.Journal(os.path.join(self.source_path, 'journal'))
+        journal.append({'pending': [{'path': u'a'}, {'path': u'b'}]})
+        journal.append({'committed': 2})
+        journal.append({'pending': [{'path': u'c'}]})
+        with open(journal.path, 'a') as _file:
+            _file.write('{"commi')
+        self.assertEqual(journal.load(), (set([u'a', u'b']), [{'path': u'c'}]))
+
+
+    def test_cli(self):
+
+        self.create_bucket('name=test_gzip&compression=gzip')
+        self.assertRaises(SystemExit, cli.ingest, [self.storage_path, 'test_gzip', self.source_path])
+        self.assertRaises(SystemExit, cli.ingest, [self.storage_path, 'unknown', self.source_path])
+
+        self.create_bucket('name=test_ingest')
+        cli.ingest([self.storage_path, 'test_ingest', self.source_path, '--workers', '1'])
+        self.assert_ingested('test_ingest')
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+import falcon
+import falcon.testing as testing
+
+from objectstore.api import metrics
+
+os.environ.setdefault('OBJECTSTORE_STORAGE_PATH', tempfile.gettempdir())
+from objectstore import appl
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def setUp(self):
+
+        self.metrics_dir = tempfile.mkdtemp(dir='/tmp/')
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.metrics_dir, ignore_errors=True)
+
+
+    def test_render(self):
+
+        registry = metrics.MetricsRegistry()
+        registry.inc('objectstore_requests_total', route='/service', method='GET', status='200')
+        registry.inc('objectstore_requests_total', route='/service', method='GET', status='200')
+        registry.observe('objectstore_request_duration_seconds', 0.002, route='/service', method='GET')
+        registry.observe('objectstore_request_duration_seconds', 20, route='/service', method='GET')
+
+        lines = registry.render().splitlines()
+        self.assertTrue('# TYPE objectstore_requests_total counter' in lines)
+        self.assertTrue('objectstore_requests_total{method="GET",route="/service",status="200"} 2' in lines)
+        self.assertTrue('objectstore_request_duration_seconds_bucket{method="GET",route="/service",le="0.001"} 0' in lines)
+        self.assertTrue('objectstore_request_duration_seconds_bucket{method="GET",route="/service",le="0.0025"} 1' in lines)
+        self.assertTrue('objectstore_request_duration_seconds_bucket{method="GET",route="/service",le="10.0"} 1' in lines)
+        self.assertTrue('objectstore_request_duration_seconds_bucket{method="GET",route="/service",le="+Inf"} 2' in lines)
+        self.assertTrue('objectstore_request_duration_seconds_count{method="GET",route="/service"} 2' in lines)
+
+
+    def test_workers_aggregation(self):
+
+        registry = metrics.MetricsRegistry(metrics_dir=self.metrics_dir)
+        registry.inc('objectstore_request_bytes_total', 10, route='/bucket')
+        with registry.timer('objectstore_stage_duration_seconds', stage='validate'):
+            pass
+
+        # the snapshot of another worker
+        other = metrics.MetricsRegistry()
+        other.inc('objectstore_request_bytes_total', 5, route='/bucket')
+        other.observe('objectstore_stage_duration_seconds', 0.5, stage='validate')
+        with open(os.path.join(self.metrics_dir, 'metrics-0.json'), 'w') as _file:
+            json.dump(other.snapshot(), _file)
+
+        lines = registry.render().splitlines()
+        self.assertTrue('objectstore_request_bytes_total{route="/bucket"} 15' in lines)
+        self.assertTrue('objectstore_stage_duration_seconds_count{stage="validate"} 2' in lines)
+        self.assertTrue(os.path.exists(os.path.join(self.metrics_dir, registry.worker_snapshot)))
+
+
+    def test_stopped_workers(self):
+
+        registry = metrics.MetricsRegistry(metrics_dir=self.metrics_dir)
+        registry.inc('objectstore_request_bytes_total', 10, route='/bucket')
+
+        # the snapshot of the stopped worker, its pid can be reused by the next one
+        process = subprocess.Popen(['true'])
+        process.wait()
+        stopped = metrics.MetricsRegistry()
+        stopped.inc('objectstore_request_bytes_total', 5, route='/bucket')
+        filename = 'metrics-%d-1.json' % process.pid
+        with open(os.path.join(self.metrics_dir, filename), 'w') as _file:
+            json.dump(stopped.snapshot(), _file)
+
+        for _ in range(2):
+            lines = registry.render().splitlines()
+            self.assertTrue('objectstore_request_bytes_total{route="/bucket"} 15' in lines)
+        self.assertEqual(
+            sorted(name for name in os.listdir(self.metrics_dir) if name.endswith('.json')),
+            sorted([metrics.BASE_SNAPSHOT, registry.worker_snapshot])
+        )
+
+
+class TestMetricsAPI(testing.TestBase):
+
+    def before(self):
+
+        self.storage_path = tempfile.mkdtemp(dir='/tmp/')
+        self.api = appl.create_app(self.storage_path)
+
+
+    def after(self):
+
+        shutil.rmtree(self.storage_path, ignore_errors=True)
+
+
+    def test_metrics(self):
+
+        self.simulate_request('/bucket', method='PUT', query_string='name=test_metrics')
+        self.simulate_request('/bucket/test_metrics/object/content', method='PUT', body='#####')
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+
+        body = self.simulate_request('/metrics', method='GET')
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        self.assertEqual(dict(self.srmock.headers)['content-type'], 'text/plain; version=0.0.4')
+        text = ''.join(body)
+        for prefix in (
+                'objectstore_requests_total{method="PUT",route="/bucket",status="200"}',
+                'objectstore_request_duration_seconds_count{method="PUT",route="/bucket/{bucket_name}/object/{object_id}"}',
+                'objectstore_request_bytes_total{route="/bucket/{bucket_name}/object/{object_id}"}',
+                'objectstore_stage_duration_seconds_count{stage="hashing"}',
+                'objectstore_stage_duration_seconds_count{stage="movefile"}',
+                'objectstore_sqlite_queue_wait_seconds_count',
+                'objectstore_sqlite_execute_seconds_count'):
+            self.assertTrue('\n' + prefix in text, prefix)
+
+
+    def test_error_status(self):
+
+        class FailingResource(object):
+
+            def on_get(self, req, resp):
+                raise RuntimeError('failed')
+
+        self.api.add_route('/failing', FailingResource())
+        self.simulate_request('/bucket', method='PUT')
+        self.assertEqual(self.srmock.status, falcon.HTTP_400)
+        self.simulate_request('/failing', method='GET')
+        self.assertEqual(self.srmock.status, falcon.HTTP_500)
+
+        # the status of raised error is recorded, not the default one
+        text = ''.join(self.simulate_request('/metrics', method='GET'))
+        self.assertTrue('\nobjectstore_requests_total{method="PUT",route="/bucket",status="400"}' in text)
+        self.assertTrue('\nobjectstore_requests_total{method="GET",route="unknown",status="500"}' in text)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import falcon
+import hashlib
+import tempfile
+import unittest
+
+from objectstore.api import multipart
+
+from test_objectstore import ObjectStoreTestBase
+
+
+class TestMultipartHelpers(unittest.TestCase):
+
+    def test_parts_reader(self):
+
+        paths = []
+        try:
+            for data in ('01', '', '234'):
+                handler, path = tempfile.mkstemp(dir='/tmp')
+                os.write(handler, data)
+                os.close(handler)
+                paths.append(path)
+
+            reader = multipart.PartsReader(paths)
+            self.assertEqual(''.join(iter(lambda: reader.read(2), b'')), '01234')
+        finally:
+            for path in paths:
+                os.remove(path)
+
+
+    def test_multipart_etag(self):
+
+        digests = [hashlib.md5('01').hexdigest(), hashlib.md5('234').hexdigest()]
+        self.assertEqual(
+            multipart.multipart_etag(digests), 
+            '%s-2' % hashlib.md5(hashlib.md5('01').digest() + hashlib.md5('234').digest()).hexdigest()
+        )
+
+
+class TestObjectStoreMultipartUpload(ObjectStoreTestBase):
+
+    def before(self):
+
+        super(TestObjectStoreMultipartUpload, self).before()
+        self.simulate_request('/bucket', method='PUT', query_string='name=test_multipart')
+
+
+    def initiate(self, content_name='multipart-object'):
+
+        body = self.simulate_request(
+            '/bucket/test_multipart/object/%s' % content_name, method='POST', query_string='uploads',
+            headers={'Content-Type': 'text/plain'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        return json.loads(body[0])[u'upload-id']
+
+
+    def upload_part(self, upload_id, part_number, data, headers=None):
+
+        body = self.simulate_request(
+            '/bucket/test_multipart/object/multipart-object', method='PUT', body=data,
+            query_string='upload-id=%s&part-number=%d' % (upload_id, part_number), headers=headers)
+        return [json.loads(e) for e in body]
+
+
+    def test_multipart_upload(self):
+
+        upload_id = self.initiate()
+
+        # the parts are uploaded out of order, the part 2 is uploaded twice
+        self.upload_part(upload_id, 2, 'xxx')
+        part = self.upload_part(upload_id, 2, '234')[0]
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        self.assertEqual(part[u'part-number'], 2)
+        self.assertEqual(part[u'content-length'], 3)
+        self.assertEqual(part[u'etag'], '"%s"' % hashlib.md5('234').hexdigest())
+        self.upload_part(upload_id, 1, '01')
+
+        body = self.simulate_request(
+            '/bucket/test_multipart/object/multipart-object', method='POST', query_string='upload-id=%s' % upload_id)
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        info = json.loads(body[0])
+        self.assertEqual(info[u'content-name'], u'multipart-object')
+        self.assertEqual(info[u'content-type'], u'text/plain')
+        self.assertEqual(info[u'content-length'], 5)
+        self.assertEqual(info[u'content-sha1'], hashlib.sha1('01234').hexdigest())
+        self.assertEqual(
+            info[u'multipart-etag'], 
+            multipart.multipart_etag([hashlib.md5('01').hexdigest(), hashlib.md5('234').hexdigest()])
+        )
+
+        body = self.simulate_request('/bucket/test_multipart/object/%s' % info[u'content-sha1'], method='GET')
+        self.assertEqual(''.join(body), '01234')
+
+        # the upload is removed after completion
+        self.assertEqual(os.listdir(os.path.join(self.storage_path, 'test_multipart', 'tmp')), [])
+        body = self.simulate_request(
+            '/bucket/test_multipart/object/multipart-object', method='POST', query_string='upload-id=%s' % upload_id)
+        self.assertEqual(self.srmock.status, falcon.HTTP_404)
+
+
+    def test_multipart_upload_selected_parts(self):
+
+        upload_id = self.initiate()
+        part1 = self.upload_part(upload_id, 1, 'ab')[0]
+        self.upload_part(upload_id, 2, 'cd')
+        part3 = self.upload_part(upload_id, 3, 'ef')[0]
+
+        body = self.simulate_request(
+            '/bucket/test_multipart/object/multipart-object', method='POST', query_string='upload-id=%s' % upload_id,
+            body=json.dumps({'parts': [part3, part1]}))
+        self.assertEqual(self.srmock.status, falcon.HTTP_400)
+
+        body = self.simulate_request(
+            '/bucket/test_multipart/object/multipart-object', method='POST', query_string='upload-id=%s' % upload_id,
+            body=json.dumps({'parts': [part1, part3]}))
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        self.assertEqual(json.loads(body[0])[u'content-sha1'], hashlib.sha1('abef').hexdigest())
+
+
+    def test_multipart_upload_bad_part(self):
+
+        upload_id = self.initiate()
+
+        self.upload_part(upload_id, 1, '01', headers={'Content-MD5': hashlib.md5('02').hexdigest()})
+        self.assertEqual(self.srmock.status, falcon.HTTP_400)
+
+        self.upload_part(upload_id, 0, '01')
+        self.assertEqual(self.srmock.status, falcon.HTTP_400)
+
+        self.upload_part('unknown', 1, '01')
+        self.assertEqual(self.srmock.status, falcon.HTTP_404)
+
+        # the part of the upload of another object
+        self.simulate_request(
+            '/bucket/test_multipart/object/other-object', method='PUT', body='01',
+            query_string='upload-id=%s&part-number=1' % upload_id
+        )
+        self.assertEqual(self.srmock.status, falcon.HTTP_400)
+
+
+    def test_multipart_upload_abort(self):
+
+        upload_id = self.initiate()
+        self.upload_part(upload_id, 1, '01')
+
+        body = self.simulate_request(
+            '/bucket/test_multipart/object/multipart-object', method='DELETE', query_string='upload-id=%s' % upload_id)
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        self.assertEqual(os.listdir(os.path.join(self.storage_path, 'test_multipart', 'tmp')), [])
+
+        body = self.simulate_request(
+            '/bucket/test_multipart/object/multipart-object', method='DELETE', query_string='upload-id=%s' % upload_id)
+        self.assertEqual(self.srmock.status, falcon.HTTP_404)
@@ -3,8 +3,11 @@
 import os
 import shutil
 import tempfile
+import falcon
 import unittest
 
+from StringIO import StringIO
+
 from objectstore.api import objects
 from objectstore.api import buckets
 
@@ -35,6 +38,64 @@ class TestBucket(unittest.TestCase):
         self.assertEqual(objects.pairtree_path('1234567890', pairs=3), '12/34/56/1234567890')
 
 
+    def test_object_stream_digest(self):
+
+        digest = objects.StreamDigest()
+        digest.update('##')
+        digest.update('#')
+        self.assertEqual(digest.size, 3)
+        self.assertEqual(
+            digest.hexdigests(),
+            {
+                'content-md5': 'dc27db9710c1c207a8bd46935163efc1',
+                'content-sha1': '5c5b8251bdb4b62eff8c746f4021483bfae24eb7',
+                'content-sha256': '56dc6d47737d155afddefda1af20c40c901353c222d01e70b7b4e021f2e4f548'
+            }
+        )
+
+
+    def test_object_parse_range(self):
+
+        self.assertEqual(objects.parse_range(None, 10), None)
+        self.assertEqual(objects.parse_range('items=0-1', 10), None)
+        self.assertEqual(objects.parse_range('bytes=a-1', 10), None)
+        self.assertEqual(objects.parse_range('bytes=-', 10), None)
+        self.assertEqual(objects.parse_range('bytes=0-1', 10), [(0, 1)])
+        self.assertEqual(objects.parse_range('bytes=5-', 10), [(5, 9)])
+        self.assertEqual(objects.parse_range('bytes=-20', 10), [(0, 9)])
+        self.assertEqual(objects.parse_range('bytes=0-0, 20-30, 9-', 10), [(0, 0), (9, 9)])
+        self.assertRaises(falcon.HTTPRangeNotSatisfiable, objects.parse_range, 'bytes=10-', 10)
+        self.assertRaises(falcon.HTTPRangeNotSatisfiable, objects.parse_range, 'bytes=-0', 10)
+
+
+    def test_object_etag_matches(self):
+
+        self.assertEqual(objects.parse_etags(None), None)
+        self.assertEqual(objects.parse_etags(' * '), ['*'])
+        self.assertEqual(objects.parse_etags('"a", W/"b"'), ['"a"', 'W/"b"'])
+
+        self.assertTrue(objects.etag_matches(['*'], '"a"'))
+        self.assertTrue(objects.etag_matches(['"b"', '"a"'], '"a"'))
+        self.assertFalse(objects.etag_matches(['W/"a"'], '"a"'))
+        self.assertTrue(objects.etag_matches(['W/"a"'], '"a"', weak=True))
+
+
+    def test_object_http_date(self):
+
+        self.assertEqual(objects.http_date(1445000000), 'Fri, 16 Oct 2015 12:53:20 GMT')
+        self.assertEqual(objects.parse_http_date('Fri, 16 Oct 2015 12:53:20 GMT'), 1445000000)
+        self.assertEqual(objects.parse_http_date('yesterday'), None)
+
+
+    def test_object_file_slice(self):
+
+        fileobj = StringIO('0123456789')
+        file_slice = objects.FileSlice(fileobj, 2, 5)
+        self.assertEqual(file_slice.read(2), '23')
+        self.assertEqual(file_slice.read(), '456')
+        self.assertEqual(file_slice.read(), '')
+
+
     def test_object_movefile(self):
 
         try:
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import falcon
+import shutil
+import tempfile
+import unittest
+
+from objectstore.api import packs
+from objectstore.api import buckets
+from objectstore.api import objects
+
+from test_objectstore import ObjectStoreTestBase
+
+
+class TestPackStore(unittest.TestCase):
+
+    def setUp(self):
+
+        self.bucket_path = tempfile.mkdtemp(dir='/tmp/')
+        self.store = packs.PackStore(self.bucket_path, segment_size=8)
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.bucket_path, ignore_errors=True)
+
+
+    def store_data(self, object_id, data):
+
+        handler, source = tempfile.mkstemp(dir=self.bucket_path)
+        os.write(handler, data)
+        os.close(handler)
+        location = self.store.store(object_id, source)
+        os.remove(source)
+        return location
+
+
+    def test_rolling_segments(self):
+
+        self.assertEqual(self.store_data('o1', '0123'), ('pack-000001', 0, 4))
+        self.assertEqual(self.store_data('o2', '4567'), ('pack-000001', 4, 4))
+        self.assertEqual(self.store_data('o3', '89'), ('pack-000002', 0, 2))
+
+        # the object larger than segment is stored in its own segment
+        self.assertEqual(self.store_data('o4', '0123456789'), ('pack-000003', 0, 10))
+        self.assertEqual(self.store.segments(), ['pack-000001', 'pack-000002', 'pack-000003'])
+
+        self.assertEqual(self.store.read(self.store.location('o2')), '4567')
+        self.assertEqual(self.store.location('unknown'), None)
+
+
+    def test_pread(self):
+
+        self.store_data('o1', '0123456789')
+        fd = os.open(self.store.segment_path('pack-000001'), os.O_RDONLY)
+        try:
+            self.assertEqual(packs.pread(fd, 3, 2), '234')
+        finally:
+            os.close(fd)
+
+
+    def test_compact(self):
+
+        self.store_data('o1', '0123')
+        self.store_data('o2', '4567')
+        self.store_data('o3', '89')
+        self.store.remove('o1')
+
+        # recently modified segments are skipped
+        self.assertEqual(self.store.compact(), {'segments': 0, 'bytes': 0})
+
+        self.assertEqual(self.store.compact(grace_period=0), {'segments': 1, 'bytes': 4})
+        self.assertEqual(self.store.segments(), ['pack-000002'])
+        self.assertEqual(self.store.location('o2'), ('pack-000002', 2, 4))
+        self.assertEqual(self.store.read(self.store.location('o2')), '4567')
+        self.assertEqual(self.store.read(self.store.location('o3')), '89')
+
+
+    def test_compact_concurrent_delete(self):
+
+        self.store_data('o1', '0123')
+        self.store_data('o2', '4567')
+        self.store_data('o3', '89')
+        self.store.remove('o1')
+        self.store.index.commit()
+
+        # the object is deleted after the snapshot of the index, it's not restored
+        read = self.store.read
+
+        def read_and_delete(location):
+            if 'o2' in self.store.index:
+                self.store.remove('o2')
+                self.store.index.commit()
+            return read(location)
+
+        self.store.read = read_and_delete
+        self.assertEqual(self.store.compact(grace_period=0), {'segments': 1, 'bytes': 4})
+        self.assertEqual(self.store.location('o2'), None)
+        self.assertEqual(self.store.location('o3'), ('pack-000002', 0, 2))
+
+
+class TestObjectStorePackedObjects(ObjectStoreTestBase):
+
+    def before(self):
+
+        super(TestObjectStorePackedObjects, self).before()
+        self.simulate_request('/bucket', method='PUT', query_string='name=test_packs&pack-threshold=8')
+
+
+    def test_packed_object(self):
+
+        body = self.simulate_request(
+            '/bucket/test_packs/object/small', method='PUT', body='0123', headers={'Content-Type': 'text/plain'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        object_id = json.loads(body[0])[u'content-sha1']
+
+        body = self.simulate_request(
+            '/bucket/test_packs/object/large', method='PUT', body='0123456789', headers={'Content-Type': 'text/plain'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+
+        bucket_path = os.path.join(self.storage_path, 'test_packs')
+        self.assertEqual(os.listdir(os.path.join(bucket_path, 'packs')), ['lock', 'pack-000001'])
+        self.assertEqual(len(os.listdir(os.path.join(bucket_path, 'data'))), 1)
+
+        body = self.simulate_request('/bucket/test_packs/object/%s' % object_id, method='GET')
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        self.assertEqual(''.join(body), '0123')
+        self.assertEqual(dict(self.srmock.headers)['content-length'], '4')
+
+        body = self.simulate_request(
+            '/bucket/test_packs/object/%s' % object_id, method='GET', headers={'Range': 'bytes=1-2'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_206)
+        self.assertEqual(''.join(body), '12')
+
+        body = self.simulate_request(
+            '/bucket/test_packs/object/%s' % object_id, method='GET', headers={'Range': 'bytes=0-0,3-'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_206)
+        content = ''.join(body)
+        self.assertTrue('\r\n\r\n0\r\n--' in content)
+        self.assertTrue('\r\n\r\n3\r\n--' in content)
+
+        body = self.simulate_request('/bucket/test_packs/object/%s' % object_id, method='DELETE')
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+
+        body = self.simulate_request('/bucket/test_packs/object/%s' % object_id, method='GET')
+        self.assertEqual(self.srmock.status, falcon.HTTP_404)
+
+
+    def test_read_compacted_object(self):
+
+        self.simulate_request('/bucket', method='PUT', query_string='name=test_compact&pack-threshold=8&pack-segment-size=8')
+        object_ids = list()
+        for data in ('0123', '4567', '89'):
+            body = self.simulate_request('/bucket/test_compact/object/small', method='PUT', body=data)
+            self.assertEqual(self.srmock.status, falcon.HTTP_200)
+            object_ids.append(json.loads(body[0])[u'content-sha1'])
+        self.simulate_request('/bucket/test_compact/object/%s' % object_ids[0], method='DELETE')
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+
+        # the location is looked up before the segment is removed by compaction
+        bucket = buckets.Bucket('test_compact', storage_path=self.storage_path)
+        read_object = objects.BucketObject(object_id=object_ids[1], bucket=bucket)
+        open_object = objects.BucketObject(object_id=object_ids[1], bucket=bucket)
+        self.assertEqual(read_object.pack_location, ('pack-000001', 4, 4))
+        self.assertEqual(open_object.pack_location, ('pack-000001', 4, 4))
+
+        store = packs.PackStore(bucket.bucket_path, segment_size=8)
+        self.assertEqual(store.compact(grace_period=0), {'segments': 1, 'bytes': 4})
+        self.assertEqual(read_object.read(), '4567')
+        _file = open_object.open(1, 2)
+        self.assertEqual(_file.read(), '56')
+        _file.close()
+
+
+    def test_delete_bucket_with_packed_objects(self):
+
+        body = self.simulate_request('/bucket/test_packs/object/small', method='PUT', body='0123')
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+
+        body = self.simulate_request('/bucket/test_packs', method='DELETE')
+        self.assertEqual(self.srmock.status, falcon.HTTP_409)
@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 
+import os
 import json
+import shutil
 import falcon
 
+from objectstore.api import buckets
+from objectstore.api import objects
+
 from test_objectstore import ObjectStoreTestBase
 
 
@@ -87,7 +92,7 @@ class TestObjectStoreBucket(ObjectStoreTestBase):
     def test_bucket_options(self):
 
         body = self.simulate_request('/bucket/test1', method='OPTIONS')
-        self.assertEqual(self.srmock.headers, [('allow', 'DELETE, GET, HEAD')])
+        self.assertEqual(self.srmock.headers, [('allow', 'DELETE, GET, HEAD, POST')])
         self.assertEqual(self.srmock.status, falcon.HTTP_204)
 
 
@@ -104,6 +109,16 @@ class TestObjectStoreBucket(ObjectStoreTestBase):
 
         body = self.simulate_request('/bucket/exists', method='HEAD')
         self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        headers = dict(self.srmock.headers)
+        self.assertEqual((headers['object-count'], headers['bytes-used']), ('0', '0'))
+
+        objects = buckets.Bucket('exists', storage_path=self.storage_path).objects_metadata()
+        objects.update({'o1': {'content-length': 3}, 'o2': {'content-length': 4}})
+        objects.commit()
+
+        body = self.simulate_request('/bucket/exists', method='HEAD')
+        headers = dict(self.srmock.headers)
+        self.assertEqual((headers['object-count'], headers['bytes-used']), ('2', '7'))
 
 
     def test_delete_bucket(self):
@@ -121,6 +136,17 @@ class TestObjectStoreBucket(ObjectStoreTestBase):
         self.assertEqual(self.srmock.status, falcon.HTTP_404)
 
 
+    def test_recreated_bucket_config(self):
+
+        for codec in ('gzip', 'zlib'):
+            # the bucket is removed outside of the service, the generation counter of the new
+            # bucket is the same
+            shutil.rmtree(os.path.join(self.storage_path, 'recreated'), ignore_errors=True)
+            body = self.simulate_request('/bucket', method='PUT', query_string='name=recreated&compression=%s' % codec)
+            self.assertEqual(self.srmock.status, falcon.HTTP_200)
+            self.assertEqual(buckets.Bucket('recreated', storage_path=self.storage_path).config.compression, codec)
+
+
     def test_delete_non_exists_bucket(self):
 
         body = self.simulate_request('/bucket/non-exists', method='DELETE')
@@ -136,10 +162,199 @@ class TestObjectStoreBucket(ObjectStoreTestBase):
         self.assertEqual(self.srmock.status, falcon.HTTP_200)
         self.assertEqual(
             [json.loads(e) for e in body], 
-            [{u'objects': [], u'metadata': {u'name': u'with-objects'}}]
+            [{
+                u'objects': [], 
+                u'common-prefixes': [], 
+                u'is-truncated': False, 
+                u'metadata': {u'name': u'with-objects'}
+            }]
         )
 
 
+    def test_objects_list_pages(self):
+
+        body = self.simulate_request('/bucket', method='PUT', query_string='name=with-pages')
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+
+        objects = buckets.Bucket('with-pages', storage_path=self.storage_path).objects_metadata()
+        objects.update(dict(('%02d' % i, {}) for i in range(5)))
+        objects.commit()
+
+        keys, query_string = [], 'prefix=0&max-keys=2'
+        while True:
+            body = self.simulate_request('/bucket/with-pages', method='GET', query_string=query_string)
+            self.assertEqual(self.srmock.status, falcon.HTTP_200)
+            listing = json.loads(body[0])
+            keys.extend(listing[u'objects'])
+            if not listing[u'is-truncated']:
+                break
+            query_string = 'prefix=0&max-keys=2&continuation-token=%s' % listing[u'next-continuation-token']
+
+        self.assertEqual(keys, [u'00', u'01', u'02', u'03', u'04'])
+
+        body = self.simulate_request('/bucket/with-pages', method='GET', query_string='marker=02')
+        self.assertEqual(json.loads(body[0])[u'objects'], [u'03', u'04'])
+
+        body = self.simulate_request('/bucket/with-pages', method='GET', query_string='max-keys=0')
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        listing = json.loads(body[0])
+        self.assertEqual((listing[u'objects'], listing[u'is-truncated']), ([], True))
+        self.assertFalse(u'next-continuation-token' in listing)
+
+
+    def test_objects_search(self):
+
+        body = self.simulate_request('/bucket', method='PUT', query_string='name=with-search')
+        objects = buckets.Bucket('with-search', storage_path=self.storage_path).objects_metadata()
+        objects.update(dict(
+            ('%02d' % i, {'content-length': i, 'content-type': 'image/png' if i % 2 else 'text/plain'}) 
+            for i in range(5)
+        ))
+        objects.commit()
+
+        keys, query_string = [], 'query=content-type%3Dimage/png,content-length>0&order=-content-length&max-keys=1'
+        while True:
+            body = self.simulate_request('/bucket/with-search', method='GET', query_string=query_string)
+            self.assertEqual(self.srmock.status, falcon.HTTP_200)
+            result = json.loads(body[0])
+            keys.extend(entry[u'object-id'] for entry in result[u'objects'])
+            if not result[u'is-truncated']:
+                break
+            query_string = 'query=content-type%%3Dimage/png&order=-content-length&max-keys=1&continuation-token=%s' % \
+                result[u'next-continuation-token']
+        self.assertEqual(keys, [u'03', u'01'])
+        self.assertEqual(result[u'objects'][0][u'metadata'], {u'content-length': 1, u'content-type': u'image/png'})
+
+        body = self.simulate_request('/bucket/with-search', method='GET', query_string='query=size>1')
+        self.assertEqual(self.srmock.status, falcon.HTTP_400)
+
+        body = self.simulate_request('/bucket/with-search', method='GET', query_string='order=created&continuation-token=MQ==')
+        self.assertEqual(self.srmock.status, falcon.HTTP_400)
+
+
+    def test_delete_objects(self):
+
+        body = self.simulate_request('/bucket', method='PUT', query_string='name=multi-delete&pack-threshold=5')
+        object_ids = list()
+        for content in ('###', '0123456789', '9876543210'):
+            body = self.simulate_request('/bucket/multi-delete/object/content', method='PUT', body=content)
+            object_ids.append(json.loads(body[0])[u'content-sha1'])
+
+        body = self.simulate_request(
+            '/bucket/multi-delete', method='POST', query_string='delete', 
+            body=json.dumps({'objects': object_ids[:2] + ['unknown', object_ids[0]]}))
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        self.assertEqual(json.loads(body[0]), {
+            u'deleted': object_ids[:2],
+            u'errors': [{u'object-id': u'unknown', u'code': u'NoSuchKey', u'message': u'The object does not exist'}]
+        })
+
+        body = self.simulate_request('/bucket/multi-delete', method='GET')
+        self.assertEqual(json.loads(body[0])[u'objects'], object_ids[2:])
+        bucket_path = os.path.join(self.storage_path, 'multi-delete')
+        self.assertEqual(buckets.Bucket('multi-delete', storage_path=self.storage_path).stats()[u'object-count'], 1)
+        self.assertFalse(os.path.exists(os.path.join(bucket_path, 'data', buckets.pairtree_path(object_ids[1]))))
+        self.assertEqual(buckets.PackStore(bucket_path).index.keys(), [])
+        # the pool of removing threads is shared by requests
+        self.assertTrue(buckets.delete_pool() is buckets.delete_pool())
+
+        for query_string, body in (('delete', '{"objects": "unknown"}'), ('delete', 'unknown'), ('', '{"objects": []}')):
+            self.simulate_request('/bucket/multi-delete', method='POST', query_string=query_string, body=body)
+            self.assertEqual(self.srmock.status, falcon.HTTP_400)
+
+
+    def test_reshard_bucket(self):
+
+        body = self.simulate_request('/bucket', method='PUT', query_string='name=reshard&pairtree-depth=1')
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        object_ids = list()
+        for content in ('0123456789', '9876543210'):
+            body = self.simulate_request('/bucket/reshard/object/content', method='PUT', body=content)
+            object_ids.append(json.loads(body[0])[u'content-sha1'])
+        data_path = os.path.join(self.storage_path, 'reshard', 'data')
+        self.assertTrue(os.path.exists(os.path.join(data_path, buckets.pairtree_path(object_ids[0], pairs=1))))
+
+        # the interrupted resharding: the new objects are stored in the new layout, the objects
+        # which are not moved yet are served from the previous one
+        bucket = buckets.Bucket('reshard', storage_path=self.storage_path)
+        bucket.metadata = {'pairtree-depth': 3, 'pairtree-previous-depth': 1}
+        body = self.simulate_request('/bucket/reshard/object/content', method='PUT', body='###')
+        object_ids.append(json.loads(body[0])[u'content-sha1'])
+        self.assertTrue(os.path.exists(os.path.join(data_path, buckets.pairtree_path(object_ids[2], pairs=3))))
+        body = self.simulate_request('/bucket/reshard/object/%s' % object_ids[0], method='GET')
+        self.assertEqual(''.join(body), '0123456789')
+
+        self.assertRaises(RuntimeError, bucket.reshard, 2)
+        self.assertEqual(bucket.reshard(3), {'moved': 2, 'skipped': 0, 'directories': 0})
+        self.assertEqual(bucket.config.previous_pairtree_depth, None)
+        for object_id, content in zip(object_ids, ('0123456789', '9876543210', '###')):
+            self.assertTrue(os.path.exists(os.path.join(data_path, buckets.pairtree_path(object_id, pairs=3))))
+            body = self.simulate_request('/bucket/reshard/object/%s' % object_id, method='GET')
+            self.assertEqual(''.join(body), content)
+
+        # the leaf directories of deeper layout are removed
+        self.assertEqual(bucket.reshard(0), {'moved': 3, 'skipped': 0, 'directories': 9})
+        self.assertEqual(sorted(os.listdir(data_path)), sorted(object_ids))
+        self.assertEqual(bucket.reshard(0), {'moved': 0, 'skipped': 0, 'directories': 0})
+        self.simulate_request('/bucket/reshard/object/%s' % object_ids[1], method='DELETE')
+        self.assertEqual(sorted(os.listdir(data_path)), sorted(object_ids[:1] + object_ids[2:]))
+
+        body = self.simulate_request('/bucket', method='PUT', query_string='name=reshard-invalid&pairtree-depth=5')
+        self.assertEqual(self.srmock.status, falcon.HTTP_400)
+
+
+    def test_read_resharded_object(self):
+
+        self.simulate_request('/bucket', method='PUT', query_string='name=reshard-read&pairtree-depth=1')
+        body = self.simulate_request('/bucket/reshard-read/object/content', method='PUT', body='0123456789')
+        object_id = json.loads(body[0])[u'content-sha1']
+
+        # the file is moved by the resharding after the path is resolved by the request
+        bucket = buckets.Bucket('reshard-read', storage_path=self.storage_path)
+        obj, sliced = objects.BucketObject(object_id, bucket=bucket), objects.BucketObject(object_id, bucket=bucket)
+        self.assertEqual(bucket.reshard(3), {'moved': 1, 'skipped': 0, 'directories': 0})
+        self.assertEqual(obj.read(), '0123456789')
+        file_slice = sliced.open(2, 3)
+        self.assertEqual(file_slice.read(), '234')
+        file_slice.close()
+
+
+    def test_lookup_objects(self):
+
+        body = self.simulate_request('/bucket', method='PUT', query_string='name=lookup')
+        objects = buckets.Bucket('lookup', storage_path=self.storage_path).objects_metadata()
+        objects.update(dict(('%02d' % i, {'content-length': i}) for i in range(5)))
+        objects.commit()
+
+        body = self.simulate_request(
+            '/bucket/lookup', method='POST', query_string='lookup', 
+            body=json.dumps({'objects': ['04', 'unknown', '00']}))
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        self.assertEqual(dict(self.srmock.headers)['content-type'], 'application/x-ndjson')
+        self.assertEqual([json.loads(line) for line in ''.join(body).splitlines()], [
+            {u'object-id': u'04', u'metadata': {u'content-length': 4}},
+            {u'object-id': u'unknown', u'missing': True},
+            {u'object-id': u'00', u'metadata': {u'content-length': 0}},
+        ])
+
+        # one chunk per batch
+        chunks = list(buckets.iter_lookup(objects, ['00', '01', '02'], batch_size=2))
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(json.loads(chunks[1]), {u'object-id': u'02', u'metadata': {u'content-length': 2}})
+
+
+    def test_objects_list_incorrect_params(self):
+
+        body = self.simulate_request('/bucket', method='PUT', query_string='name=incorrect-params')
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+
+        body = self.simulate_request('/bucket/incorrect-params', method='GET', query_string='max-keys=-1')
+        self.assertEqual(self.srmock.status, falcon.HTTP_400)
+
+        body = self.simulate_request('/bucket/incorrect-params', method='GET', query_string='continuation-token=1')
+        self.assertEqual(self.srmock.status, falcon.HTTP_400)
+
+
     def test_objects_list_non_exists_bucket(self):
 
         body = self.simulate_request('/bucket/not-exists', method='GET')
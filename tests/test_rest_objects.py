@@ -1,21 +1,46 @@
 # -*- coding: utf-8 -*-
 
+import os
 import json
 import falcon
 import gunicorn
 
+from StringIO import StringIO
+
+from objectstore.api import objects
+from objectstore.api import buckets
+
 from test_objectstore import ObjectStoreTestBase
 
 
+# the creation time of objects stored by tests
+CREATED = 1445000000
+CREATED_HTTP_DATE = 'Fri, 16 Oct 2015 12:53:20 GMT'
+
+
+class FrozenTime(object):
+
+    def time(self):
+
+        return float(CREATED)
+
+
 class TestObjectStoreObject(ObjectStoreTestBase):
 
     def before(self):
 
         super(TestObjectStoreObject, self).before()
+        self._time, objects.time = objects.time, FrozenTime()
         self.simulate_request('/bucket', method='PUT', query_string='name=test_objects')
         self.simulate_request('/bucket', method='PUT', query_string='name=test_objects_md5key&object-key=content-md5')
 
 
+    def after(self):
+
+        objects.time = self._time
+        super(TestObjectStoreObject, self).after()
+
+
     def test_objects_options(self):
 
         body = self.simulate_request('/bucket/object-options/object/object-01', method='OPTIONS')
@@ -45,11 +70,66 @@ class TestObjectStoreObject(ObjectStoreTestBase):
                 u'content-length': 3,
                 u'content-md5': u'dc27db9710c1c207a8bd46935163efc1',
                 u'content-sha1': u'5c5b8251bdb4b62eff8c746f4021483bfae24eb7',
-                u'content-sha256': u'56dc6d47737d155afddefda1af20c40c901353c222d01e70b7b4e021f2e4f548'
+                u'content-sha256': u'56dc6d47737d155afddefda1af20c40c901353c222d01e70b7b4e021f2e4f548',
+                u'created': CREATED
+            }]
+        )
+
+
+    def test_put_object_small_buffer(self):
+
+        self.api.add_route(
+            '/bucket/{bucket_name}/small-buffer/{object_id}',
+            objects.ObjectAPI(storage_path=self.storage_path, buffer_size=2)
+        )
+        body = self.simulate_request('/bucket/test_objects/small-buffer/small-buffer-object', method='PUT', body='#####')
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        self.assertEqual(
+            [json.loads(e)[u'content-sha1'] for e in body], 
+            [u'c51d430a95691338da6a2455353eb0ab5fe08ef6']
+        )
+
+
+    def test_put_object_bad_digest(self):
+
+        body = self.simulate_request(
+            '/bucket/test_objects/object/bad-digest', 
+            method='PUT', body='###', headers={'Content-MD5': '00000000000000000000000000000000'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_400)
+        self.assertEqual(
+            [json.loads(e) for e in body], 
+            [{
+                u'description': u'The Content-MD5 did not match',
+                u'title': u'BadDigest'
             }]
         )
 
 
+    def test_put_object_too_large(self):
+
+        self.simulate_request('/bucket', method='PUT', query_string='name=test_objects_limit&max-object-size=4')
+        temp_path = os.path.join(self.storage_path, 'test_objects_limit', 'tmp')
+
+        # the declared length is rejected before reading
+        body = self.simulate_request('/bucket/test_objects_limit/object/too-large', method='PUT', body='#####')
+        self.assertEqual(self.srmock.status, falcon.HTTP_413)
+        self.assertEqual(json.loads(body[0])[u'title'], u'EntityTooLarge')
+
+        # the content is read up to the limit, the temp file is removed
+        bucket_object = objects.BucketObject(
+            bucket=buckets.Bucket('test_objects_limit', storage_path=self.storage_path), buffer_size=2)
+        stream = StringIO('#' * 100)
+        self.assertRaises(falcon.HTTPRequestEntityTooLarge, bucket_object.ingest, stream)
+        self.assertEqual(stream.tell(), 5)
+        self.assertEqual(os.listdir(temp_path), [])
+
+        bucket_object.metadata = {'content-length': 3}
+        stream = StringIO('#' * 100)
+        self.assertRaises(falcon.HTTPBadRequest, bucket_object.ingest, stream)
+        self.assertEqual(stream.tell(), 4)
+        self.assertEqual(os.listdir(temp_path), [])
+
+
     def test_put_object_with_object_key(self):
 
         body = self.simulate_request('/bucket/test_objects_md5key/object/put-object-with-object-key', method='PUT', body='1###')
@@ -60,7 +140,8 @@ class TestObjectStoreObject(ObjectStoreTestBase):
                 u'content-length': 4,
                 u'content-md5': u'6c67e4f2aea14240a5a8c6303750d44d',
                 u'content-sha1': u'9a2a678895eba59c691c2263ad69ab446652e5bc',
-                u'content-sha256': u'70b3b94dff96d2b818ba8c3e522c8db463cca17fc238a604aa58f8682b314ae5'
+                u'content-sha256': u'70b3b94dff96d2b818ba8c3e522c8db463cca17fc238a604aa58f8682b314ae5',
+                u'created': CREATED
             }]
         )
 
@@ -90,10 +171,13 @@ class TestObjectStoreObject(ObjectStoreTestBase):
             {
                 u'content-name': u'exist-object',
                 u'content-type': u'application/json; charset=utf-8',
-                u'content-length': 4,
+                u'content-length': '4',
                 u'content-md5': u'd9636b3388bd7b68bc02dc92c68ea328',
                 u'content-sha1': u'e6fed90453a5dfe8ea1fb4088ef46b54cf7d7b77',
-                u'content-sha256': u'c4a3b90d0d3210c35be2d9e93e9ed6810a037bdaba1aeccaa8498a8d5eddf1dc'
+                u'content-sha256': u'c4a3b90d0d3210c35be2d9e93e9ed6810a037bdaba1aeccaa8498a8d5eddf1dc',
+                u'created': str(CREATED),
+                u'etag': u'"d9636b3388bd7b68bc02dc92c68ea328"',
+                u'last-modified': CREATED_HTTP_DATE
             }
         )
 
@@ -116,7 +200,11 @@ class TestObjectStoreObject(ObjectStoreTestBase):
                 u'content-length': u'5',
                 u'content-md5': u'59fb38dbd2e7c8461be5422a4e12cacb',
                 u'content-sha1': u'c51d430a95691338da6a2455353eb0ab5fe08ef6',
-                u'content-sha256': u'9d56858ab62ca2d6de624b262a3d7b522403026982a01b6b4f82e46f0146ee51'
+                u'content-sha256': u'9d56858ab62ca2d6de624b262a3d7b522403026982a01b6b4f82e46f0146ee51',
+                u'created': str(CREATED),
+                u'etag': u'"59fb38dbd2e7c8461be5422a4e12cacb"',
+                u'last-modified': CREATED_HTTP_DATE,
+                u'accept-ranges': u'bytes'
             }
         )
 
@@ -124,6 +212,108 @@ class TestObjectStoreObject(ObjectStoreTestBase):
         self.assertEqual(self.srmock.status, falcon.HTTP_404)        
 
 
+    def test_get_object_range(self):
+
+        body = self.simulate_request(
+            '/bucket/test_objects/object/range-object', 
+            method='PUT', body='0123456789', headers={'Content-Type': 'text/plain'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        object_path = '/bucket/test_objects/object/%s' % json.loads(body[0])[u'content-sha1']
+
+        body = self.simulate_request(object_path, method='GET', headers={'Range': 'bytes=2-4'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_206)
+        self.assertEqual(''.join(body), '234')
+        headers = dict(self.srmock.headers)
+        self.assertEqual(headers['content-range'], 'bytes 2-4/10')
+        self.assertEqual(headers['content-length'], '3')
+
+        body = self.simulate_request(object_path, method='GET', headers={'Range': 'bytes=-3'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_206)
+        self.assertEqual(''.join(body), '789')
+
+        body = self.simulate_request(object_path, method='GET', headers={'Range': 'bytes=8-100'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_206)
+        self.assertEqual(''.join(body), '89')
+        self.assertEqual(dict(self.srmock.headers)['content-range'], 'bytes 8-9/10')
+
+        body = self.simulate_request(object_path, method='GET', headers={'Range': 'bytes=10-'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_416)
+        self.assertEqual(dict(self.srmock.headers)['content-range'], 'bytes */10')
+
+        body = self.simulate_request(object_path, method='GET', headers={'Range': 'bytes=5-2'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        self.assertEqual(''.join(body), '0123456789')
+
+
+    def test_get_object_multiple_ranges(self):
+
+        body = self.simulate_request(
+            '/bucket/test_objects/object/ranges-object', 
+            method='PUT', body='0123456789', headers={'Content-Type': 'text/plain'})
+        object_path = '/bucket/test_objects/object/%s' % json.loads(body[0])[u'content-sha1']
+
+        body = self.simulate_request(object_path, method='GET', headers={'Range': 'bytes=0-1,-2'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_206)
+        headers = dict(self.srmock.headers)
+        boundary = headers['content-type'].split('boundary=')[1]
+        self.assertTrue(headers['content-type'].startswith('multipart/byteranges'))
+
+        content = ''.join(body)
+        self.assertEqual(int(headers['content-length']), len(content))
+        self.assertEqual(
+            content, 
+            '\r\n--%s\r\nContent-Type: text/plain\r\nContent-Range: bytes 0-1/10\r\n\r\n01'
+            '\r\n--%s\r\nContent-Type: text/plain\r\nContent-Range: bytes 8-9/10\r\n\r\n89'
+            '\r\n--%s--\r\n' % (boundary, boundary, boundary)
+        )
+
+
+    def test_get_object_conditional(self):
+
+        body = self.simulate_request(
+            '/bucket/test_objects/object/conditional-object', 
+            method='PUT', body='0123456789', headers={'Content-Type': 'text/plain'})
+        object_path = '/bucket/test_objects/object/%s' % json.loads(body[0])[u'content-sha1']
+        etag = '"%s"' % json.loads(body[0])[u'content-md5']
+
+        for method in ('GET', 'HEAD'):
+            body = self.simulate_request(object_path, method=method, headers={'If-None-Match': etag})
+            self.assertEqual(self.srmock.status, falcon.HTTP_304)
+            self.assertEqual(list(body), [])
+            self.assertEqual(dict(self.srmock.headers)['etag'], etag)
+
+        body = self.simulate_request(object_path, method='GET', headers={'If-None-Match': 'W/%s, "other"' % etag})
+        self.assertEqual(self.srmock.status, falcon.HTTP_304)
+
+        body = self.simulate_request(object_path, method='GET', headers={'If-None-Match': '"other"'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        self.assertEqual(''.join(body), '0123456789')
+
+        body = self.simulate_request(object_path, method='GET', headers={'If-Match': '"other"'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_412)
+
+        body = self.simulate_request(object_path, method='GET', headers={'If-Match': '*'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+
+        body = self.simulate_request(object_path, method='GET', headers={'If-Modified-Since': CREATED_HTTP_DATE})
+        self.assertEqual(self.srmock.status, falcon.HTTP_304)
+
+        body = self.simulate_request(
+            object_path, method='GET', headers={'If-Modified-Since': 'Thu, 15 Oct 2015 12:53:20 GMT'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+
+        body = self.simulate_request(
+            object_path, method='GET', headers={'If-Unmodified-Since': 'Thu, 15 Oct 2015 12:53:20 GMT'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_412)
+
+        body = self.simulate_request(object_path, method='GET', headers={'Range': 'bytes=0-1', 'If-Range': etag})
+        self.assertEqual(self.srmock.status, falcon.HTTP_206)
+
+        body = self.simulate_request(object_path, method='GET', headers={'Range': 'bytes=0-1', 'If-Range': '"other"'})
+        self.assertEqual(self.srmock.status, falcon.HTTP_200)
+        self.assertEqual(''.join(body), '0123456789')
+
+
     def test_delete_object(self):
 
         body = self.simulate_request(
@@ -138,7 +328,8 @@ class TestObjectStoreObject(ObjectStoreTestBase):
                 u'content-length': 13,
                 u'content-md5': u'7725bbca5cf2c8ce5e6ca03583978fe9',
                 u'content-sha1': u'2f4461266997b1d288837f471890e3b2542c605f',
-                u'content-sha256': u'8e67bd234e15ed0cd906aa3384ca3503b784aeccd53e0223d700f1aa6a07803e'
+                u'content-sha256': u'8e67bd234e15ed0cd906aa3384ca3503b784aeccd53e0223d700f1aa6a07803e',
+                u'created': CREATED
             }]
         )
 
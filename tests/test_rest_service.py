@@ -36,6 +36,7 @@ class TestObjectStoreService(ObjectStoreTestBase):
             [b[u"name"] for b in buckets_list].sort(), 
             [u"bucket-list-01",u"bucket-list-02"].sort()
         )
+        self.assertEqual([(b[u"object-count"], b[u"bytes-used"]) for b in buckets_list], [(0, 0), (0, 0)])
 
 
     def test_service_storage_path_is_not_defined(self):
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+from objectstore.api.sqlitedict import SqliteDict, encode
+
+
+class TestSqliteDictDirectBackend(unittest.TestCase):
+
+    def setUp(self):
+
+        self.path = tempfile.mkdtemp(dir='/tmp/')
+        self.filename = os.path.join(self.path, 'direct.sqlite')
+
+
+    def tearDown(self):
+
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+    def wait_connections(self, d, count):
+        ''' returns the number of open connections, waits up to 1 second until the thread-local
+        data of finished threads is released
+        '''
+        for _ in range(100):
+            if len(d.conn._connections) <= count:
+                break
+            time.sleep(0.01)
+        return len(d.conn._connections)
+
+
+    def test_unknown_backend(self):
+
+        self.assertRaises(ValueError, SqliteDict, self.filename, 'objects', backend='unknown')
+
+
+    def test_in_memory_database(self):
+
+        self.assertRaises(ValueError, SqliteDict, ':memory:', 'objects', backend='direct')
+
+
+    def test_wal_journal_mode(self):
+
+        with SqliteDict(self.filename, 'objects', autocommit=True, backend='direct') as d:
+            self.assertEqual(d.conn.select_one('PRAGMA journal_mode')[0].lower(), 'wal')
+
+
+    def test_dict_operations(self):
+
+        with SqliteDict(self.filename, 'objects', autocommit=True, backend='direct') as d:
+            d['k1'] = {'content-length': 1}
+            d.update({'k2': 2, 'k3': 3})
+            del d['k3']
+
+            self.assertTrue('k1' in d)
+            self.assertFalse('k3' in d)
+            self.assertEqual(d['k1'], {'content-length': 1})
+            self.assertEqual(len(d), 2)
+            self.assertEqual(d.keys(), ['k1', 'k2'])
+            self.assertRaises(KeyError, d.__getitem__, 'k3')
+
+        # the data is visible to the default backend
+        with SqliteDict(self.filename, 'objects') as d:
+            self.assertEqual(d['k2'], 2)
+
+
+    def test_batched_select(self):
+
+        with SqliteDict(self.filename, 'objects', autocommit=True, backend='direct') as d:
+            d.conn.batch_size = 3
+            d.update(dict(('k%02d' % i, i) for i in range(10)))
+            self.assertEqual(d.values(), range(10))
+
+
+    def test_concurrent_readers(self):
+
+        with SqliteDict(self.filename, 'objects', autocommit=True, backend='direct') as d:
+            d.update(dict(('k%d' % i, i) for i in range(100)))
+
+            errors = []
+            def reader():
+                try:
+                    for i in range(100):
+                        assert d['k%d' % i] == i
+                except Exception as err:
+                    errors.append(err)
+
+            threads = [threading.Thread(target=reader) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            self.assertEqual(errors, [])
+            # the connections of finished threads are closed
+            self.assertEqual(self.wait_connections(d, 1), 1)
+
+
+    def test_thread_connection_closed(self):
+
+        with SqliteDict(self.filename, 'objects', autocommit=True, backend='direct') as d:
+            connections = list()
+            thread = threading.Thread(target=lambda: connections.append(d.conn.connection()))
+            thread.start()
+            thread.join()
+
+            self.assertEqual(self.wait_connections(d, 1), 1)
+            for _ in range(100):
+                try:
+                    connections[0].execute('SELECT 1')
+                except sqlite3.ProgrammingError:
+                    break
+                time.sleep(0.01)
+            else:
+                self.fail('The connection of finished thread is not closed')
+            self.assertEqual(d.conn.select_one('SELECT 1'), (1,))
+
+
+    def test_execute_batch(self):
+
+        for backend in ('direct', 'multithread'):
+            with SqliteDict(self.filename, backend, autocommit=True, backend=backend) as d:
+                ADD_ITEM = 'REPLACE INTO %s (key, value) VALUES (?, ?)' % d.tablename
+                d['k1'] = 1
+                d.conn.execute_batch([
+                    ('DELETE FROM %s WHERE key = ?' % d.tablename, ('k1',)),
+                    (ADD_ITEM, ('k2', encode(2))),
+                ])
+                self.assertEqual(d.keys(), ['k2'])
+
+                # the failed batch is rolled back
+                self.assertRaises(Exception, d.conn.execute_batch, [
+                    (ADD_ITEM, ('k3', encode(3))),
+                    ('INSERT INTO unknown VALUES (?)', (1,)),
+                ])
+                self.assertEqual(d.keys(), ['k2'])
+
+
+    def test_transaction(self):
+
+        for backend in ('direct', 'multithread'):
+            with SqliteDict(self.filename, backend, autocommit=True, backend=backend) as d:
+                d['k1'] = 1
+
+                def move(cursor):
+                    value, = cursor.execute('SELECT value FROM %s WHERE key = ?' % d.tablename, ('k1',)).fetchone()
+                    cursor.execute('DELETE FROM %s WHERE key = ?' % d.tablename, ('k1',))
+                    cursor.execute('INSERT INTO %s (key, value) VALUES (?, ?)' % d.tablename, ('k2', value))
+
+                d.conn.transaction(move)
+                self.assertEqual(d.items(), [('k2', 1)])
+
+                # the failed transaction is rolled back
+                def fail(cursor):
+                    cursor.execute('DELETE FROM %s' % d.tablename)
+                    cursor.execute('INSERT INTO unknown VALUES (?)', (1,))
+
+                self.assertRaises(sqlite3.OperationalError, d.conn.transaction, fail)
+                self.assertEqual(d.keys(), ['k2'])